@@ -3,16 +3,14 @@ from flask import Flask, render_template, redirect, url_for, flash, request , js
 from config import Config
 from models import AgencyRating, AgencyStats, db, User, TourPackage, HomeImage , Booking 
 from forms import RegistrationForm, LoginForm, TourPackageForm, AdminLoginForm, EditProfileForm
-from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_migrate import Migrate
-from werkzeug.utils import secure_filename
-from PIL import Image
 import os
 import secrets
+from types import SimpleNamespace
 from datetime import date, timedelta
 from forms import CustomTripForm, DeleteTripForm
-from models import CustomTrip , Coupon 
+from models import CustomTrip
 from flask_socketio import SocketIO, emit, join_room, leave_room
 # app.py (at the top with other imports)
 from flask_socketio import SocketIO, emit, join_room, leave_room
@@ -23,14 +21,31 @@ from forms import RegistrationForm, LoginForm, TourPackageForm, AdminLoginForm,
 from models import RatingReplyForm as RatingReplyModel 
 # Using APScheduler or similar
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Response, g, stream_template, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user, login_user, logout_user, login_required
 from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-import atexit
 from config import Config 
-from models import db , Refund 
+from models import db , Refund , PENDING_BOOKING_TTL
+from expiry import init_expiry_scheduler
+from reservations import reserve_seats, resync_reserved_members, SeatsUnavailable
+from coupons import coupon_index, redeem_for_booking, uses_by, CouponUnavailable
+from search import search_packages, build_search_index, SORT_OPTIONS, DEFAULT_SORT
+from cache import cache
+from chat_writer import chat_writer
+from chat_sessions import chat_sessions
+from images import image_pipeline
+from blobs import blob_store, init_blob_gc
+from assets import assets
+from passwords import passwords, PasswordHashingBusy
+from identity import user_identity
+from metrics import metrics
+from database import configure_engine_options, init_database
+from loaders import with_profile
+from query_budget import query_budget
+from pagination import encode_cursor, decode_cursor, keyset_after
+from exports import iter_export, ExportError, EXPORTABLE, EXPORT_FORMATS
+import click
 
 
 
@@ -38,54 +53,15 @@ app = Flask(__name__)
 app.config.from_object(Config)
 
 login_manager = LoginManager(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-def cleanup_expired_bookings():
-    """Remove bookings that have been pending for more than 1 hour"""
-    with app.app_context():  # Important: use app context
-        try:
-            expiration_time = datetime.utcnow() - timedelta(hours=1)
-            expired_bookings = Booking.query.filter(
-                Booking.payment_status == 'Pending',
-                Booking.created_at < expiration_time
-            ).all()
-            
-            for booking in expired_bookings:
-                db.session.delete(booking)
-            
-            db.session.commit()
-            print(f"Cleaned up {len(expired_bookings)} expired pending bookings")
-        except Exception as e:
-            print(f"Error cleaning up expired bookings: {e}")
-
-# Initialize scheduler
-scheduler = BackgroundScheduler()
-scheduler.add_job(
-    func=cleanup_expired_bookings,
-    trigger=IntervalTrigger(hours=1),
-    id='cleanup_job',
-    name='Clean up expired bookings every 1 hour',
-    replace_existing=True
+# With a message queue every server process shares the same rooms, so emits to
+# admin_room and user_<id> reach clients connected to any process
+socketio = SocketIO(
+    app,
+    cors_allowed_origins=app.config['SOCKETIO_CORS_ORIGINS'],
+    async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+    message_queue=app.config['SOCKETIO_MESSAGE_QUEUE']
 )
 
-# Start the scheduler
-try:
-    scheduler.start()
-    print("✅ Background scheduler started for booking cleanup")
-except Exception as e:
-    print(f"❌ Error starting scheduler: {e}")
-
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
-
-def is_booking_expired(booking):
-    """Check if a pending booking has expired (more than 1 hour old)"""
-    if booking.payment_status != 'Pending':
-        return False
-
-    expiration_time = datetime.utcnow() - timedelta(hours=1)
-    return booking.created_at < expiration_time
-
 # Upload folder setup
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static/uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -93,15 +69,114 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB max
 
 # Extensions
+configure_engine_options(app)
 db.init_app(app)
+init_database(app, db)
+cache.init_app(app)
+blob_store.init_app(app)
+image_pipeline.init_app(app)
+assets.init_app(app)
+chat_writer.init_app(app)
+chat_sessions.init_app(app)
+user_identity.init_app(app)
+metrics.init_app(app)
+coupon_index.init_app(app)
 migrate = Migrate(app, db)
-bcrypt = Bcrypt(app)
+passwords.init_app(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# Expired pending bookings are purged in the background, never on the request path
+if app.config['BOOKING_CLEANUP_ENABLED']:
+    try:
+        init_expiry_scheduler(app)
+    except Exception as e:
+        app.logger.error("Error starting booking cleanup scheduler: %s", e)
+
+if app.config['BLOB_GC_ENABLED']:
+    try:
+        init_blob_gc(app)
+    except Exception as e:
+        app.logger.error("Error starting upload garbage collector: %s", e)
+
+@app.cli.command('resync-seats')
+def resync_seats_command():
+    """Rebuild TourPackage.reserved_members from the bookings table."""
+    count = resync_reserved_members()
+    print(f"Resynced seat counters for {count} packages")
+
+@app.cli.command('build-search-index')
+def build_search_index_command():
+    """Create the full-text/trigram index used by tour package search and fill duration_days."""
+    dialect = build_search_index()
+    print(f"Search index built for {dialect}")
+
+@app.cli.command('export')
+@click.argument('name', type=click.Choice(sorted(EXPORTABLE)))
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='csv')
+@click.option('--since-id', type=int, help='Only rows with a larger id.')
+@click.option('--since', type=click.DateTime(), help='Only rows created at or after this time.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), required=True)
+def export_command(name, fmt, since_id, since, output):
+    """Export bookings, refunds or custom trips to CSV/Parquet in constant memory."""
+    try:
+        chunks = iter_export(name, fmt, since_id=since_id, since=since)
+    except ExportError as e:
+        raise click.ClickException(str(e))
+    with open(output, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+    print(f"Exported {name} to {output}")
+
+@app.cli.command('reconcile-agency-stats')
+def reconcile_agency_stats_command():
+    """Recompute AgencyStats totals and histogram from agency_ratings."""
+    stats = AgencyStats.reconcile()
+    db.session.commit()
+    cache.invalidate('home', 'agency_stats')
+    print(f"Agency stats: {stats.total_ratings} ratings, average {stats.average_rating:.2f}")
+
+@app.cli.command('resync-chat-unread')
+def resync_chat_unread_command():
+    """Rebuild ChatSession.unread_by_admin from the messages table."""
+    ChatSession.resync_unread_counters()
+    db.session.commit()
+    print("Chat unread counters resynced")
+
+@app.cli.command('merge-chat-sessions')
+def merge_chat_sessions_command():
+    """Merge duplicate active chat sessions so the one-active-per-user index can be built."""
+    merged_users = [user_id for (user_id,) in db.session.query(ChatSession.user_id).filter(
+        ChatSession.is_active.is_(True)
+    ).group_by(ChatSession.user_id).having(db.func.count(ChatSession.id) > 1)]
+    removed = ChatSession.merge_duplicate_active()
+    db.session.commit()
+    chat_sessions.forget(*merged_users)  # Reaches the web workers with a shared registry
+    print(f"Merged {removed} duplicate chat sessions")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint static files and precompress CSS/JS; run at deploy time."""
+    manifest = assets.write_manifest()
+    print(f"Fingerprinted {len(manifest)} static files into {assets.manifest_path}")
+
+@app.cli.command('resync-blobs')
+def resync_blobs_command():
+    """Rebuild upload reference counts from the tables that use them."""
+    blob_store.resync()
+    db.session.commit()
+    print("Upload reference counts resynced")
+
+@app.cli.command('gc-blobs')
+def gc_blobs_command():
+    """Remove uploads that have been unreferenced for longer than the grace period."""
+    removed = blob_store.collect_garbage()
+    print(f"Removed {removed} unreferenced uploads")
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # A cached snapshot; views that modify the user call current_user.to_user()
+    return user_identity.load(int(user_id))
 
 # =======================
 # User-Facing Routes
@@ -109,8 +184,14 @@ def load_user(user_id):
 
 @app.route('/')
 def home():
+    home_image_filename, home_image_variants = cache.get_or_set('home', 'image', current_home_image)
+    return render_template('home.html', home_image_filename=home_image_filename,
+                           home_image_variants=home_image_variants)
+
+def current_home_image():
+    """(filename, variants) of the homepage wallpaper, or (None, None)"""
     home_image = HomeImage.query.first()
-    return render_template('home.html', home_image=home_image)
+    return (home_image.filename, home_image.image_variants) if home_image else (None, None)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -118,7 +199,7 @@ def register():
         return redirect(url_for('home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_password = passwords.hash(form.password.data)
         user = User(username=form.username.data, email=form.email.data, password=hashed_password)
         db.session.add(user)
         db.session.commit()
@@ -126,6 +207,19 @@ def register():
         return redirect(url_for('login'))
     return render_template('register.html', form=form)
 
+def check_password(user, password):
+    """Verify a login off the request thread, upgrading the stored hash if its parameters changed"""
+    ok, new_hash = passwords.verify(user.password if user else None, password)
+    if ok and new_hash:
+        user.password = new_hash
+        db.session.commit()
+    return ok
+
+@app.errorhandler(PasswordHashingBusy)
+def password_hashing_busy(e):
+    flash("We are handling a lot of sign-ins right now. Please try again in a moment.", "warning")
+    return redirect(request.url), 303
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -133,7 +227,7 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if check_password(user, form.password.data):
             login_user(user)
             flash("Login successful!", "success")
             return redirect(url_for('user_dashboard'))
@@ -147,12 +241,9 @@ def login():
 def add_tour_package():
     form = TourPackageForm()
     if form.validate_on_submit():
-        # Handle image upload
+        # Handle image upload; variants are generated after the commit
         image_file = form.image_file.data
-        filename = None
-        if image_file:
-            filename = secure_filename(image_file.filename)
-            image_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        filename = image_pipeline.save_upload(image_file) if image_file else None
 
         # Create new tour package
         package = TourPackage(
@@ -173,6 +264,9 @@ def add_tour_package():
 
         db.session.add(package)
         db.session.commit()
+        if filename:
+            image_pipeline.submit('package', package.id, filename)
+        cache.invalidate('catalog')
         flash('Tour package added successfully!', 'success')
         return redirect(url_for('admin_tour_packages'))
 
@@ -181,7 +275,6 @@ def add_tour_package():
 @app.route('/user-dashboard')
 @login_required
 def user_dashboard():
-    cleanup_expired_bookings()
     if current_user.is_admin:
         flash("Redirected to admin dashboard.", "info")
         return redirect(url_for('dashboard'))
@@ -189,47 +282,49 @@ def user_dashboard():
 
 @app.route('/tour-packages')
 def tour_packages():
-    cleanup_expired_bookings()
-    destination = request.args.get('destination')
-    price_range = request.args.get('price')
-    duration = request.args.get('duration')
-    packages = TourPackage.query
-    if destination:
-        packages = packages.filter(TourPackage.location.ilike(f"%{destination}%"))
-    if price_range:
-        min_price, max_price = map(float, price_range.split('-'))
-        packages = packages.filter(TourPackage.price.between(min_price, max_price))
-    if duration:
-        packages = packages.filter(TourPackage.duration.ilike(f"%{duration}%"))
-    packages = packages.all()
-    return render_template('tour_packages.html', packages=packages)
+    filters = {
+        'q': request.args.get('q') or request.args.get('destination', ''),
+        'price': request.args.get('price', ''),
+        'duration': request.args.get('duration', ''),
+        'sort': request.args.get('sort', DEFAULT_SORT),
+    }
+    after = request.args.get('after', '')
+    cache_key = '|'.join([filters['q'], filters['price'], filters['duration'], filters['sort'], after])
+
+    def run_search():
+        page = search_packages(
+            query_text=filters['q'],
+            price_range=filters['price'],
+            duration_range=filters['duration'],
+            sort=filters['sort'],
+            after=after or None
+        )
+        return [p.id for p in page.packages], page.next_cursor
+
+    # Only the ids are cached; rows and slot counts are re-read by primary key
+    package_ids, next_cursor = cache.get_or_set('catalog', cache_key, run_search)
+    packages_by_id = {p.id: p for p in TourPackage.query.filter(TourPackage.id.in_(package_ids))} if package_ids else {}
+    packages = [packages_by_id[i] for i in package_ids if i in packages_by_id]
+    packages = TourPackage.load_available_slots(packages)
+    return render_template('tour_packages.html', packages=packages, filters=filters,
+                           sort_options=SORT_OPTIONS, next_cursor=next_cursor)
 
 @app.route("/book_package/<int:package_id>", methods=["POST"])
 @login_required
 def book_package(package_id):
-    cleanup_expired_bookings()
     data = request.get_json()
     members_requested = int(data.get("members", 0))
 
     package = TourPackage.query.get_or_404(package_id)
 
-    if members_requested > package.available_slots:
+    if not package.can_book(members_requested):
         return jsonify({"success": False, "message": f"Not enough slots! Only {package.available_slots} left."}), 400
 
-    # Calculate total amount
-    total_amount = package.price * members_requested
-
-    # Create booking with PENDING status (don't update booked_members yet)
-    booking = Booking(
-        user_id=current_user.id, 
-        package_id=package.id, 
-        members=members_requested,
-        total_amount=total_amount,
-        final_amount=total_amount,
-        payment_status='Pending'  # Set as pending until payment
-    )
-    db.session.add(booking)
-    db.session.commit()
+    # Atomic check-and-reserve; the booking stays PENDING until payment
+    try:
+        booking = reserve_seats(package, members_requested, current_user.id)
+    except SeatsUnavailable:
+        return jsonify({"success": False, "message": f"Not enough slots! Only {package.available_slots} left."}), 400
 
     return jsonify({
         "success": True, 
@@ -274,22 +369,15 @@ def profile():
 # =======================
 # Profile Editing
 # =======================
-def save_picture(form_picture):
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(app.root_path, 'static/uploads', picture_fn)
-    output_size = (200, 200)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
-    return picture_fn
+def save_picture(user, form_picture):
+    """Store a new profile picture; its resized variants are queued after the commit"""
+    return image_pipeline.replace(user, 'avatar', form_picture)
 
 # Admin: Manage tour packages
 @app.route('/admin/tour-packages')
 @login_required
 def admin_tour_packages():
-    packages = TourPackage.query.all()
+    packages = TourPackage.load_available_slots(TourPackage.query.all())
     return render_template('admin_tour_packages.html', packages=packages)
 
 @app.route('/edit-profile', methods=['GET', 'POST'])
@@ -297,21 +385,20 @@ def admin_tour_packages():
 def edit_profile():
     form = EditProfileForm(obj=current_user)
     if form.validate_on_submit():
+        user = current_user.to_user()
+        picture_file = None
         if form.image_file.data and hasattr(form.image_file.data, 'filename'):
-            if current_user.image_file != 'default.png':
-                old_path = os.path.join(app.root_path, 'static/uploads', current_user.image_file)
-                if os.path.exists(old_path):
-                    os.remove(old_path)
-            picture_file = save_picture(form.image_file.data)
-            current_user.image_file = picture_file
-        current_user.username = form.username.data
-        current_user.email = form.email.data
-        current_user.gender = form.gender.data
-        current_user.age = form.age.data
-        current_user.occupation = form.occupation.data
-        current_user.address = form.address.data
-        current_user.phone = form.phone.data
+            picture_file = save_picture(user, form.image_file.data)
+        user.username = form.username.data
+        user.email = form.email.data
+        user.gender = form.gender.data
+        user.age = form.age.data
+        user.occupation = form.occupation.data
+        user.address = form.address.data
+        user.phone = form.phone.data
         db.session.commit()
+        if picture_file and not user.image_variants:
+            image_pipeline.submit('avatar', user.id, picture_file)
         flash('Your profile has been successfully updated!', 'success')
         return redirect(url_for('edit_profile'))
     return render_template('edit_profile.html', form=form)
@@ -321,24 +408,101 @@ def edit_profile():
 # =======================
 @app.route('/dashboard')
 @login_required
+@query_budget(2)
 def dashboard():
     if not current_user.is_admin:
         flash("Access Denied: Admins only!", "danger")
         return redirect(url_for('home'))
-    users = User.query.filter_by(is_admin=False).all()
-    return render_template('dashboard.html', users=users)
+    # The dashboard only links to the user list, it never renders it
+    return render_template('dashboard.html')
+
+ADMIN_BOOKINGS_PAGE_SIZE = 50
+BOOKING_STATUSES = ['Pending', 'Completed', 'Failed']
+PAYMENT_METHODS = ['bkash', 'nagad', 'rocket', 'bank_transfer', 'card']
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+def filtered_bookings_query(filters):
+    """Bookings matching the admin filters, newest first (expired holds excluded)"""
+    query = with_profile(Booking.query, 'booking_list').filter(db.not_(Booking.expired_clause()))
+    if filters['status'] in BOOKING_STATUSES:
+        query = query.filter(Booking.payment_status == filters['status'])
+    if filters['method'] in PAYMENT_METHODS:
+        query = query.filter(Booking.payment_method == filters['method'])
+    if filters['date_from']:
+        query = query.filter(Booking.created_at >= filters['date_from'])
+    if filters['date_to']:
+        query = query.filter(Booking.created_at < filters['date_to'] + timedelta(days=1))
+    return query.order_by(Booking.created_at.desc(), Booking.id.desc())
 
 @app.route('/admin/bookings')
 @login_required
+@query_budget(5)
 def admin_bookings():
     if not current_user.is_admin:
         flash("Access Denied: Admins only!", "danger")
         return redirect(url_for('home'))
 
-    # Fetch all bookings (standard + custom)
-    bookings = Booking.query.order_by(Booking.created_at.desc()).all()
+    filters = {
+        'status': request.args.get('status', ''),
+        'method': request.args.get('method', ''),
+        'date_from': parse_date_arg('date_from'),
+        'date_to': parse_date_arg('date_to'),
+    }
+    query = filtered_bookings_query(filters)
+    filter_args = {
+        'status': filters['status'],
+        'method': filters['method'],
+        'date_from': request.args.get('date_from', ''),
+        'date_to': request.args.get('date_to', ''),
+    }
 
-    return render_template('admin_bookings.html', bookings=bookings)
+    # Streamed mode renders every matching row without buffering the page
+    if request.args.get('stream') == '1':
+        return Response(stream_with_context(stream_template(
+            'admin_bookings.html', bookings=query.yield_per(500), streaming=True,
+            filter_args=filter_args, statuses=BOOKING_STATUSES, methods=PAYMENT_METHODS
+        )))
+
+    # Keyset pagination on (created_at, id)
+    position = decode_cursor(request.args.get('after'), 2, (datetime, int))
+    if position:
+        query = query.filter(keyset_after(Booking.created_at, position[0], Booking.id, position[1], descending=True))
+    rows = query.limit(ADMIN_BOOKINGS_PAGE_SIZE + 1).all()
+    bookings = rows[:ADMIN_BOOKINGS_PAGE_SIZE]
+    next_cursor = None
+    if len(rows) > ADMIN_BOOKINGS_PAGE_SIZE:
+        next_cursor = encode_cursor(bookings[-1].created_at, bookings[-1].id)
+
+    return render_template('admin_bookings.html', bookings=bookings, next_cursor=next_cursor,
+                           filter_args=filter_args, statuses=BOOKING_STATUSES, methods=PAYMENT_METHODS)
+
+@app.route('/admin/export/<name>')
+@login_required
+def admin_export(name):
+    """Stream a CSV/Parquet export of bookings, refunds or custom trips."""
+    if not current_user.is_admin:
+        flash("Access Denied: Admins only!", "danger")
+        return redirect(url_for('home'))
+
+    fmt = request.args.get('format', 'csv')
+    since_id = request.args.get('since_id', type=int)
+    since = request.args.get('since')
+    try:
+        since = datetime.fromisoformat(since) if since else None
+        chunks = iter_export(name, fmt, since_id=since_id, since=since)
+    except ValueError as e:  # ExportError or a malformed timestamp
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    mimetype = 'application/vnd.apache.parquet' if fmt == 'parquet' else 'text/csv'
+    filename = f"{name}-{datetime.utcnow():%Y%m%d%H%M%S}.{fmt}"
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 @app.route('/admin/booking/<int:booking_id>')
 @login_required
@@ -358,7 +522,7 @@ def admin_login():
     form = AdminLoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data, is_admin=True).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if check_password(user, form.password.data):
             login_user(user)
             flash("Admin login successful!", "success")
             return redirect(url_for('dashboard'))
@@ -368,6 +532,7 @@ def admin_login():
 
 @app.route('/admin/custom-trips')
 @login_required
+@query_budget(3)
 def admin_custom_trips():
     if not current_user.is_admin:
         flash("Access Denied: Admins only!", "danger")
@@ -376,7 +541,7 @@ def admin_custom_trips():
     # Get filter from query params (default = show all except Confirmed)
     status_filter = request.args.get("status")
 
-    query = CustomTrip.query
+    query = with_profile(CustomTrip.query, 'custom_trip_list')
 
     # Only allow Pending, Approved, Rejected
     allowed_statuses = ["Pending", "Approved", "Rejected"]
@@ -436,11 +601,12 @@ def user_details(user_id):
 
 @app.route('/manage-users')
 @login_required
+@query_budget(2)
 def manage_users():
     if not current_user.is_admin:
         flash("Access Denied!", "danger")
         return redirect(url_for('home'))
-    users = User.query.filter_by(is_admin=False).all()
+    users = with_profile(User.query, 'user_list').filter_by(is_admin=False).all()
     return render_template('manage_users.html', users=users)
 
 @app.route('/delete-user/<int:user_id>', methods=['POST'])
@@ -453,8 +619,14 @@ def delete_user(user_id):
     if user.is_admin:
         flash("You cannot delete another admin.", "danger")
         return redirect(url_for('dashboard'))
+    # Take the user's ratings out of the agency totals before they go
+    for rating in user.agency_ratings:
+        update_agency_stats(rating.rating, None)
+        db.session.delete(rating)
+    image_pipeline.release(user.image_file)
     db.session.delete(user)
     db.session.commit()
+    chat_sessions.forget(user.id)
     flash(f"User {user.username} deleted successfully.", "success")
     return redirect(url_for('dashboard'))
 
@@ -467,43 +639,43 @@ def admin_chat_manager():
         flash("Access Denied: Admins only!", "danger")
         return redirect(url_for('home'))
 
-    # Get all active chat sessions with their users and unread counts
-    chat_sessions = ChatSession.query.filter_by(is_active=True).order_by(ChatSession.updated_at.desc()).all()
+    # Get all active chat sessions with their users, then unread counts and
+    # last messages for all of them in grouped queries
+    inbox_sessions = with_profile(ChatSession.query, 'chat_session_list').filter_by(
+        is_active=True
+    ).order_by(ChatSession.updated_at.desc()).all()
+    ChatSession.load_inbox(inbox_sessions, use_counter=app.config['CHAT_UNREAD_COUNTER'])
 
     # Calculate total unread messages for the admin dashboard
-    total_unread = 0
+    total_unread = sum(session.unread_count for session in inbox_sessions)
     selected_user = None
     selected_session = None
     messages = []
-
-    for session in chat_sessions:
-        session.unread_count = session.get_unread_count(for_admin=True)
-        total_unread += session.unread_count
+    older_cursor = None
 
     # Check if a specific user chat is requested
     user_id = request.args.get('user_id', type=int)
     if user_id:
         selected_user = User.query.get_or_404(user_id)
         # Find or create a chat session for this user
-        selected_session = ChatSession.query.filter_by(user_id=user_id, is_active=True).first()
-        if not selected_session:
-            selected_session = ChatSession(user_id=user_id)
-            db.session.add(selected_session)
-            db.session.commit()
+        selected_session = chat_sessions.active_session(user_id)
 
-        # Get messages for this session
-        messages = Message.query.filter_by(session_id=selected_session.id).order_by(Message.timestamp.asc()).all()
+        # Newest page of messages; older ones are fetched on demand
+        chat_writer.flush()
+        messages, older_cursor = load_chat_page(selected_session.id)
 
         # Mark messages as read when admin opens the chat
         Message.query.filter_by(session_id=selected_session.id, is_admin_message=False, is_read=False).update({'is_read': True})
+        selected_session.unread_by_admin = 0
         db.session.commit()
 
     return render_template('admin_chat_manager.html', 
-                         chat_sessions=chat_sessions, 
+                         chat_sessions=inbox_sessions,
                          total_unread=total_unread,
                          selected_user=selected_user,
                          selected_session=selected_session,
-                         messages=messages)
+                         messages=messages,
+                         older_cursor=older_cursor)
 # app.py (add with other routes)
 @app.route('/user/chat')
 @login_required
@@ -512,16 +684,76 @@ def user_chat():
         return redirect(url_for('admin_chat_manager'))
 
     # Find or create a chat session for the current user
-    session = ChatSession.query.filter_by(user_id=current_user.id, is_active=True).first()
-    if not session:
-        session = ChatSession(user_id=current_user.id)
-        db.session.add(session)
-        db.session.commit()
+    session = chat_sessions.active_session(current_user.id)
 
-    messages = Message.query.filter_by(session_id=session.id).order_by(Message.timestamp.asc()).all()
+    chat_writer.flush()
+    messages, older_cursor = load_chat_page(session.id)
     unread_count = session.get_unread_count(for_admin=False) # Messages user hasn't read
 
-    return render_template('user_chat.html', session=session, messages=messages, unread_count=unread_count)
+    return render_template('user_chat.html', session=session, messages=messages,
+                           older_cursor=older_cursor, unread_count=unread_count)
+
+
+CHAT_PAGE_SIZE = 50
+
+def load_chat_page(session_id, before=None, limit=CHAT_PAGE_SIZE):
+    """Newest `limit` messages before the (timestamp, id) cursor, oldest first, plus the cursor for the page before"""
+    query = Message.query.filter(Message.session_id == session_id)
+    position = decode_cursor(before, 2, (datetime, int))
+    if position:
+        query = query.filter(keyset_after(Message.timestamp, position[0], Message.id, position[1], descending=True))
+    rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    older_cursor = encode_cursor(page[-1].timestamp, page[-1].id) if len(rows) > limit else None
+    return list(reversed(page)), older_cursor
+
+def serialize_message(message, sender_name):
+    return {
+        # Snowflake ids exceed 2**53, so clients get them as strings and compare as BigInt
+        'message_id': str(message.id),
+        'session_id': message.session_id,
+        'sender_name': sender_name,
+        'is_admin': message.is_admin_message,
+        'content': message.content,
+        'timestamp': message.timestamp.strftime("%Y-%m-%d %H:%M"),
+        'is_read': message.is_read
+    }
+
+def serialize_history(session, messages):
+    """Serialize messages with the same sender names live emits use, in one username lookup at most"""
+    sender_ids = {m.sender_id for m in messages if m.sender_id is not None and m.sender_id != session.user_id}
+    names = dict(db.session.query(User.id, User.username).filter(User.id.in_(sender_ids))) if sender_ids else {}
+    names[session.user_id] = session.user.username
+
+    def sender_name(message):
+        if message.sender_id in names:
+            return names[message.sender_id]
+        # Written before senders were stored: only the user's own messages can be attributed
+        return 'Admin' if message.is_admin_message else session.user.username
+
+    return [serialize_message(m, sender_name(m)) for m in messages]
+
+def can_view_chat(session):
+    return current_user.is_admin or session.user_id == current_user.id
+
+@app.route('/chat/<int:session_id>/messages')
+@login_required
+def chat_history(session_id):
+    """JSON history: ?before=<cursor> pages backwards, ?since_id=<id> returns the delta after a message"""
+    session = ChatSession.query.get_or_404(session_id)
+    if not can_view_chat(session):
+        return jsonify({'success': False, 'message': 'Access denied.'}), 403
+
+    chat_writer.flush()
+    since_id = request.args.get('since_id', type=int)
+    if since_id is not None:
+        messages = Message.query.filter(
+            Message.session_id == session.id, Message.id > since_id
+        ).order_by(Message.id.asc()).limit(CHAT_PAGE_SIZE * 4).all()
+        return jsonify({'success': True, 'messages': serialize_history(session, messages)})
+
+    messages, older_cursor = load_chat_page(session.id, before=request.args.get('before'))
+    return jsonify({'success': True, 'messages': serialize_history(session, messages), 'older_cursor': older_cursor})
 
 
 # Admin: Edit tour package
@@ -554,16 +786,14 @@ def edit_tour_package(package_id):
         package.tour_type = form.tour_type.data
 
         # Handle image upload
+        filename = None
         if form.image_file.data:
-            if package.image_filename:
-                old_path = os.path.join(app.root_path, 'static/uploads', package.image_filename)
-                if os.path.exists(old_path):
-                    os.remove(old_path)
-            filename = secure_filename(form.image_file.data.filename)
-            form.image_file.data.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            package.image_filename = filename
+            filename = image_pipeline.replace(package, 'package', form.image_file.data)
 
         db.session.commit()
+        if filename and not package.image_variants:
+            image_pipeline.submit('package', package.id, filename)
+        cache.invalidate('catalog')
         flash("Tour package updated successfully!", "success")
         return redirect(url_for('admin_tour_packages'))
 
@@ -575,12 +805,10 @@ def edit_tour_package(package_id):
 def delete_tour_package(package_id):
     package = TourPackage.query.get_or_404(package_id)
     # Delete image file if exists
-    if package.image_filename:
-        image_path = os.path.join(app.static_folder, 'uploads', package.image_filename)
-        if os.path.exists(image_path):
-            os.remove(image_path)
+    image_pipeline.release(package.image_filename)
     db.session.delete(package)
     db.session.commit()
+    cache.invalidate('catalog')
     flash('Tour package deleted successfully!', 'success')
     return redirect(url_for('admin_tour_packages'))
 
@@ -614,11 +842,13 @@ def agency_feedback():
     if form.validate_on_submit():
         if existing_rating:
             # Update existing rating
+            old_rating = existing_rating.rating
             existing_rating.rating = form.rating.data
             existing_rating.feedback = form.feedback.data
             flash('Your feedback has been updated!', 'success')
         else:
             # Create new rating
+            old_rating = None
             rating = AgencyRating(
                 user_id=current_user.id,
                 rating=form.rating.data,
@@ -627,8 +857,8 @@ def agency_feedback():
             db.session.add(rating)
             flash('Thank you for your feedback!', 'success')
         
-        # Update agency stats
-        update_agency_stats()
+        # Update agency stats in the same transaction
+        update_agency_stats(old_rating, form.rating.data)
         db.session.commit()
         return redirect(url_for('agency_feedback'))
     
@@ -644,13 +874,14 @@ def agency_feedback():
 
 @app.route('/admin/agency-feedback')
 @login_required
+@query_budget(4)
 def admin_agency_feedback():
     if not current_user.is_admin:
         flash("Access Denied: Admins only!", "danger")
         return redirect(url_for('home'))
     
     # Get all ratings with their users and replies
-    all_ratings = AgencyRating.query.order_by(AgencyRating.created_at.desc()).all()
+    all_ratings = with_profile(AgencyRating.query, 'rating_list').order_by(AgencyRating.created_at.desc()).all()
     
     return render_template('admin_agency_feedback.html', all_ratings=all_ratings)
 
@@ -707,76 +938,52 @@ def user_reply_to_feedback(rating_id):
     return render_template('user_reply_to_feedback.html', form=form, rating=rating)
 
 # Helper function to update agency stats
-def update_agency_stats():
-    all_ratings = AgencyRating.query.all()
-    
-    if all_ratings:
-        total_ratings = len(all_ratings)
-        average_rating = sum(r.rating for r in all_ratings) / total_ratings
-        
-        # Get or create agency stats
-        stats = AgencyStats.query.first()
-        if not stats:
-            stats = AgencyStats()
-            db.session.add(stats)
-        
-        stats.total_ratings = total_ratings
-        stats.average_rating = round(average_rating, 1)
-    else:
-        # No ratings yet
-        stats = AgencyStats.query.first()
-        if stats:
-            stats.total_ratings = 0
-            stats.average_rating = 0.0
-    
-    db.session.commit()
-    return stats
+def update_agency_stats(old_rating=None, new_rating=None):
+    """Apply one rating change to the running totals (no rescan of agency_ratings); caches drop on commit"""
+    AgencyStats.apply_rating_change(old_rating, new_rating)
+    cache.invalidate_on_commit(db.session, 'home', 'agency_stats')
+
+def load_agency_stats():
+    """Read-only snapshot of the agency stats; a missing row reads as no ratings"""
+    stats = AgencyStats.query.order_by(AgencyStats.id).first()
+    if not stats:
+        return SimpleNamespace(total_ratings=0, average_rating=0.0,
+                               histogram=[(stars, 0) for stars in range(5, 0, -1)])
+    return SimpleNamespace(
+        total_ratings=stats.total_ratings or 0,
+        average_rating=stats.average_rating or 0.0,
+        histogram=stats.histogram
+    )
 
 # Function to get current agency stats (for templates)
-@app.context_processor
-def utility_processor():
-    def get_agency_stats():
-        stats = AgencyStats.query.first()
-        if not stats:
-            stats = AgencyStats()
-            db.session.add(stats)
-            db.session.commit()
-        return stats
-    return dict(get_agency_stats=get_agency_stats)
-
-
 def get_agency_stats():
-    stats = AgencyStats.query.first()
-    if not stats:
-        stats = AgencyStats()
-        db.session.add(stats)
-        db.session.commit()
-    return stats
-
-
+    """Memoized per request, backed by a short-TTL process-wide cache; never writes"""
+    if 'agency_stats' not in g:
+        g.agency_stats = cache.get_or_set('agency_stats', 'current', load_agency_stats,
+                                          ttl=app.config['AGENCY_STATS_CACHE_TTL'])
+    return g.agency_stats
 
 @app.context_processor
 def utility_processor():
-    def get_agency_stats():
-        stats = AgencyStats.query.first()
-        if not stats:
-            stats = AgencyStats()
-            db.session.add(stats)
-            db.session.commit()
-        return stats
     return dict(get_agency_stats=get_agency_stats)
 
 
-with app.app_context():
-    try:
-        stats = AgencyStats.query.first()
-        if not stats:
-            stats = AgencyStats()
-            db.session.add(stats)
-            db.session.commit()
-            print("Agency stats initialized")
-    except:
-        print("Could not initialize agency stats (tables might not exist yet)")
+@app.route('/admin/cache-stats')
+@login_required
+def admin_cache_stats():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admins only'}), 403
+    stats = cache.stats()
+    stats['user_identity'] = user_identity.stats()
+    return jsonify(stats)
+
+@app.route('/admin/slow-queries')
+@login_required
+def admin_slow_queries():
+    """The slowest SQL statements seen by this process, normalized, with the route that ran them"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admins only'}), 403
+    return jsonify(metrics.slow_statements())
 
 
 # =======================
@@ -794,24 +1001,26 @@ def admin_home_image():
     if request.method == 'POST':
         file = request.files.get('image_file')
         if file:
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.root_path, 'static/uploads', filename))
-
-            if home_image:
-                old_path = os.path.join(app.root_path, 'static/uploads', home_image.filename)
-                if os.path.exists(old_path):
-                    os.remove(old_path)
-                home_image.filename = filename
-            else:
-                home_image = HomeImage(filename=filename)
-                db.session.add(home_image)
-            
-            db.session.commit()
+            home_image = replace_home_image(home_image, file)
+            cache.invalidate('home')
             flash("Home image updated successfully!", "success")
         return redirect(url_for('admin_home_image'))
 
     return render_template('admin_home_image.html', home_image=home_image)
 
+def replace_home_image(home_image, file):
+    """Store a new homepage wallpaper, commit it and queue its variants"""
+    if home_image:
+        filename = image_pipeline.replace(home_image, 'home', file)
+    else:
+        filename = image_pipeline.save_upload(file)
+        home_image = HomeImage(filename=filename)
+        db.session.add(home_image)
+    db.session.commit()
+    if not home_image.image_variants:
+        image_pipeline.submit('home', home_image.id, filename)
+    return home_image
+
 @app.route('/update-home-image', methods=['POST'])
 @login_required
 def update_home_image():
@@ -821,20 +1030,8 @@ def update_home_image():
 
     file = request.files.get('image_file')
     if file:
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.root_path, 'static/uploads', filename))
-
-        home_image = HomeImage.query.first()
-        if home_image:
-            old_path = os.path.join(app.root_path, 'static/uploads', home_image.filename)
-            if os.path.exists(old_path):
-                os.remove(old_path)
-            home_image.filename = filename
-        else:
-            home_image = HomeImage(filename=filename)
-            db.session.add(home_image)
-
-        db.session.commit()
+        replace_home_image(HomeImage.query.first(), file)
+        cache.invalidate('home')
         flash("Homepage wallpaper updated!", "success")
 
     return redirect(url_for('home'))
@@ -1033,17 +1230,13 @@ def request_refund(booking_id):
         
 @app.route('/admin/refunds')
 @login_required
+@query_budget(3)
 def admin_refunds():
     if not current_user.is_admin:
         flash("Access Denied: Admins only!", "danger")
         return redirect(url_for('home'))
     
-    refunds = Refund.query.options(
-        db.joinedload(Refund.user),
-        db.joinedload(Refund.custom_trip),
-        db.joinedload(Refund.booking).joinedload(Booking.package),
-        db.joinedload(Refund.booking).joinedload(Booking.custom_trip)
-    ).order_by(Refund.request_date.desc()).all()
+    refunds = with_profile(Refund.query, 'refund_list').order_by(Refund.request_date.desc()).all()
     
     return render_template('admin_refunds.html', refunds=refunds)
 
@@ -1090,20 +1283,15 @@ def process_refund(refund_id):
 @app.route('/payment/<int:booking_id>')
 @login_required
 def payment_page(booking_id):
-    # Clean up expired bookings first
-    cleanup_expired_bookings()
-    
     booking = Booking.query.get_or_404(booking_id)
     
-    # Check if booking has expired
-    if booking.payment_status == 'Pending' and is_booking_expired(booking):
-        db.session.delete(booking)
-        db.session.commit()
+    # Expired holds are ignored here and purged by the background job
+    if booking.is_expired():
         flash("Your booking session has expired. Please book again.", "warning")
         return redirect(url_for('tour_packages'))
     
     # Calculate time remaining
-    expiration_time = booking.created_at + timedelta(hours=1)
+    expiration_time = booking.created_at + PENDING_BOOKING_TTL
     time_remaining = expiration_time - datetime.utcnow()
     minutes_remaining = max(0, int(time_remaining.total_seconds() / 60))
     
@@ -1118,17 +1306,22 @@ def apply_coupon():
     booking_id = data.get('booking_id')
     
     booking = Booking.query.get_or_404(booking_id)
-    coupon = Coupon.query.filter_by(code=coupon_code).first()
+    # Served from the in-memory coupon index; limits are enforced again at payment
+    coupon = coupon_index.get(coupon_code)
     
     if not coupon or not coupon.is_valid():
         return jsonify({
             'success': False,
             'message': 'Invalid or expired coupon code'
         })
+    if coupon.per_user_limit is not None and uses_by(coupon.id, current_user.id) >= coupon.per_user_limit:
+        return jsonify({
+            'success': False,
+            'message': 'You have already used this coupon the maximum number of times'
+        })
     
     # Calculate discount
-    discount_amount = (booking.total_amount * coupon.discount_percent) / 100
-    final_amount = booking.total_amount - discount_amount
+    discount_amount, final_amount = coupon.apply(booking.total_amount)
     
     return jsonify({
         'success': True,
@@ -1145,34 +1338,54 @@ def process_payment(booking_id):
     if booking.user_id != current_user.id:
         flash("Access denied.", "danger")
         return redirect(url_for('user_dashboard'))
+
+    if booking.is_expired():
+        flash("Your booking session has expired. Please book again.", "warning")
+        return redirect(url_for('tour_packages'))
     
     payment_method = request.form.get('payment_method')
     transaction_id = request.form.get('transaction_id')
     coupon_code = request.form.get('coupon_code')
     
     # Validate payment method
-    valid_methods = ['bkash', 'nagad', 'rocket', 'bank_transfer', 'card']
-    if payment_method not in valid_methods:
+    if payment_method not in PAYMENT_METHODS:
         flash("Invalid payment method.", "danger")
         return redirect(url_for('payment_page', booking_id=booking_id))
     
-    # Apply coupon if provided
-    if coupon_code:
-        coupon = Coupon.query.filter_by(code=coupon_code).first()
-        if coupon and coupon.is_valid():
-            booking.discount_amount = (booking.total_amount * coupon.discount_percent) / 100
-            booking.final_amount = booking.total_amount - booking.discount_amount
-            booking.coupon_code = coupon_code
-    
-    # Update payment details
+    # Claim the booking first: of two concurrent submits only one moves it to
+    # Completed, so the coupon and the seats are counted once. The claim is
+    # rolled back with everything else if the coupon turns out to be spent.
+    claimed = db.session.execute(
+        db.update(Booking)
+        .where(Booking.id == booking.id, Booking.payment_status != 'Completed')
+        .values(payment_status='Completed', payment_method=payment_method, transaction_id=transaction_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        flash("This booking has already been paid.", "info")
+        return redirect(url_for('user_dashboard'))
     booking.payment_method = payment_method
     booking.transaction_id = transaction_id
     booking.payment_status = 'Completed'
+
+    # Apply coupon if provided; the redemption counters are bumped in this
+    # transaction, so a failed payment never uses up a capped coupon.
+    if coupon_code:
+        try:
+            redeem_for_booking(booking, coupon_code, current_user.id)
+        except CouponUnavailable as e:
+            db.session.rollback()
+            flash(str(e), "warning")
+            return redirect(url_for('payment_page', booking_id=booking_id))
     
     # ✅ ONLY update package slots if it's a standard package booking
-    if booking.package:  # This checks if package is not None
-        package = booking.package
-        package.booked_members += booking.members
+    if booking.package_id is not None:
+        db.session.execute(
+            db.update(TourPackage).where(TourPackage.id == booking.package_id)
+            .values(booked_members=db.func.coalesce(TourPackage.booked_members, 0) + booking.members)
+            .execution_options(synchronize_session=False)
+        )
     
     db.session.commit()
     
@@ -1183,9 +1396,10 @@ def process_payment(booking_id):
 
 # Handle user connecting
 @socketio.on('connect')
+@metrics.track_event('connect')
 def handle_connect():
     if current_user.is_authenticated:
-        print(f"User {current_user.id} connected")
+        app.logger.info("User %s connected", current_user.id)
         # Join a room unique to this user for private messaging
         join_room(f'user_{current_user.id}')
         if current_user.is_admin:
@@ -1197,11 +1411,13 @@ def handle_connect():
 
 # Handle user disconnecting
 @socketio.on('disconnect')
+@metrics.track_event('disconnect')
 def handle_disconnect():
-    print(f"User {current_user.id} disconnected")
+    app.logger.info("User %s disconnected", current_user.id)
 
 # Handle sending a new message
 @socketio.on('send_message')
+@metrics.track_event('send_message')
 def handle_send_message(data):
     """Handles sending a message from either user or admin."""
     if not current_user.is_authenticated:
@@ -1213,51 +1429,30 @@ def handle_send_message(data):
     if not content:
         return
 
-    # Find or create a chat session
+    # Find or create a chat session (a registry hit needs no query)
     if current_user.is_admin:
         # Admin is sending to a specific user
         target_user_id = user_id
-        session = ChatSession.query.filter_by(user_id=target_user_id, is_active=True).first()
-        if not session:
-            # Create a new session if none exists
-            session = ChatSession(user_id=target_user_id)
-            db.session.add(session)
-            db.session.commit()
+        if not target_user_id:
+            return
+        session_id = chat_sessions.active_session_id(target_user_id)
         is_admin_msg = True
         sender_room = f'user_{target_user_id}' # Send to the specific user's room
         receiver_room = 'admin_room' # Also send to all admins for their live view
     else:
         # User is sending to admin
-        session = ChatSession.query.filter_by(user_id=current_user.id, is_active=True).first()
-        if not session:
-            session = ChatSession(user_id=current_user.id)
-            db.session.add(session)
-            db.session.commit()
+        session_id = chat_sessions.active_session_id(current_user.id)
         target_user_id = current_user.id
         is_admin_msg = False
         sender_room = 'admin_room' # Send to all admins
         receiver_room = f'user_{target_user_id}' # Also send back to the user for their live view
 
-    # Create and save the new message
-    new_message = Message(
-        session_id=session.id,
-        is_admin_message=is_admin_msg,
-        content=content
-    )
-    db.session.add(new_message)
-    session.updated_at = datetime.utcnow() # Update the session's last activity
-    db.session.commit()
+    # Queue the message for a batched insert; it already has its final id and
+    # timestamp, and the session's updated_at/unread bump is coalesced there
+    new_message = chat_writer.submit(session_id, is_admin_msg, content, sender_id=current_user.id)
 
     # Prepare data to send back to clients
-    message_data = {
-        'message_id': new_message.id,
-        'session_id': session.id,
-        'sender_name': current_user.username,
-        'is_admin': is_admin_msg,
-        'content': content,
-        'timestamp': new_message.timestamp.strftime("%Y-%m-%d %H:%M"),
-        'is_read': new_message.is_read
-    }
+    message_data = serialize_message(new_message, current_user.username)
 
     # Emit the new message to the relevant rooms
     emit('receive_message', message_data, room=sender_room)
@@ -1266,6 +1461,7 @@ def handle_send_message(data):
 
 # Handle marking messages as read (for admin)
 @socketio.on('mark_messages_read')
+@metrics.track_event('mark_messages_read')
 def handle_mark_read(data):
     """Marks all messages from a user in a session as read."""
     if not current_user.is_authenticated or not current_user.is_admin:
@@ -1278,18 +1474,43 @@ def handle_mark_read(data):
     if session_id:
         session = ChatSession.query.get(session_id)
     elif user_id:
-        session = ChatSession.query.filter_by(user_id=user_id, is_active=True).first()
+        session = ChatSession.query.get(chat_sessions.active_session_id(user_id))
     else:
         return
 
     if session:
         # Mark all unread messages from the user (not admin) as read
+        chat_writer.flush()
         Message.query.filter_by(session_id=session.id, is_admin_message=False, is_read=False).update({'is_read': True})
+        session.unread_by_admin = 0
         db.session.commit()
 
         # Notify the user that their messages have been read (optional)
         emit('messages_read', {'session_id': session.id}, room=f'user_{session.user_id}')
-        print(f"Marked messages read for session {session.id}")
+        app.logger.info("Marked messages read for session %s", session.id)
+
+
+# Reconnecting clients ask only for what they missed
+@socketio.on('sync_messages')
+@metrics.track_event('sync_messages')
+def handle_sync_messages(data):
+    """Emits messages newer than last_seen_id back to the requesting client only."""
+    if not current_user.is_authenticated or not isinstance(data, dict):
+        return
+
+    session = ChatSession.query.get(data.get('session_id'))
+    if not session or not can_view_chat(session):
+        return
+
+    chat_writer.flush()
+    try:
+        last_seen_id = int(data.get('last_seen_id') or 0)
+    except (TypeError, ValueError):
+        return  # Not an id we handed out; the client resyncs from the history endpoint
+    messages = Message.query.filter(
+        Message.session_id == session.id, Message.id > last_seen_id
+    ).order_by(Message.id.asc()).limit(CHAT_PAGE_SIZE * 4).all()
+    emit('messages_delta', {'session_id': session.id, 'messages': serialize_history(session, messages)})
 
 
 # =======================
@@ -1297,4 +1518,5 @@ def handle_mark_read(data):
 # =======================
 # app.py (at the very bottom)
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    # Development server; see wsgi.py for production
+    socketio.run(app, debug=os.environ.get('FLASK_DEBUG', '1') == '1')
\ No newline at end of file
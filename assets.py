@@ -0,0 +1,195 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from flask import abort, request, send_file, url_for
+from werkzeug.security import safe_join
+
+from blobs import is_blob, write_atomic
+
+try:
+    import brotli
+except ImportError:  # Brotli output is optional; gzip is always produced
+    brotli = None
+
+FINGERPRINT_LENGTH = 12
+IMMUTABLE_MAX_AGE = 31536000  # One year
+
+# File types worth precompressing; images are already compressed
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.map'}
+
+# Precompressed siblings, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def fingerprinted_name(filename, digest):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{digest}{ext}"
+
+
+def precompress(path):
+    """Write path.gz (and path.br when brotli is installed) next to a static file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    write_atomic(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(path + '.br', brotli.compress(data, quality=11))
+
+
+class AssetPipeline:
+    """Fingerprinted URLs for everything under the static folder.
+
+    asset_url('css/styles.css') returns /assets/css/styles.<hash>.css. The
+    hashes come from a manifest: ASSET_MANIFEST (written by
+    `flask build-assets` at deploy time, along with .gz/.br files) or, if that
+    is missing, one built at startup. Fingerprinted responses are immutable
+    and carry the hash as their ETag; precompressed files are picked by
+    Accept-Encoding. Content-addressed uploads are already unique, so their
+    plain static URL is used and only the cache headers are added.
+
+    With ASSET_AUTO_RELOAD (on in debug) files are re-hashed when they
+    change, so edits show up without a restart.
+    """
+
+    def __init__(self, app=None):
+        self.static_folder = None
+        self.manifest = {}   # 'css/styles.css' -> hash
+        self._stats = {}     # filename -> (mtime, size) the hash was computed for
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.manifest_path = app.config.get('ASSET_MANIFEST') or os.path.join(app.static_folder, 'assets-manifest.json')
+        self.auto_reload = app.config.get('ASSET_AUTO_RELOAD', app.debug)
+        self.load_manifest()
+
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.send_asset)
+        app.add_template_global(self.asset_url, 'asset_url')
+        app.after_request(self._cache_blob_uploads)
+        app.extensions['assets'] = self
+
+    def _source_files(self):
+        for root, dirs, files in os.walk(self.static_folder):
+            # Uploads are fingerprinted on demand or are blobs already
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != os.path.join(self.static_folder, 'uploads')]
+            for name in files:
+                if name.endswith(('.gz', '.br')) or name.startswith('.') or name == os.path.basename(self.manifest_path):
+                    continue
+                yield os.path.relpath(os.path.join(root, name), self.static_folder).replace(os.sep, '/')
+
+    def build_manifest(self, compress=False):
+        """Hash every static file (optionally precompressing) and return the manifest"""
+        manifest = {}
+        for filename in self._source_files():
+            path = os.path.join(self.static_folder, filename)
+            manifest[filename] = file_hash(path)
+            if compress and os.path.splitext(filename)[1] in COMPRESSIBLE_EXTENSIONS:
+                precompress(path)
+        return manifest
+
+    def write_manifest(self):
+        """Build the manifest plus .gz/.br files and save it for the next startup (deploy step)"""
+        manifest = self.build_manifest(compress=True)
+        write_atomic(self.manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+        self.manifest = manifest
+        return manifest
+
+    def load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = self.build_manifest()
+
+    def _hash_for(self, filename):
+        digest = self.manifest.get(filename)
+        if digest is not None and not self.auto_reload:
+            return digest
+        path = safe_join(self.static_folder, filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if digest is None or self._stats.get(filename, key) != key:
+                digest = file_hash(path)
+                self.manifest[filename] = digest
+            self._stats[filename] = key
+        return digest
+
+    def asset_url(self, filename):
+        """Template helper: cache-busting URL for a file under the static folder"""
+        if filename.startswith('uploads/') and is_blob(filename[len('uploads/'):]):
+            return url_for('static', filename=filename)
+        digest = self._hash_for(filename)
+        if digest is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=fingerprinted_name(filename, digest))
+
+    def send_asset(self, filename):
+        """Serve /assets/<name>.<hash>.<ext> with immutable caching and precompression"""
+        directory, name = os.path.split(filename)
+        stem, ext = os.path.splitext(name)
+        stem, _, digest = stem.rpartition('.')
+        source = '/'.join(filter(None, [directory, stem + ext]))
+        if not stem or self._hash_for(source) != digest:
+            abort(404)  # Unknown file or an outdated fingerprint
+
+        path = safe_join(self.static_folder, source)
+        etag = digest
+        encoding = None
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            for candidate, suffix in ENCODINGS:
+                if candidate in request.accept_encodings and _is_fresh(path + suffix, path):
+                    encoding, path, etag = candidate, path + suffix, f"{digest}-{candidate}"
+                    break
+
+        # Keep the original file's type when sending a .gz/.br sibling
+        mimetype = mimetypes.guess_type(source)[0] or 'application/octet-stream'
+        response = send_file(path, mimetype=mimetype,
+                             etag=etag, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    @staticmethod
+    def _cache_blob_uploads(response):
+        # Blob names change whenever the content does, so browsers may cache them forever
+        if request.endpoint == 'static' and response.status_code == 200:
+            filename = (request.view_args or {}).get('filename', '')
+            if filename.startswith('uploads/') and is_blob(filename[len('uploads/'):]):
+                response.cache_control.public = True
+                response.cache_control.max_age = IMMUTABLE_MAX_AGE
+                response.cache_control.immutable = True
+        return response
+
+
+def _is_fresh(compressed_path, source_path):
+    """A .gz/.br sibling is only used if it is newer than the file it was made from"""
+    try:
+        return os.path.getmtime(compressed_path) >= os.path.getmtime(source_path)
+    except OSError:
+        return False
+
+
+assets = AssetPipeline()
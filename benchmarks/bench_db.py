@@ -0,0 +1,39 @@
+"""Database selection shared by the benchmark scripts.
+
+Benchmarks never pick up the app's DATABASE_URL: they run against an
+explicit --database-url or --db-path, or a throwaway SQLite file when
+neither is given. Tables are only dropped and recreated on an explicit
+target when --reseed is passed as well.
+"""
+import os
+import tempfile
+
+
+def add_database_arguments(parser):
+    parser.add_argument('--database-url', help='database to run against (DATABASE_URL is deliberately ignored)')
+    parser.add_argument('--db-path', help='SQLite file to run against')
+    parser.add_argument('--reseed', action='store_true',
+                        help='allow dropping and recreating every table in --database-url/--db-path')
+
+
+def configure_database(args, name):
+    """Point the app at the benchmark database; call before importing app"""
+    if args.database_url and args.db_path:
+        raise SystemExit("Pass either --database-url or --db-path, not both")
+    if args.database_url:
+        url = args.database_url
+    elif args.db_path:
+        url = f'sqlite:///{os.path.abspath(args.db_path)}?timeout=30'
+    else:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), name + '.db')}?timeout=30"
+        args.reseed = True  # A brand-new file has nothing to lose
+    args.target = url
+    os.environ['DATABASE_URL'] = url
+
+
+def reset_schema(db, args):
+    """Drop and recreate every table, but only when the run was started with --reseed"""
+    if not args.reseed:
+        raise SystemExit(f"Refusing to drop the tables in {db.engine.url!r}; pass --reseed to allow it")
+    db.drop_all()
+    db.create_all()
@@ -0,0 +1,127 @@
+"""Socket.IO load test for the support chat.
+
+Connects thousands of simulated users plus a few admins to a running server,
+has every user send messages and measures fan-out latency: the time from a
+user's send until the message reaches the user's own room and every admin in
+admin_room. Run several server processes with a shared
+SOCKETIO_MESSAGE_QUEUE to check cross-process delivery.
+
+    python benchmarks/chat_load.py --url http://127.0.0.1:5000 --users 2000 --admins 5
+
+The script signs Flask session cookies itself, so it must run with the same
+SECRET_KEY and DATABASE_URL as the server (test users are created if missing).
+Needs python-socketio[asyncio_client].
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import socketio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=1000, help='simulated chat users')
+    parser.add_argument('--admins', type=int, default=3, help='simulated admins in admin_room')
+    parser.add_argument('--messages', type=int, default=5, help='messages sent per user')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between a user\'s messages')
+    parser.add_argument('--settle', type=float, default=5.0, help='seconds to wait for stragglers')
+    return parser.parse_args()
+
+
+def prepare_cookies(users, admins):
+    """Create the test accounts and sign a Flask-Login session cookie for each"""
+    os.environ.setdefault('BOOKING_CLEANUP_ENABLED', '0')
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        def account(name, is_admin):
+            user = User.query.filter_by(username=name).first()
+            if not user:
+                user = User(username=name, email=f'{name}@loadtest.local', password='!', is_admin=is_admin)
+                db.session.add(user)
+                db.session.flush()
+            return user.id
+
+        user_ids = [account(f'loadtest_user_{i}', False) for i in range(users)]
+        admin_ids = [account(f'loadtest_admin_{i}', True) for i in range(admins)]
+        db.session.commit()
+
+        serializer = app.session_interface.get_signing_serializer(app)
+        cookie_name = app.config['SESSION_COOKIE_NAME']
+
+        def cookie(user_id):
+            return f"{cookie_name}={serializer.dumps({'_user_id': str(user_id), '_fresh': True})}"
+
+        return [cookie(i) for i in user_ids], [cookie(i) for i in admin_ids]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(args):
+    user_cookies, admin_cookies = prepare_cookies(args.users, args.admins)
+
+    sent_at = {}
+    echo_latencies = []
+    fanout_latencies = []
+
+    def on_receive(latencies):
+        async def handler(data):
+            marker = data.get('content', '').rsplit(' ', 1)[-1]
+            started = sent_at.get(marker)
+            if started is not None:
+                latencies.append((time.perf_counter() - started) * 1000)
+        return handler
+
+    async def connect(cookie, latencies):
+        client = socketio.AsyncClient(reconnection=False)
+        client.on('receive_message', on_receive(latencies))
+        await client.connect(args.url, headers={'Cookie': cookie}, transports=['websocket'])
+        return client
+
+    started = time.perf_counter()
+    admins = await asyncio.gather(*(connect(c, fanout_latencies) for c in admin_cookies))
+    users = await asyncio.gather(*(connect(c, echo_latencies) for c in user_cookies))
+    print(f"Connected {len(users)} users and {len(admins)} admins in {time.perf_counter() - started:.1f}s")
+
+    async def chat(client):
+        for _ in range(args.messages):
+            marker = uuid.uuid4().hex
+            sent_at[marker] = time.perf_counter()
+            await client.emit('send_message', {'content': f'load test {marker}'})
+            await asyncio.sleep(args.interval)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(client) for client in users))
+    await asyncio.sleep(args.settle)
+    elapsed = time.perf_counter() - started
+
+    await asyncio.gather(*(client.disconnect() for client in users + admins))
+
+    total_sent = len(sent_at)
+    print(f"Sent {total_sent} messages in {elapsed:.1f}s ({total_sent / elapsed:.0f} msg/s)")
+    for label, latencies, expected in [
+        ('user echo', echo_latencies, total_sent),
+        ('admin fan-out', fanout_latencies, total_sent * len(admins)),
+    ]:
+        if not latencies:
+            print(f"{label}: no deliveries (expected {expected})")
+            continue
+        print(f"{label}: delivered {len(latencies)}/{expected} "
+              f"p50={statistics.median(latencies):.1f}ms p95={percentile(latencies, 0.95):.1f}ms "
+              f"p99={percentile(latencies, 0.99):.1f}ms max={max(latencies):.1f}ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
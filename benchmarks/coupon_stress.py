@@ -0,0 +1,129 @@
+"""Concurrency test for capped coupon redemption.
+
+Creates a coupon with a global cap and a per-user limit, then pays
+thousands of pending bookings concurrently with it, the way a promo spike
+would. It checks that the coupon is never overspent and that no user goes
+over their limit.
+
+    python benchmarks/coupon_stress.py --bookings 5000 --threads 64 --cap 500
+    python benchmarks/coupon_stress.py --database-url postgresql://... --reseed
+
+Without --database-url or --db-path a throwaway SQLite file is used; an
+explicit database has all its tables dropped, so it also needs --reseed.
+Exits non-zero on failure.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_db import add_database_arguments, configure_database, reset_schema
+
+COUPON_CODE = 'SPIKE50'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, default=5000, help='concurrent checkouts using the coupon')
+    parser.add_argument('--threads', type=int, default=64, help='concurrent workers')
+    parser.add_argument('--users', type=int, default=200, help='users the bookings are spread over')
+    parser.add_argument('--cap', type=int, default=500, help='Coupon.max_redemptions')
+    parser.add_argument('--per-user', type=int, default=3, help='Coupon.per_user_limit')
+    add_database_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    configure_database(args, 'coupon_stress')
+    os.environ['BOOKING_CLEANUP_ENABLED'] = '0'
+    os.environ['BLOB_GC_ENABLED'] = '0'
+
+    from app import app
+    from models import db, User, TourPackage, Booking, Coupon, CouponUsage
+    from coupons import redeem_for_booking, CouponUnavailable
+
+    with app.app_context():
+        reset_schema(db, args)
+        db.session.execute(db.insert(User), [
+            {'username': f'spike_{i}', 'email': f'spike_{i}@example.com', 'password': 'x'}
+            for i in range(args.users)
+        ])
+        package = TourPackage(title='Spike', description='-', price=100.0, location='Nowhere',
+                              members=args.bookings * 4)
+        db.session.add(package)
+        db.session.add(Coupon(code=COUPON_CODE, discount_percent=50, is_active=True,
+                              max_redemptions=args.cap, per_user_limit=args.per_user))
+        db.session.commit()
+        user_ids = list(db.session.execute(db.select(User.id)).scalars())
+        db.session.execute(db.insert(Booking), [
+            {'user_id': random.choice(user_ids), 'package_id': package.id, 'members': 1,
+             'total_amount': 100.0, 'final_amount': 100.0, 'payment_status': 'Pending'}
+            for _ in range(args.bookings)
+        ])
+        db.session.commit()
+        booking_ids = list(db.session.execute(db.select(Booking.id)).scalars())
+
+    counters = {'redeemed': 0, 'refused': 0, 'error': 0}
+    lock = threading.Lock()
+
+    def checkout(booking_id):
+        # The coupon part of process_payment, committed with the payment
+        outcome = 'redeemed'
+        with app.app_context():
+            try:
+                booking = db.session.get(Booking, booking_id)
+                redeem_for_booking(booking, COUPON_CODE, booking.user_id)
+                booking.payment_status = 'Completed'
+                db.session.commit()
+            except CouponUnavailable:
+                db.session.rollback()
+                outcome = 'refused'
+            except Exception:
+                db.session.rollback()
+                outcome = 'error'
+            finally:
+                db.session.remove()
+        with lock:
+            counters[outcome] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(checkout, booking_ids))
+    elapsed = time.perf_counter() - started
+
+    failures = []
+    with app.app_context():
+        coupon = Coupon.query.filter_by(code=COUPON_CODE).one()
+        discounted = db.session.query(db.func.count(Booking.id)).filter(Booking.coupon_code == COUPON_CODE).scalar()
+        print(f"coupon: cap={coupon.max_redemptions} counter={coupon.redemption_count} discounted bookings={discounted}")
+        if discounted > coupon.max_redemptions or discounted != coupon.redemption_count:
+            failures.append('global cap')
+
+        per_user = dict(db.session.query(Booking.user_id, db.func.count(Booking.id)).filter(
+            Booking.coupon_code == COUPON_CODE
+        ).group_by(Booking.user_id).all())
+        usages = {usage.user_id: usage.count for usage in CouponUsage.query.filter_by(coupon_id=coupon.id)}
+        over = [user_id for user_id, count in per_user.items() if count > args.per_user or usages.get(user_id) != count]
+        print(f"users with the coupon: {len(per_user)}, most uses by one user: {max(per_user.values(), default=0)}")
+        if over:
+            failures.append(f'per-user limit ({len(over)} users)')
+
+    print(f"{args.bookings} checkouts in {elapsed:.2f}s -> {args.bookings / elapsed:.0f} req/s "
+          f"(redeemed={counters['redeemed']} refused={counters['refused']} error={counters['error']})")
+
+    if failures:
+        print(f"FAIL: {', '.join(failures)} violated")
+        return 1
+    print("OK: coupon never overspent")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
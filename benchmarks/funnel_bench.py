@@ -0,0 +1,443 @@
+"""Benchmark suite for the booking funnel and the admin list pages.
+
+Seeds a database with realistic volumes (by default 100k users, 10k tour
+packages, 1M bookings and 5M chat messages), then drives the real Flask app
+through its test client: browse -> book -> payment page -> apply coupon ->
+pay, plus the admin list pages. Every step reports p50/p99 latency,
+throughput and SQL statements per request. Results are written to
+benchmarks/results/ as JSON and compared with the previous run.
+
+    python benchmarks/funnel_bench.py --scale 0.01                          # quick smoke run
+    python benchmarks/funnel_bench.py --db-path /tmp/funnel.db --reseed     # seed once, reuse after
+    python benchmarks/funnel_bench.py --database-url postgresql://... --reseed --journeys 2000
+    python benchmarks/funnel_bench.py --db-path /tmp/funnel.db --fail-on-regression
+
+Seeding is deterministic (--seed), so runs against the same volumes are
+comparable. An existing database that already has the requested number of
+users is reused as is; seeding one that does not drops every table in it
+and therefore needs --reseed. DATABASE_URL is never used (see bench_db.py).
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_db import add_database_arguments, configure_database, reset_schema
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+CHUNK = 10000
+
+LOCATIONS = ['Cox\'s Bazar', 'Sylhet', 'Sundarbans', 'Bandarban', 'Kathmandu', 'Bali', 'Maldives',
+             'Darjeeling', 'Bangkok', 'Dubai', 'Istanbul', 'Paris', 'Rome', 'Tokyo', 'Cairo']
+WORDS = ['beach', 'hill', 'forest', 'river', 'safari', 'trek', 'cruise', 'temple', 'city', 'island',
+         'desert', 'lake', 'village', 'heritage', 'luxury', 'budget', 'family', 'honeymoon']
+BROWSE_QUERIES = [
+    {},
+    {'q': 'beach'},
+    {'q': 'kathmandu trek'},
+    {'price': '500-1000'},
+    {'duration': '4-7', 'sort': 'price_asc'},
+    {'q': 'island', 'price': '1000+', 'sort': 'price_desc'},
+    {'sort': 'duration_desc'},
+]
+ADMIN_PAGES = [
+    ('dashboard', {}),
+    ('admin_bookings', {}),
+    ('admin_bookings', {'status': 'Completed'}),
+    ('admin_bookings', {'method': 'bkash'}),
+    ('admin_custom_trips', {}),
+    ('admin_refunds', {}),
+    ('manage_users', {}),
+    ('admin_agency_feedback', {}),
+    ('admin_chat_manager', {}),
+]
+COUPON_CODE = 'BENCH10'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--packages', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--messages', type=int, default=5000000)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every volume, e.g. 0.01 for a smoke run')
+    parser.add_argument('--journeys', type=int, default=500, help='browse->pay journeys to run')
+    parser.add_argument('--admin-rounds', type=int, default=20, help='passes over the admin list pages')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed journeys before measuring')
+    parser.add_argument('--seed', type=int, default=42)
+    add_database_arguments(parser)
+    parser.add_argument('--label', default='', help='free-form note stored with the results')
+    parser.add_argument('--baseline', help='results file to compare with (default: the latest one)')
+    parser.add_argument('--regression-threshold', type=float, default=10.0, help='%% slower that counts as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+    for name in ('users', 'packages', 'bookings', 'messages'):
+        setattr(args, name, max(1, int(getattr(args, name) * args.scale)))
+    return args
+
+
+def configure_environment(args):
+    configure_database(args, 'funnel_bench')
+    # Keep background work out of the measurements
+    os.environ['BOOKING_CLEANUP_ENABLED'] = '0'
+    os.environ['BLOB_GC_ENABLED'] = '0'
+    os.environ['CHAT_WRITE_BEHIND'] = '0'
+    os.environ['IMAGE_WORKERS'] = '0'
+
+
+# =======================
+# Seeding
+# =======================
+
+def insert_chunks(db, model, rows):
+    """Bulk-insert an iterator of row dicts in CHUNK-sized executemany batches"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == CHUNK:
+            db.session.execute(db.insert(model), batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+        db.session.commit()
+
+
+def seed(args):
+    from app import PAYMENT_METHODS
+    from models import (db, User, TourPackage, Booking, ChatSession, Message, Coupon, CustomTrip,
+                        Refund, AgencyRating, AgencyStats, parse_duration_days)
+    from reservations import resync_reserved_members
+    from search import build_search_index
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    reset_schema(db, args)
+
+    def step(label, started):
+        print(f"  {label} in {time.perf_counter() - started:.1f}s")
+        return time.perf_counter()
+
+    started = time.perf_counter()
+    print(f"Seeding {args.users} users, {args.packages} packages, {args.bookings} bookings, {args.messages} messages")
+
+    insert_chunks(db, User, (
+        {'username': f'bench_user_{i}', 'email': f'bench_user_{i}@bench.local', 'password': '!',
+         'is_admin': i == 1, 'image_file': 'default.png'}
+        for i in range(1, args.users + 1)
+    ))
+    started = step('users', started)
+
+    prices = {}
+
+    def package_rows():
+        for i in range(1, args.packages + 1):
+            days = rng.randint(1, 14)
+            duration = f'{days} Days / {max(days - 1, 0)} Nights'
+            prices[i] = round(rng.uniform(100, 3000), 2)
+            yield {
+                'title': f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} escape #{i}',
+                'description': ' '.join(rng.choices(WORDS, k=25)),
+                'price': prices[i], 'location': rng.choice(LOCATIONS),
+                'duration': duration, 'duration_days': parse_duration_days(duration),
+                'members': 1000000, 'reserved_members': 0, 'booked_members': 0,
+            }
+    insert_chunks(db, TourPackage, package_rows())
+    started = step('packages', started)
+
+    def booking_rows():
+        for _ in range(args.bookings):
+            package_id = rng.randint(1, args.packages)
+            members = rng.randint(1, 4)
+            status = rng.choices(['Completed', 'Pending', 'Failed'], weights=[80, 5, 15])[0]
+            total = prices[package_id] * members
+            yield {
+                'user_id': rng.randint(1, args.users), 'package_id': package_id, 'members': members,
+                'total_amount': total, 'discount_amount': 0.0, 'final_amount': total,
+                'payment_method': rng.choice(PAYMENT_METHODS) if status != 'Pending' else None,
+                'payment_status': status,
+                # Pending holds are old, so they count as expired rather than holding seats
+                'created_at': now - timedelta(minutes=rng.randint(120, 2 * 365 * 24 * 60)),
+            }
+    insert_chunks(db, Booking, booking_rows())
+    started = step('bookings', started)
+
+    sessions = max(1, min(args.users, args.messages // 50))
+    insert_chunks(db, ChatSession, (
+        {'user_id': i, 'is_active': True, 'unread_by_admin': 0,
+         'created_at': now - timedelta(days=365), 'updated_at': now}
+        for i in range(1, sessions + 1)
+    ))
+    step_seconds = (365 * 24 * 3600) / max(args.messages, 1)
+    insert_chunks(db, Message, (
+        {'id': i, 'session_id': rng.randint(1, sessions), 'is_admin_message': rng.random() < 0.4,
+         'content': ' '.join(rng.choices(WORDS, k=rng.randint(3, 15))),
+         'timestamp': now - timedelta(seconds=(args.messages - i) * step_seconds), 'is_read': rng.random() < 0.97}
+        for i in range(1, args.messages + 1)
+    ))
+    started = step('chat', started)
+
+    trips = max(1, args.users // 10)
+    insert_chunks(db, CustomTrip, (
+        {'user_id': rng.randint(1, args.users), 'destination': rng.choice(LOCATIONS), 'transport': 'Bus',
+         'hotel': 'Any', 'number_of_rooms': 1, 'room_type': 'Double',
+         'start_date': date.today() + timedelta(days=30), 'end_date': date.today() + timedelta(days=35),
+         'people': rng.randint(1, 6), 'status': rng.choice(['Pending', 'Priced', 'Confirmed'])}
+        for _ in range(trips)
+    ))
+    insert_chunks(db, Refund, (
+        {'booking_id': rng.randint(1, args.bookings), 'user_id': rng.randint(1, args.users),
+         'amount': 100.0, 'reason': 'Change of plans', 'status': rng.choice(['Pending', 'Approved', 'Rejected'])}
+        for _ in range(max(1, args.bookings // 100))
+    ))
+    insert_chunks(db, AgencyRating, (
+        {'user_id': rng.randint(1, args.users), 'rating': rng.randint(1, 5), 'feedback': 'Nice trip'}
+        for _ in range(max(1, args.users // 20))
+    ))
+    db.session.add(Coupon(code=COUPON_CODE, discount_percent=10, is_active=True))
+    db.session.commit()
+    started = step('trips, refunds, ratings, coupon', started)
+
+    # Bring the denormalized counters and indexes in line with the bulk data
+    resync_reserved_members()
+    ChatSession.resync_unread_counters()
+    AgencyStats.reconcile()
+    db.session.commit()
+    build_search_index()
+    step('counters and search index', started)
+
+
+def ensure_seeded(args):
+    from models import db, User
+    try:
+        existing = db.session.query(db.func.count(User.id)).scalar()
+    except Exception:
+        db.session.rollback()
+        existing = 0
+    if existing >= args.users:
+        print(f"Reusing seeded database ({existing} users)")
+        return
+    if not args.reseed:
+        raise SystemExit(f"The database has {existing} users, fewer than the {args.users} requested; "
+                         f"pass --reseed to drop its tables and seed it")
+    seed(args)
+
+
+# =======================
+# Measurement
+# =======================
+
+class Step:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+        total = sum(ordered)
+        return {
+            'requests': len(ordered),
+            'errors': self.errors,
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+            'mean_ms': round(statistics.mean(ordered) * 1000, 2) if ordered else 0.0,
+            'throughput_rps': round(len(ordered) / total, 1) if total else 0.0,
+            'queries_per_request': round(statistics.mean(self.queries), 1) if self.queries else 0.0,
+        }
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Driver:
+    """Times requests through the Flask test client and counts their SQL"""
+
+    def __init__(self, app, db):
+        self.app = app
+        with app.app_context():
+            self.engine = db.engine
+        self.steps = {}
+        self.recording = True
+
+    def client_for(self, user_id):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+
+    def request(self, step_name, client, method, url, **kwargs):
+        from query_budget import count_queries
+        started = time.perf_counter()
+        with count_queries(self.engine) as statements:
+            response = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            step = self.steps.setdefault(step_name, Step(step_name))
+            step.latencies.append(elapsed)
+            step.queries.append(len(statements))
+            if response.status_code >= 400:
+                step.errors += 1
+        return response
+
+
+def run_journey(driver, args, rng, urls):
+    client = driver.client_for(rng.randint(2, args.users))
+    query = rng.choice(BROWSE_QUERIES)
+    driver.request('browse', client, 'GET', urls['tour_packages'], query_string=query)
+
+    package_id = rng.randint(1, args.packages)
+    response = driver.request('book', client, 'POST', urls['book_package'].format(package_id),
+                              json={'members': rng.randint(1, 3)})
+    data = response.get_json(silent=True) or {}
+    booking_id = data.get('booking_id')
+    if not booking_id:
+        return
+
+    driver.request('payment_page', client, 'GET', urls['payment_page'].format(booking_id))
+    driver.request('apply_coupon', client, 'POST', urls['apply_coupon'],
+                   json={'coupon_code': COUPON_CODE, 'booking_id': booking_id})
+    driver.request('process_payment', client, 'POST', urls['process_payment'].format(booking_id),
+                   data={'payment_method': 'bkash', 'transaction_id': f'TX{booking_id}', 'coupon_code': COUPON_CODE})
+
+
+def run_admin_pages(driver, admin_client, urls, rounds):
+    for _ in range(rounds):
+        for endpoint, params in ADMIN_PAGES:
+            name = endpoint + ''.join(f'[{k}={v}]' for k, v in params.items())
+            driver.request(name, admin_client, 'GET', urls[endpoint], query_string=params)
+
+
+def resolve_urls(app):
+    from flask import url_for
+    with app.test_request_context():
+        urls = {
+            'tour_packages': url_for('tour_packages'),
+            'book_package': url_for('book_package', package_id=999999999).replace('999999999', '{}'),
+            'payment_page': url_for('payment_page', booking_id=999999999).replace('999999999', '{}'),
+            'apply_coupon': url_for('apply_coupon'),
+            'process_payment': url_for('process_payment', booking_id=999999999).replace('999999999', '{}'),
+        }
+        for endpoint, _ in ADMIN_PAGES:
+            urls[endpoint] = url_for(endpoint)
+    return urls
+
+
+# =======================
+# Results
+# =======================
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def latest_results(exclude=None):
+    files = sorted(glob.glob(os.path.join(RESULTS_DIR, 'funnel-*.json')))
+    files = [f for f in files if f != exclude]
+    return files[-1] if files else None
+
+
+def compare(current, baseline, threshold):
+    """Print per-step p50/p99 deltas against a baseline; return the regressed steps"""
+    regressions = []
+    print(f"\nCompared with {baseline['file']} ({baseline.get('git_revision') or 'unknown revision'})")
+    print(f"{'step':<45} {'p50 delta':>10} {'p99 delta':>10} {'queries':>12}")
+    for name, stats in current['steps'].items():
+        old = baseline['steps'].get(name)
+        if not old:
+            continue
+        deltas = []
+        for key in ('p50_ms', 'p99_ms'):
+            deltas.append((stats[key] - old[key]) / old[key] * 100 if old[key] else 0.0)
+        queries = f"{old['queries_per_request']}->{stats['queries_per_request']}"
+        flag = ' REGRESSION' if max(deltas) > threshold else ''
+        print(f"{name:<45} {deltas[0]:>+9.1f}% {deltas[1]:>+9.1f}% {queries:>12}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        ensure_seeded(args)
+        admin_id = db.session.query(User.id).filter_by(is_admin=True).order_by(User.id).limit(1).scalar()
+        dialect = db.engine.dialect.name
+
+    urls = resolve_urls(app)
+    driver = Driver(app, db)
+    rng = random.Random(args.seed + 1)
+
+    driver.recording = False
+    for _ in range(args.warmup):
+        run_journey(driver, args, rng, urls)
+    driver.recording = True
+
+    started = time.perf_counter()
+    for _ in range(args.journeys):
+        run_journey(driver, args, rng, urls)
+    funnel_seconds = time.perf_counter() - started
+    run_admin_pages(driver, driver.client_for(admin_id), urls, args.admin_rounds)
+
+    results = {
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'label': args.label,
+        'git_revision': git_revision(),
+        'database': dialect,
+        'python': platform.python_version(),
+        'volumes': {name: getattr(args, name) for name in ('users', 'packages', 'bookings', 'messages')},
+        'journeys': args.journeys,
+        'journeys_per_second': round(args.journeys / funnel_seconds, 1),
+        'steps': {name: step.summary() for name, step in driver.steps.items()},
+    }
+
+    print(f"\n{'step':<45} {'n':>6} {'err':>5} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8} {'queries':>8}")
+    for name, stats in results['steps'].items():
+        print(f"{name:<45} {stats['requests']:>6} {stats['errors']:>5} {stats['p50_ms']:>9.2f} "
+              f"{stats['p99_ms']:>9.2f} {stats['throughput_rps']:>8.1f} {stats['queries_per_request']:>8.1f}")
+    print(f"Funnel: {results['journeys_per_second']} journeys/s on {dialect}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = os.path.join(RESULTS_DIR, f"funnel-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    baseline_file = args.baseline or latest_results(exclude=output)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = dict(json.load(f), file=os.path.basename(baseline_file))
+        if baseline.get('volumes') != results['volumes']:
+            print("Note: baseline was seeded with different volumes")
+        regressions = compare(results, baseline, args.regression_threshold)
+        if regressions and args.fail_on_regression:
+            print(f"FAIL: {len(regressions)} steps regressed by more than {args.regression_threshold}%")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Login throughput benchmark for the password hashing settings.
+
+For each algorithm/cost setting, times single verifications (logins/sec
+per core) and then drives the PasswordService pool from many concurrent
+callers to measure total logins/sec, the way a login storm would.
+
+    python benchmarks/password_bench.py
+    python benchmarks/password_bench.py --workers 8 --concurrency 64 --pool process
+
+Settings whose library is not installed (argon2-cffi) are skipped.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordService, make_hasher
+
+SETTINGS = [
+    ('bcrypt', {'PASSWORD_BCRYPT_ROUNDS': 10}),
+    ('bcrypt', {'PASSWORD_BCRYPT_ROUNDS': 12}),
+    ('bcrypt', {'PASSWORD_BCRYPT_ROUNDS': 14}),
+    ('argon2', {'PASSWORD_ARGON2_TIME_COST': 2, 'PASSWORD_ARGON2_MEMORY_KIB': 19456}),
+    ('argon2', {'PASSWORD_ARGON2_TIME_COST': 3, 'PASSWORD_ARGON2_MEMORY_KIB': 65536}),
+    ('scrypt', {'PASSWORD_SCRYPT_LOG_N': 14}),
+    ('scrypt', {'PASSWORD_SCRYPT_LOG_N': 15}),
+    ('scrypt', {'PASSWORD_SCRYPT_LOG_N': 17}),
+]
+
+PASSWORD = 'correct horse battery staple'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=20, help='single-threaded verifications per setting')
+    parser.add_argument('--logins', type=int, default=200, help='logins per setting through the pool')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--concurrency', type=int, default=32, help='simultaneous login requests')
+    parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+    return parser.parse_args()
+
+
+class _App:
+    """Just enough of a Flask app for PasswordService.init_app"""
+
+    def __init__(self, config):
+        self.config = config
+        self.extensions = {}
+
+
+def label(algorithm, params):
+    return algorithm + ' ' + ','.join(f"{key.split('_', 2)[-1].lower()}={value}" for key, value in params.items())
+
+
+def bench(algorithm, params, args):
+    config = dict(params, PASSWORD_HASH_ALGORITHM=algorithm, PASSWORD_HASH_WORKERS=args.workers,
+                  PASSWORD_HASH_POOL=args.pool, PASSWORD_HASH_MAX_PENDING=args.concurrency)
+    hasher = make_hasher(algorithm, config)
+    hashed = hasher.hash(PASSWORD)
+
+    timings = []
+    for _ in range(args.samples):
+        started = time.perf_counter()
+        hasher.verify(hashed, PASSWORD)
+        timings.append(time.perf_counter() - started)
+    per_login = statistics.median(timings)
+
+    service = PasswordService(_App(config))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as callers:
+        results = list(callers.map(lambda _: service.verify(hashed, PASSWORD)[0], range(args.logins)))
+    elapsed = time.perf_counter() - started
+    service._executor.shutdown()
+    assert all(results)
+
+    return per_login, args.logins / elapsed
+
+
+def main():
+    args = parse_args()
+    print(f"{'setting':<40} {'ms/login':>9} {'logins/s/core':>14} {'pool logins/s':>14}")
+    for algorithm, params in SETTINGS:
+        try:
+            per_login, throughput = bench(algorithm, params, args)
+        except (RuntimeError, ImportError) as e:
+            print(f"{label(algorithm, params):<40} skipped: {e}")
+            continue
+        print(f"{label(algorithm, params):<40} {per_login * 1000:>9.1f} {1 / per_login:>14.1f} {throughput:>14.1f}")
+    print(f"pool: {args.pool} x {args.workers} workers, {args.concurrency} concurrent callers")
+
+
+if __name__ == '__main__':
+    main()
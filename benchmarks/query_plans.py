@@ -0,0 +1,159 @@
+"""Query plans for the hot filters and joins, before and after the index pack.
+
+Seeds (or reuses) the funnel benchmark dataset and drops the hot-path
+indexes: those added by migration 3f1c9a2b7d40 and the earlier ones that
+cover the same predicates. It prints the plan and median latency of every
+hot query, then recreates the indexes and prints the same again.
+
+    python benchmarks/query_plans.py --scale 0.05
+    python benchmarks/query_plans.py --db-path /tmp/funnel.db       # reuse a funnel_bench database
+    python benchmarks/query_plans.py --database-url postgresql://... --reseed
+
+The indexes are left in place when the run finishes. Like funnel_bench it
+never uses DATABASE_URL, and it refuses to touch indexes in a database
+that does not hold the funnel benchmark's seed data.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_db import add_database_arguments
+from funnel_bench import COUPON_CODE, configure_environment, ensure_seeded
+
+INDEX_PACK = [
+    'ix_booking_status_created_at_id',
+    'ix_booking_package_status_created_at',
+    'ix_booking_user_status_created_at',
+    'ix_refund_booking_status',
+    'ix_custom_trips_status_start_date',
+    'ix_chat_sessions_user_active',
+    'ix_chat_sessions_active_updated_at',
+    'ix_messages_session_admin_read',
+    'ix_messages_session_timestamp_id',
+]
+
+EXPLAIN = {'sqlite': 'EXPLAIN QUERY PLAN', 'postgresql': 'EXPLAIN', 'mysql': 'EXPLAIN', 'mariadb': 'EXPLAIN'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--packages', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--messages', type=int, default=5000000)
+    parser.add_argument('--scale', type=float, default=0.1, help='multiply every volume')
+    parser.add_argument('--runs', type=int, default=20, help='timed executions per query')
+    parser.add_argument('--seed', type=int, default=42)
+    add_database_arguments(parser)
+    args = parser.parse_args()
+    for name in ('users', 'packages', 'bookings', 'messages'):
+        setattr(args, name, max(1, int(getattr(args, name) * args.scale)))
+    return args
+
+
+def hot_queries(args):
+    """(label, statement) for each predicate the index pack targets"""
+    from models import db, Booking, Refund, CustomTrip, ChatSession, Message, Coupon, PENDING_BOOKING_TTL
+
+    user_id = args.users // 2
+    package_ids = list(range(1, min(args.packages, 12) + 1))
+    hold_start = datetime.utcnow() - PENDING_BOOKING_TTL
+    return [
+        ('expired pending cleanup',
+         db.select(Booking.id).where(Booking.expired_clause())),
+        # Same statement as TourPackage.reserved_seats_for
+        ('reserved seats per package',
+         db.select(Booking.package_id, db.func.sum(Booking.members)).where(
+             Booking.package_id.in_(package_ids),
+             db.or_(Booking.payment_status == 'Completed',
+                    db.and_(Booking.payment_status == 'Pending', Booking.created_at >= hold_start)),
+         ).group_by(Booking.package_id)),
+        ('my_booked_packages',
+         db.select(Booking).where(Booking.user_id == user_id, Booking.payment_status == 'Completed',
+                                  Booking.package_id.isnot(None)).order_by(Booking.created_at.desc())),
+        ('has_pending_refund',
+         db.select(Refund.id).where(Refund.booking_id == args.bookings // 2, Refund.status == 'Pending').limit(1)),
+        ('admin_custom_trips',
+         db.select(CustomTrip).where(CustomTrip.status == 'Pending').order_by(CustomTrip.start_date.asc())),
+        ("user's active chat session",
+         db.select(ChatSession.id).where(ChatSession.user_id == user_id, ChatSession.is_active.is_(True))),
+        ('admin chat inbox',
+         db.select(ChatSession.id).where(ChatSession.is_active.is_(True)).order_by(ChatSession.updated_at.desc())),
+        ('chat history page',
+         db.select(Message).where(Message.session_id == 1).order_by(Message.timestamp.desc(), Message.id.desc()).limit(50)),
+        ('coupon lookup',
+         db.select(Coupon).where(Coupon.code == COUPON_CODE)),
+    ]
+
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    params = compiled.construct_params()
+    if compiled.positiontup is not None:
+        params = tuple(params[name] for name in compiled.positiontup)
+    rows = connection.exec_driver_sql(f"{EXPLAIN[connection.dialect.name]} {compiled}", params).fetchall()
+    if connection.dialect.name == 'sqlite':
+        return [row[-1] for row in rows]
+    return [' | '.join(str(value) for value in row) for row in rows]
+
+
+def median_ms(connection, statement, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        connection.execute(statement).fetchall()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def measure(db, queries, runs):
+    with db.engine.connect() as connection:
+        return {label: (explain(connection, statement), median_ms(connection, statement, runs))
+                for label, statement in queries}
+
+
+def set_indexes(db, present):
+    indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    for name in INDEX_PACK:
+        if present:
+            indexes[name].create(bind=db.engine, checkfirst=True)
+        else:
+            indexes[name].drop(bind=db.engine, checkfirst=True)
+    with db.engine.begin() as connection:
+        if connection.dialect.name in ('sqlite', 'postgresql'):
+            connection.exec_driver_sql('ANALYZE')
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        ensure_seeded(args)
+        if not db.session.query(User.id).filter_by(username='bench_user_1').first():
+            raise SystemExit("This is not a funnel benchmark database; refusing to drop its indexes")
+        queries = hot_queries(args)
+        set_indexes(db, present=False)
+        before = measure(db, queries, args.runs)
+        set_indexes(db, present=True)
+        after = measure(db, queries, args.runs)
+
+    for label, _ in queries:
+        (plan_before, ms_before), (plan_after, ms_after) = before[label], after[label]
+        print(f"== {label}: {ms_before:.2f}ms -> {ms_after:.2f}ms ({ms_before / max(ms_after, 1e-6):.1f}x)")
+        print('  before:')
+        print('\n'.join(f'    {line}' for line in plan_before))
+        print('  after:')
+        print('\n'.join(f'    {line}' for line in plan_after))
+
+
+if __name__ == '__main__':
+    main()
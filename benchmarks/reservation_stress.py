@@ -0,0 +1,105 @@
+"""Stress test for the seat reservation engine.
+
+Fires thousands of concurrent reserve_seats() calls at a few packages and
+checks that no package is ever overbooked.
+
+    python benchmarks/reservation_stress.py --requests 5000 --threads 64
+    python benchmarks/reservation_stress.py --database-url postgresql://... --reseed
+
+Without --database-url or --db-path a throwaway SQLite file is used; an
+explicit database has all its tables dropped, so it also needs --reseed.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_db import add_database_arguments, configure_database, reset_schema
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000, help='total booking attempts')
+    parser.add_argument('--threads', type=int, default=64, help='concurrent workers')
+    parser.add_argument('--packages', type=int, default=5, help='packages to spread bookings over')
+    parser.add_argument('--seats', type=int, default=500, help='capacity of each package')
+    parser.add_argument('--max-members', type=int, default=4, help='largest party size per booking')
+    add_database_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    configure_database(args, 'reservation_stress')
+    os.environ['BOOKING_CLEANUP_ENABLED'] = '0'
+
+    from app import app
+    from models import db, User, TourPackage, Booking
+    from reservations import reserve_seats, SeatsUnavailable
+
+    with app.app_context():
+        reset_schema(db, args)
+        user = User(username='stress', email='stress@example.com', password='x')
+        db.session.add(user)
+        packages = [
+            TourPackage(title=f'Stress {i}', description='-', price=100.0, location='Nowhere', members=args.seats)
+            for i in range(args.packages)
+        ]
+        db.session.add_all(packages)
+        db.session.commit()
+        user_id = user.id
+        package_ids = [p.id for p in packages]
+
+    counters = {'ok': 0, 'full': 0, 'error': 0}
+    lock = threading.Lock()
+
+    def attempt(_):
+        outcome = 'ok'
+        with app.app_context():
+            package = db.session.get(TourPackage, random.choice(package_ids))
+            try:
+                reserve_seats(package, random.randint(1, args.max_members), user_id)
+            except SeatsUnavailable:
+                outcome = 'full'
+            except Exception:
+                db.session.rollback()
+                outcome = 'error'
+            finally:
+                db.session.remove()
+        with lock:
+            counters[outcome] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(attempt, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    overbooked = []
+    with app.app_context():
+        for package_id in package_ids:
+            package = db.session.get(TourPackage, package_id)
+            booked = db.session.query(db.func.coalesce(db.func.sum(Booking.members), 0)).filter(
+                Booking.package_id == package_id
+            ).scalar()
+            print(f"package {package_id}: capacity={package.members} counter={package.reserved_members} booked={booked}")
+            if booked > package.members or booked != package.reserved_members:
+                overbooked.append(package_id)
+
+    print(f"{args.requests} attempts in {elapsed:.2f}s -> {args.requests / elapsed:.0f} req/s "
+          f"(ok={counters['ok']} full={counters['full']} error={counters['error']})")
+
+    if overbooked:
+        print(f"FAIL: seat counters inconsistent for packages {overbooked}")
+        return 1
+    print("OK: no package overbooked")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
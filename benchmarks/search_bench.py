@@ -0,0 +1,106 @@
+"""Latency benchmark for tour package search.
+
+Seeds a catalog of synthetic packages, builds the search index and times a
+mix of text, range and sorted/paginated searches.
+
+    python benchmarks/search_bench.py --packages 100000
+    python benchmarks/search_bench.py --database-url postgresql://... --reseed
+
+Without --database-url or --db-path a throwaway SQLite file is used; an
+explicit database has all its tables dropped, so it also needs --reseed.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_db import add_database_arguments, configure_database, reset_schema
+
+LOCATIONS = ['Cox\'s Bazar', 'Sylhet', 'Sundarbans', 'Bandarban', 'Kathmandu', 'Bali', 'Maldives',
+             'Darjeeling', 'Bangkok', 'Dubai', 'Istanbul', 'Paris', 'Rome', 'Tokyo', 'Cairo']
+WORDS = ['beach', 'hill', 'forest', 'river', 'safari', 'trek', 'cruise', 'temple', 'city', 'island',
+         'desert', 'lake', 'village', 'heritage', 'luxury', 'budget', 'family', 'honeymoon']
+
+QUERIES = [
+    dict(query_text='beach'),
+    dict(query_text='kathmandu trek'),
+    dict(price_range='500-1000'),
+    dict(duration_range='4-7', sort='price_asc'),
+    dict(query_text='island', price_range='1000+', sort='price_desc'),
+    dict(sort='duration_desc'),
+    dict(),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--packages', type=int, default=100000, help='catalog size to seed')
+    parser.add_argument('--runs', type=int, default=50, help='timed runs per query')
+    parser.add_argument('--pages', type=int, default=3, help='pages to walk per run')
+    add_database_arguments(parser)
+    return parser.parse_args()
+
+
+def seed(db, TourPackage, count):
+    from models import parse_duration_days
+    rows = []
+    for i in range(count):
+        days = random.randint(1, 14)
+        duration = f'{days} Days / {max(days - 1, 0)} Nights'
+        rows.append({
+            'title': f'{random.choice(WORDS).title()} {random.choice(WORDS)} escape #{i}',
+            'description': ' '.join(random.choices(WORDS, k=25)),
+            'price': round(random.uniform(100, 3000), 2),
+            'location': random.choice(LOCATIONS),
+            'duration': duration,
+            'duration_days': parse_duration_days(duration),
+            'members': 30,
+        })
+        if len(rows) == 5000:
+            db.session.execute(db.insert(TourPackage), rows)
+            rows = []
+    if rows:
+        db.session.execute(db.insert(TourPackage), rows)
+    db.session.commit()
+
+
+def main():
+    args = parse_args()
+
+    configure_database(args, 'search_bench')
+    os.environ['BOOKING_CLEANUP_ENABLED'] = '0'
+
+    from app import app
+    from models import db, TourPackage
+    from search import build_search_index, search_packages
+
+    with app.app_context():
+        reset_schema(db, args)
+        started = time.perf_counter()
+        seed(db, TourPackage, args.packages)
+        build_search_index()
+        print(f"Seeded {args.packages} packages in {time.perf_counter() - started:.1f}s")
+
+        for params in QUERIES:
+            timings = []
+            for _ in range(args.runs):
+                after = None
+                for _ in range(args.pages):
+                    started = time.perf_counter()
+                    page = search_packages(after=after, **params)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    db.session.expunge_all()
+                    after = page.next_cursor
+                    if not after:
+                        break
+            timings.sort()
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            print(f"{str(params):70} p50={statistics.median(timings):6.2f}ms p99={p99:6.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
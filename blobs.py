@@ -0,0 +1,232 @@
+import atexit
+import glob
+import hashlib
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from expiry import _ProcessLock
+from models import db, Blob, TourPackage, HomeImage, User
+
+HASH_LENGTH = 32
+
+# Files collect_garbage() has moved aside while its DELETE commits
+GC_PREFIX = '.gc-'
+
+# Blob originals and their derived files (e.g. image variants) share the hash prefix
+BLOB_NAME = re.compile(r'^[0-9a-f]{%d}(?:\.[A-Za-z0-9]+|-.+)$' % HASH_LENGTH)
+
+# Columns that reference blobs; used to rebuild reference counts
+BLOB_REFERENCES = [
+    (TourPackage, TourPackage.image_filename),
+    (HomeImage, HomeImage.filename),
+    (User, User.image_file),
+]
+
+
+def blob_filename(data, original_name):
+    """Name a blob after a hash of its bytes, keeping the original extension"""
+    _, ext = os.path.splitext(secure_filename(original_name or ''))
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH] + (ext.lower() or '.bin')
+
+
+def is_blob(filename):
+    return bool(filename) and bool(BLOB_NAME.match(filename))
+
+
+def write_atomic(path, data):
+    """Write a file via a temp file in the same directory and an atomic rename"""
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            out.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class BlobStore:
+    """Deduplicated, reference-counted upload storage.
+
+    Files are named by content hash, so identical uploads share one file and
+    concurrent uploads never overwrite each other. Reference counts live in
+    the blobs table and change inside the caller's transaction; nothing is
+    deleted on the request path. collect_garbage() removes blobs that have
+    been unreferenced for BLOB_GC_GRACE_MINUTES, together with their derived
+    files.
+    """
+
+    def __init__(self, app=None):
+        self.folder = None
+        self.grace = timedelta(minutes=60)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.config['UPLOAD_FOLDER']
+        self.grace = timedelta(minutes=app.config.get('BLOB_GC_GRACE_MINUTES', 60))
+        app.extensions['blob_store'] = self
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def put(self, file_storage):
+        """Store an upload and take one reference to it (caller commits); returns the filename.
+
+        The reference is taken before the file is checked: once the row is
+        updated, collect_garbage() can no longer delete it, and if it already
+        has, the file was moved aside before that commit and is written again.
+        """
+        data = file_storage.read()
+        filename = blob_filename(data, file_storage.filename)
+        self.incref(filename, size=len(data))
+        if os.path.exists(self.path(filename)):
+            os.utime(self.path(filename))  # Keep the orphan sweep off a file that is being reused
+        else:
+            write_atomic(self.path(filename), data)
+        return filename
+
+    def incref(self, filename, size=0):
+        if not is_blob(filename):
+            return
+        updated = db.session.execute(
+            db.update(Blob).where(Blob.filename == filename)
+            .values(ref_count=Blob.ref_count + 1, released_at=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Blob(filename=filename, size=size, ref_count=1))
+            except IntegrityError:
+                # Created concurrently; count our reference on that row
+                self.incref(filename, size)
+
+    def decref(self, filename):
+        """Drop one reference (caller commits); the file goes on the next GC after the grace period"""
+        if not is_blob(filename):
+            return
+        db.session.execute(
+            db.update(Blob).where(Blob.filename == filename, Blob.ref_count > 0)
+            .values(
+                ref_count=Blob.ref_count - 1,
+                released_at=db.case((Blob.ref_count == 1, datetime.utcnow()), else_=Blob.released_at)
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    def _move_aside(self, filename):
+        """Rename a blob and its derived files to hidden names; returns [(hidden path, original path)]"""
+        stem, _ = os.path.splitext(filename)
+        moved = []
+        for path in [self.path(filename)] + glob.glob(self.path(glob.escape(stem) + '-*')):
+            hidden = self.path(GC_PREFIX + os.path.basename(path))
+            try:
+                os.replace(path, hidden)
+            except FileNotFoundError:
+                continue
+            moved.append((hidden, path))
+        return moved
+
+    def collect_garbage(self):
+        """Delete unreferenced blobs past the grace period, then orphaned blob files.
+
+        Each row is deleted with a conditional DELETE first, so a blob that
+        was referenced again in the meantime is left alone. Its files are
+        moved aside before the DELETE commits and removed after it: an upload
+        of the same content that lands in between finds no file and writes a
+        new one, instead of having it removed from under its new row.
+        """
+        cutoff = datetime.utcnow() - self.grace
+        candidates = db.session.query(Blob.filename).filter(
+            Blob.ref_count <= 0, Blob.released_at < cutoff
+        ).all()
+
+        removed = 0
+        for (filename,) in candidates:
+            deleted = db.session.execute(
+                db.delete(Blob).where(Blob.filename == filename, Blob.ref_count <= 0)
+            ).rowcount
+            moved = self._move_aside(filename) if deleted else []
+            try:
+                db.session.commit()
+            except Exception:
+                for hidden, path in moved:
+                    os.replace(hidden, path)
+                raise
+            for hidden, _ in moved:
+                os.remove(hidden)
+            if deleted:
+                removed += 1
+
+        # Files whose upload transaction never committed have no row at all
+        known = {name for (name,) in db.session.query(Blob.filename)}
+        known_stems = {os.path.splitext(name)[0] for name in known}
+        cutoff_ts = cutoff.timestamp()
+        for name in os.listdir(self.folder):
+            left_over = name.startswith(GC_PREFIX)  # From a run that died before cleaning up
+            if not left_over and (not is_blob(name) or name in known or name[:HASH_LENGTH] in known_stems):
+                continue
+            path = self.path(name)
+            if os.path.getmtime(path) < cutoff_ts:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def resync(self):
+        """Rebuild every reference count from the referencing columns (does not commit)"""
+        counts = {}
+        for model, column in BLOB_REFERENCES:
+            for filename, count in db.session.query(column, db.func.count()).group_by(column):
+                if is_blob(filename):
+                    counts[filename] = counts.get(filename, 0) + count
+
+        now = datetime.utcnow()
+        for blob in Blob.query:
+            blob.ref_count = counts.pop(blob.filename, 0)
+            blob.released_at = (blob.released_at or now) if blob.ref_count == 0 else None
+        for filename, count in counts.items():
+            size = os.path.getsize(self.path(filename)) if os.path.exists(self.path(filename)) else 0
+            db.session.add(Blob(filename=filename, size=size, ref_count=count))
+
+
+def init_blob_gc(app):
+    """Run collect_garbage() periodically on a BackgroundScheduler, in one process only"""
+    lock = _ProcessLock(app.config['BLOB_GC_LOCK_FILE'])
+
+    def run_gc():
+        if not lock.acquire():
+            return
+        with app.app_context():
+            try:
+                removed = blob_store.collect_garbage()
+                if removed:
+                    app.logger.info("Removed %d unreferenced uploads", removed)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error("Upload garbage collection failed: %s", e)
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        func=run_gc,
+        trigger=IntervalTrigger(minutes=app.config['BLOB_GC_INTERVAL_MINUTES']),
+        id='blob_gc_job',
+        name='Remove unreferenced uploads',
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
+    scheduler.start()
+    atexit.register(lambda: scheduler.shutdown(wait=False))
+    return scheduler
+
+
+blob_store = BlobStore()
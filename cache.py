@@ -0,0 +1,163 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class MemoryBackend:
+    """In-process LRU cache with a per-entry TTL"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._counters = {}  # Kept outside the LRU so generations are never evicted
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    """Shared cache for multi-process deployments; any Redis-protocol server works"""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        if raw is None:
+            return False, None
+        return True, pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, pickle.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def counter(self, key):
+        return int(self._client.get(key) or 0)
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+
+class ResponseCache:
+    """Namespaced cache for query results and rendered fragments.
+
+    Each namespace has a generation number baked into its keys; invalidate()
+    bumps it, which drops every entry of that namespace at once on every
+    backend.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.default_ttl = 300
+        self.key_prefix = 'cache'
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('CACHE_BACKEND') == 'redis':
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        else:
+            self.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', 1024))
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', 300)
+        self.key_prefix = app.config.get('CACHE_KEY_PREFIX', 'cache')
+        app.extensions['response_cache'] = self
+        app.add_template_global(self.cached_fragment, 'cached')
+
+    def _generation(self, namespace):
+        return self.backend.counter(f"{self.key_prefix}:gen:{namespace}")
+
+    def _key(self, namespace, key):
+        return f"{self.key_prefix}:{namespace}:{self._generation(namespace)}:{key}"
+
+    def _count(self, namespace, outcome):
+        with self._counts_lock:
+            counts = self._counts.setdefault(namespace, {'hits': 0, 'misses': 0})
+            counts[outcome] += 1
+
+    def get_or_set(self, namespace, key, producer, ttl=None):
+        """Return the cached value for (namespace, key), calling producer() on a miss"""
+        full_key = self._key(namespace, key)
+        found, value = self.backend.get(full_key)
+        if found:
+            self._count(namespace, 'hits')
+            return value
+        self._count(namespace, 'misses')
+        value = producer()
+        self.backend.set(full_key, value, ttl if ttl is not None else self.default_ttl)
+        return value
+
+    def cached_fragment(self, namespace, key, ttl=None, caller=None):
+        """Template helper: {% call cached('home', 'rating_card') %}...{% endcall %}"""
+        return Markup(self.get_or_set(namespace, key, lambda: str(caller()), ttl))
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.incr(f"{self.key_prefix}:gen:{namespace}")
+
+    def invalidate_on_commit(self, session, *namespaces):
+        """Invalidate once `session` commits, so no reader can re-cache the old values in between"""
+        session.info.setdefault('cache_namespaces', set()).update(namespaces)
+
+    def stats(self):
+        with self._counts_lock:
+            stats = {namespace: dict(counts) for namespace, counts in self._counts.items()}
+        for counts in stats.values():
+            total = counts['hits'] + counts['misses']
+            counts['hit_rate'] = round(counts['hits'] / total, 3) if total else 0.0
+        return stats
+
+
+cache = ResponseCache()
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_namespaces(session):
+    namespaces = session.info.pop('cache_namespaces', None)
+    if namespaces and cache.backend is not None:
+        cache.invalidate(*namespaces)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_namespaces(session):
+    session.info.pop('cache_namespaces', None)
@@ -0,0 +1,60 @@
+from cache import MemoryBackend, RedisBackend
+from models import ChatSession
+
+
+class ChatSessionRegistry:
+    """Maps user_id -> active chat session id so the send path needs no lookup.
+
+    Entries live in an LRU with a TTL (CHAT_SESSION_REGISTRY_MAX,
+    CHAT_SESSION_REGISTRY_TTL). With CHAT_SESSION_REGISTRY=redis the map is
+    shared by every process and forget() reaches all of them; otherwise each
+    process keeps its own. Hits are trusted without a query: when a session
+    was closed or removed elsewhere, the chat writer finds out from its
+    batched session update, moves the messages to the user's active session
+    and forgets the stale entry. A miss falls back to
+    ChatSession.active_id_for(), which creates the session atomically.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 3600
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('CHAT_SESSION_REGISTRY') == 'redis':
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        else:
+            self.backend = MemoryBackend(app.config.get('CHAT_SESSION_REGISTRY_MAX', 10000))
+        self.ttl = app.config.get('CHAT_SESSION_REGISTRY_TTL', 3600)
+        app.extensions['chat_sessions'] = self
+
+    @staticmethod
+    def _key(user_id):
+        return f"chat_session:user:{user_id}"
+
+    def active_session_id(self, user_id):
+        """Id of the user's active session, creating the session on first use"""
+        found, session_id = self.backend.get(self._key(user_id))
+        if found:
+            return session_id
+        session_id = ChatSession.active_id_for(user_id)
+        self.backend.set(self._key(user_id), session_id, self.ttl)
+        return session_id
+
+    def active_session(self, user_id):
+        """The user's active ChatSession object (a primary-key get on a registry hit)"""
+        session = ChatSession.query.get(self.active_session_id(user_id))
+        if session is None or not session.is_active:
+            # Stale entry: the session was closed or removed elsewhere
+            self.forget(user_id)
+            session = ChatSession.query.get(self.active_session_id(user_id))
+        return session
+
+    def forget(self, *user_ids):
+        """Drop cached mappings, e.g. after a session is closed or its user deleted"""
+        for user_id in user_ids:
+            self.backend.delete(self._key(user_id))
+
+
+chat_sessions = ChatSessionRegistry()
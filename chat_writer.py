@@ -0,0 +1,352 @@
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from chat_sessions import chat_sessions
+from models import db, ChatSession, Message, User, WorkerLease
+
+# Snowflake-style ids: milliseconds since EPOCH_MS, then a 10-bit worker id and
+# a 12-bit sequence. Ids are unique across processes and roughly time-ordered,
+# and always larger than the old autoincrement ids.
+EPOCH_MS = 1704067200000  # 2024-01-01
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+
+class MessageIds:
+    """Hands out message ids without a database round trip"""
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id < 1 << WORKER_BITS:
+            raise ValueError(f"worker id {worker_id} does not fit in {WORKER_BITS} bits")
+        self.worker_id = worker_id
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            now = max(int(time.time() * 1000), self._last_ms)  # Never step back with the clock
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    now += 1  # Sequence exhausted: borrow the next millisecond
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+class WorkerIdLease:
+    """A worker id leased from worker_leases for as long as this process keeps renewing it.
+
+    Leases are claimed and renewed on their own connection, never the
+    caller's session. current() renews at half the lease interval and
+    re-acquires if another process took over an expired lease, so two live
+    processes never hold the same id.
+    """
+
+    def __init__(self, name, slots, ttl_seconds):
+        self.name = name
+        self.slots = slots
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.worker_id = None
+        self._renew_at = 0.0
+
+    def current(self):
+        """The leased worker id, renewing or re-acquiring the lease when it is due"""
+        if self.worker_id is not None and time.monotonic() < self._renew_at:
+            return self.worker_id
+        with db.engine.begin() as connection:
+            if self.worker_id is None or not self._renew(connection):
+                self.worker_id = self._acquire(connection)
+        self._renew_at = time.monotonic() + self.ttl.total_seconds() / 2
+        return self.worker_id
+
+    def _renew(self, connection):
+        leases = WorkerLease.__table__
+        return connection.execute(
+            leases.update()
+            .where(leases.c.name == self.name, leases.c.worker_id == self.worker_id,
+                   leases.c.holder == self.holder)
+            .values(expires_at=datetime.utcnow() + self.ttl)
+        ).rowcount == 1
+
+    def _acquire(self, connection):
+        leases = WorkerLease.__table__
+        now = datetime.utcnow()
+        claim = {'holder': self.holder, 'expires_at': now + self.ttl}
+
+        # Take over an expired lease; the conditional UPDATE makes concurrent takeovers exclusive
+        expired = connection.execute(
+            db.select(leases.c.worker_id)
+            .where(leases.c.name == self.name, leases.c.expires_at < now)
+            .order_by(leases.c.worker_id).limit(16)
+        ).scalars().all()
+        for worker_id in expired:
+            taken = connection.execute(
+                leases.update()
+                .where(leases.c.name == self.name, leases.c.worker_id == worker_id, leases.c.expires_at < now)
+                .values(**claim)
+            ).rowcount
+            if taken == 1:
+                return worker_id
+
+        # Otherwise insert the lowest free id; a concurrent insert of the same id fails on the primary key
+        used = set(connection.execute(db.select(leases.c.worker_id).where(leases.c.name == self.name)).scalars())
+        for worker_id in range(self.slots):
+            if worker_id in used:
+                continue
+            try:
+                with connection.begin_nested():
+                    connection.execute(leases.insert().values(name=self.name, worker_id=worker_id, **claim))
+                return worker_id
+            except IntegrityError:
+                continue
+        raise RuntimeError(f"All {self.slots} '{self.name}' worker ids are leased by live processes")
+
+    def release(self):
+        if self.worker_id is None:
+            return
+        leases = WorkerLease.__table__
+        with db.engine.begin() as connection:
+            connection.execute(leases.delete().where(
+                leases.c.name == self.name, leases.c.worker_id == self.worker_id, leases.c.holder == self.holder
+            ))
+        self.worker_id = None
+
+
+class ChatWriter:
+    """Write-behind pipeline for chat messages.
+
+    submit() assigns the id and timestamp and returns at once so the message
+    can be emitted; a background thread inserts queued messages in batches
+    every CHAT_FLUSH_INTERVAL_MS or CHAT_FLUSH_BATCH_SIZE messages and applies
+    one coalesced updated_at/unread bump per session. Pending messages are
+    flushed on interpreter exit.
+
+    Messages the database rejects (a deleted session, a duplicate id) are
+    split out of their batch and dead-lettered to CHAT_DEAD_LETTER_FILE so
+    they never hold up the rest.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._ids = None
+        self._lease = None
+        self.dead_lettered = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('CHAT_WRITE_BEHIND', True)
+        self.interval = app.config.get('CHAT_FLUSH_INTERVAL_MS', 20) / 1000
+        self.batch_size = app.config.get('CHAT_FLUSH_BATCH_SIZE', 200)
+        self.dead_letter_path = app.config.get('CHAT_DEAD_LETTER_FILE')
+        self._lease = WorkerIdLease('chat_writer', 1 << WORKER_BITS, app.config.get('CHAT_WORKER_LEASE_SECONDS', 600))
+        app.extensions['chat_writer'] = self
+        atexit.register(self.shutdown)
+
+    def _next_id(self):
+        worker_id = self._lease.current()
+        if self._ids is None or self._ids.worker_id != worker_id:
+            self._ids = MessageIds(worker_id)
+        return self._ids.next_id()
+
+    def _ensure_started(self):
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, session_id, is_admin_message, content, sender_id=None):
+        """Queue a message and return a transient Message carrying its final id and timestamp"""
+        with self._lock:
+            self._ensure_started()
+            message = Message(
+                id=self._next_id(),
+                session_id=session_id,
+                is_admin_message=is_admin_message,
+                sender_id=sender_id,
+                content=content,
+                timestamp=datetime.utcnow(),
+                is_read=False
+            )
+            self._pending.append(message)
+            pending = len(self._pending)
+
+        if not self.enabled:
+            self.flush()
+        elif pending >= self.batch_size:
+            self._wakeup.set()
+        return message
+
+    def flush(self):
+        """Write every queued message now; safe to call from any thread.
+
+        Messages queued for a session that has since been closed or removed
+        (the session registry trusts its cached ids) are moved to the user's
+        active session. A batch the database rejects is bisected until the
+        offending rows are isolated and dead-lettered. Any other failure (e.g. the database is
+        down) puts the unwritten messages back in front of the queue and is
+        raised, so the next tick retries them.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            chunks = [batch]
+            written = 0
+            with self.app.app_context():
+                while chunks:
+                    chunk = chunks.pop()
+                    try:
+                        written += self._write(chunk)
+                    except (IntegrityError, DataError) as e:
+                        if len(chunk) == 1:
+                            self._dead_letter(chunk[0], e)
+                        else:
+                            middle = len(chunk) // 2
+                            chunks += [chunk[middle:], chunk[:middle]]
+                    except Exception:
+                        unwritten = chunk + [m for part in reversed(chunks) for m in part]
+                        with self._lock:
+                            self._pending = unwritten + self._pending
+                        raise
+            return written
+
+    def _dead_letter(self, message, error):
+        """Log a message that cannot be written and keep it as a JSON line for inspection"""
+        self.dead_lettered += 1
+        self.app.logger.error("Chat message %s for session %s dead-lettered: %s",
+                              message.id, message.session_id, getattr(error, 'orig', error))
+        record = {
+            'id': message.id,
+            'session_id': message.session_id,
+            'is_admin_message': message.is_admin_message,
+            'sender_id': message.sender_id,
+            'content': message.content,
+            'timestamp': message.timestamp.isoformat(),
+            'error': str(getattr(error, 'orig', error)),
+        }
+        try:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as out:
+                out.write(json.dumps(record) + '\n')
+        except OSError as e:
+            self.app.logger.error("Could not write chat dead letter file %s: %s", self.dead_letter_path, e)
+
+    def _reroute(self, batch, stale_ids):
+        """Point messages for closed or removed sessions at their user's active session"""
+        owners = dict(db.session.query(ChatSession.id, ChatSession.user_id).filter(ChatSession.id.in_(stale_ids)))
+        for session_id in stale_ids:
+            if session_id not in owners:
+                # Removed (e.g. merged); only the user's own messages say whose it was
+                owners[session_id] = next((m.sender_id for m in batch if m.session_id == session_id
+                                           and not m.is_admin_message and m.sender_id is not None), None)
+        user_ids = {user_id for user_id in owners.values() if user_id is not None}
+        existing = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids))} if user_ids else set()
+
+        for session_id, user_id in owners.items():
+            if user_id not in existing:
+                continue
+            chat_sessions.forget(user_id)
+            active_id = ChatSession.active_id_for(user_id)
+            for message in batch:
+                if message.session_id == session_id:
+                    message.session_id = active_id
+
+    def _write(self, batch, reroute=True):
+        """Insert a batch and bump its sessions in one transaction; returns how many messages were written"""
+        # One updated_at bump and one unread increment per active session; a
+        # session that matches nothing was closed or removed since it was cached
+        bumps = {}
+        for m in batch:
+            last_at, unread = bumps.get(m.session_id, (m.timestamp, 0))
+            bumps[m.session_id] = (max(last_at, m.timestamp), unread + (0 if m.is_admin_message else 1))
+
+        try:
+            stale = set()
+            for session_id, (last_at, unread) in bumps.items():
+                updated = db.session.execute(
+                    db.update(ChatSession)
+                    .where(ChatSession.id == session_id, ChatSession.is_active.is_(True))
+                    .values(updated_at=last_at, unread_by_admin=ChatSession.unread_by_admin + unread)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if not updated:
+                    stale.add(session_id)
+            if stale:
+                db.session.rollback()
+                if reroute:
+                    self._reroute(batch, stale)
+                lost = [m for m in batch if m.session_id in stale]
+                rest = [m for m in batch if m.session_id not in stale]
+                written = self._write(rest, reroute=False) if rest else 0
+                for message in lost:
+                    self._dead_letter(message, LookupError(f"chat session {message.session_id} is closed or gone"))
+                return written
+
+            db.session.execute(db.insert(Message), [{
+                'id': m.id,
+                'session_id': m.session_id,
+                'is_admin_message': m.is_admin_message,
+                'sender_id': m.sender_id,
+                'content': m.content,
+                'timestamp': m.timestamp,
+                'is_read': False,
+            } for m in batch])
+            db.session.commit()
+            return len(batch)
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error("Chat writer flush failed, will retry: %s", e)
+                time.sleep(min(self.interval * 10, 1.0))
+
+    def shutdown(self):
+        """Stop the background thread and write whatever is still queued"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self.app is None:
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            # Exiting: keep whatever could not be written rather than lose it
+            with self._lock:
+                batch, self._pending = self._pending, []
+            for message in batch:
+                self._dead_letter(message, e)
+        try:
+            with self.app.app_context():
+                self._lease.release()
+        except Exception as e:
+            self.app.logger.warning("Could not release chat writer worker id: %s", e)
+
+
+chat_writer = ChatWriter()
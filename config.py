@@ -1,6 +1,132 @@
+import json
 import os
+import tempfile
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Expired pending booking cleanup (see expiry.py)
+    BOOKING_CLEANUP_ENABLED = os.environ.get('BOOKING_CLEANUP_ENABLED', '1') == '1'
+    BOOKING_CLEANUP_INTERVAL_MINUTES = int(os.environ.get('BOOKING_CLEANUP_INTERVAL_MINUTES', 10))
+    BOOKING_CLEANUP_LOCK_FILE = os.environ.get(
+        'BOOKING_CLEANUP_LOCK_FILE',
+        os.path.join(tempfile.gettempdir(), 'travel_agency_booking_cleanup.lock')
+    )
+
+    # Response cache for the public catalog and home page (see cache.py)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')  # 'memory' or 'redis'
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    AGENCY_STATS_CACHE_TTL = int(os.environ.get('AGENCY_STATS_CACHE_TTL', 60))
+
+    # Fail admin list views that go over their query budget (always on when TESTING)
+    QUERY_BUDGET_ENFORCE = os.environ.get('QUERY_BUDGET_ENFORCE') == '1'
+
+    # Read admin inbox unread counts from ChatSession.unread_by_admin instead of
+    # counting messages (run 'flask resync-chat-unread' once before enabling)
+    CHAT_UNREAD_COUNTER = os.environ.get('CHAT_UNREAD_COUNTER') == '1'
+
+    # Socket.IO: async worker mode ('eventlet', 'gevent', 'threading' or None to
+    # autodetect) and the message queue shared by all server processes
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or None
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None  # e.g. redis://localhost:6379/1
+    SOCKETIO_CORS_ORIGINS = os.environ.get('SOCKETIO_CORS_ORIGINS', '*')
+
+    # Write-behind chat persistence (see chat_writer.py)
+    CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', '1') == '1'
+    CHAT_FLUSH_INTERVAL_MS = int(os.environ.get('CHAT_FLUSH_INTERVAL_MS', 20))
+    CHAT_FLUSH_BATCH_SIZE = int(os.environ.get('CHAT_FLUSH_BATCH_SIZE', 200))
+    # Message id worker ids are leased per process and renewed at half this interval
+    CHAT_WORKER_LEASE_SECONDS = int(os.environ.get('CHAT_WORKER_LEASE_SECONDS', 600))
+    # Messages the database rejects are appended here as JSON lines instead of being retried
+    CHAT_DEAD_LETTER_FILE = os.environ.get(
+        'CHAT_DEAD_LETTER_FILE',
+        os.path.join(tempfile.gettempdir(), 'travel_agency_chat_dead_letters.jsonl')
+    )
+
+    # user_id -> active chat session map (see chat_sessions.py); 'redis' shares it across
+    # processes, 'memory' keeps one per process. Defaults to CACHE_BACKEND
+    CHAT_SESSION_REGISTRY = os.environ.get('CHAT_SESSION_REGISTRY', CACHE_BACKEND)
+    CHAT_SESSION_REGISTRY_MAX = int(os.environ.get('CHAT_SESSION_REGISTRY_MAX', 10000))
+    CHAT_SESSION_REGISTRY_TTL = int(os.environ.get('CHAT_SESSION_REGISTRY_TTL', 3600))
+
+    # Responsive image variants generated off-request (see images.py)
+    IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'webp')
+    IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+    # 'auto' resizes on OS threads suited to SOCKETIO_ASYNC_MODE; 'thread' forces a ThreadPoolExecutor
+    IMAGE_POOL = os.environ.get('IMAGE_POOL', 'auto')
+
+    # Content-addressed uploads (see blobs.py); unreferenced files are removed after the grace period
+    BLOB_GC_ENABLED = os.environ.get('BLOB_GC_ENABLED', '1') == '1'
+    BLOB_GC_INTERVAL_MINUTES = int(os.environ.get('BLOB_GC_INTERVAL_MINUTES', 30))
+    BLOB_GC_GRACE_MINUTES = int(os.environ.get('BLOB_GC_GRACE_MINUTES', 60))
+    BLOB_GC_LOCK_FILE = os.environ.get(
+        'BLOB_GC_LOCK_FILE',
+        os.path.join(tempfile.gettempdir(), 'travel_agency_blob_gc.lock')
+    )
+
+    # Password hashing (see passwords.py); existing hashes are upgraded on the next login
+    PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM', 'bcrypt')  # bcrypt, argon2 or scrypt
+    PASSWORD_BCRYPT_ROUNDS = int(os.environ.get('PASSWORD_BCRYPT_ROUNDS', 12))
+    PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 3))
+    PASSWORD_ARGON2_MEMORY_KIB = int(os.environ.get('PASSWORD_ARGON2_MEMORY_KIB', 65536))
+    PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 1))
+    PASSWORD_SCRYPT_LOG_N = int(os.environ.get('PASSWORD_SCRYPT_LOG_N', 15))
+    PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+    PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+    # 'auto' (OS threads suited to SOCKETIO_ASYNC_MODE), 'thread', 'process', 'eventlet' or 'gevent'
+    PASSWORD_HASH_POOL = os.environ.get('PASSWORD_HASH_POOL', 'auto')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))  # 0 = one per CPU
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+
+    # flask_login user snapshots (see identity.py); defaults to CACHE_BACKEND
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND', CACHE_BACKEND)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+
+    # Request/SQL instrumentation (see metrics.py); /metrics needs "Authorization: Bearer <token>" when set
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+    SLOW_STATEMENT_LIMIT = int(os.environ.get('SLOW_STATEMENT_LIMIT', 20))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Database engine profiles (see database.py): pool sizing per deployment,
+    # replica routing for read-only routes and per-route statement timeouts
+    DB_PROFILE = os.environ.get('DB_PROFILE', 'development')  # development, production or test
+    DB_POOL_PROFILES = {
+        'development': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 10,
+                        'pool_recycle': 1800, 'pool_pre_ping': True},
+        'production': {'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+                       'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+                       'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 5)),
+                       'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+                       'pool_pre_ping': True},
+        'test': {'pool_size': 2, 'max_overflow': 0, 'pool_timeout': 5,
+                 'pool_recycle': -1, 'pool_pre_ping': False},
+    }
+    # Postgres/MySQL only; 0 disables the limit
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get(
+        'DB_STATEMENT_TIMEOUT_MS', 5000 if DB_PROFILE == 'production' else 0))
+    DB_ROUTE_STATEMENT_TIMEOUTS_MS = json.loads(os.environ.get('DB_ROUTE_STATEMENT_TIMEOUTS_MS') or '{}') or {
+        'tour_packages': 2000,
+        'admin_bookings': 15000,
+        'admin_export': 0,  # streamed exports may run long
+    }
+    READ_REPLICA_URL = os.environ.get('READ_REPLICA_URL')
+    SQLALCHEMY_BINDS = {'replica': READ_REPLICA_URL} if READ_REPLICA_URL else {}
+    DB_REPLICA_ROUTES = ['tour_packages', 'admin_bookings', 'admin_export']
+    # Single-node SQLite deployments: WAL lets readers run alongside the writer
+    SQLITE_PRAGMAS_ENABLED = os.environ.get('SQLITE_PRAGMAS_ENABLED', '1') == '1'
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'busy_timeout': 30000,
+        'cache_size': -64000,
+    }
+
+    # In-memory coupon index (see coupons.py); reloaded on ORM changes and at least this often
+    COUPON_INDEX_TTL = int(os.environ.get('COUPON_INDEX_TTL', 60))
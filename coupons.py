@@ -0,0 +1,185 @@
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, Coupon, CouponUsage
+
+
+class CouponUnavailable(Exception):
+    """Raised when a known coupon cannot be redeemed (inactive, expired or over a limit)"""
+
+
+class CouponRule:
+    """Immutable copy of a Coupon row as held by the CouponIndex"""
+
+    __slots__ = ('id', 'code', 'discount_percent', 'is_active', 'expires_at',
+                 'max_redemptions', 'per_user_limit', 'exhausted')
+
+    def __init__(self, coupon):
+        self.id = coupon.id
+        self.code = coupon.code
+        self.discount_percent = coupon.discount_percent
+        self.is_active = coupon.is_active
+        self.expires_at = coupon.expires_at
+        self.max_redemptions = coupon.max_redemptions
+        self.per_user_limit = coupon.per_user_limit
+        self.exhausted = coupon.max_redemptions is not None and coupon.redemption_count >= coupon.max_redemptions
+
+    def is_valid(self):
+        if not self.is_active or self.exhausted:
+            return False
+        return not (self.expires_at and self.expires_at < datetime.utcnow())
+
+    def apply(self, amount):
+        """(discount, final amount) for an order total"""
+        discount = (amount * self.discount_percent) / 100
+        return discount, amount - discount
+
+
+class CouponIndex:
+    """In-memory code -> CouponRule map used by apply_coupon and process_payment.
+
+    The coupons table is small, so it is loaded whole. It is reloaded after
+    any commit that changed a Coupon through the ORM, after a redemption hits
+    a cap, and at least every COUPON_INDEX_TTL seconds so edits made by other
+    processes show up. The index only answers "is this worth trying";
+    limits are enforced by redeem_coupon in the database.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self._rules = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('COUPON_INDEX_TTL', 60)
+        app.extensions['coupon_index'] = self
+
+    def _current(self):
+        rules = self._rules
+        if rules is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return rules
+        with self._lock:
+            if self._rules is None or time.monotonic() - self._loaded_at >= self.ttl:
+                coupons = db.session.execute(db.select(Coupon)).scalars()
+                self._rules = {coupon.code: CouponRule(coupon) for coupon in coupons}
+                self._loaded_at = time.monotonic()
+            return self._rules
+
+    def get(self, code):
+        """CouponRule for a code as typed by the user, or None if there is no such coupon"""
+        if not code:
+            return None
+        return self._current().get(code.strip())
+
+    def invalidate(self):
+        self._rules = None
+
+
+coupon_index = CouponIndex()
+
+
+def uses_by(coupon_id, user_id):
+    """How many times the user has redeemed the coupon"""
+    count = db.session.execute(
+        db.select(CouponUsage.count).where(CouponUsage.coupon_id == coupon_id, CouponUsage.user_id == user_id)
+    ).scalar()
+    return count or 0
+
+
+def _ensure_usage_row(coupon_id, user_id):
+    """Insert-or-select the per-user counter row; a concurrent duplicate insert loses quietly"""
+    if db.session.get(CouponUsage, (coupon_id, user_id)) is not None:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(CouponUsage(coupon_id=coupon_id, user_id=user_id, count=0))
+    except IntegrityError:
+        pass
+
+
+def redeem_coupon(rule, user_id):
+    """Count one use of a coupon inside the caller's transaction.
+
+    Both limits are conditional UPDATEs, so the database serialises
+    concurrent checkouts on the counter rows and a capped coupon can never
+    be overspent. On CouponUnavailable the caller must roll back, which also
+    undoes a global claim made before the per-user check failed.
+    """
+    if not rule.is_valid():
+        raise CouponUnavailable("This coupon is invalid or has expired.")
+
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        db.update(Coupon)
+        .where(
+            Coupon.id == rule.id,
+            Coupon.is_active.is_(True),
+            db.or_(Coupon.expires_at.is_(None), Coupon.expires_at >= now),
+            db.or_(Coupon.max_redemptions.is_(None), Coupon.redemption_count < Coupon.max_redemptions)
+        )
+        .values(redemption_count=Coupon.redemption_count + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    if not claimed:
+        coupon_index.invalidate()
+        raise CouponUnavailable("This coupon has reached its redemption limit.")
+
+    # Uses are counted even without a per-user limit, so a limit set later covers earlier redemptions
+    _ensure_usage_row(rule.id, user_id)
+    limit = db.select(Coupon.per_user_limit).where(Coupon.id == rule.id).scalar_subquery()
+    claimed = db.session.execute(
+        db.update(CouponUsage)
+        .where(
+            CouponUsage.coupon_id == rule.id,
+            CouponUsage.user_id == user_id,
+            db.or_(limit.is_(None), CouponUsage.count < limit)
+        )
+        .values(count=CouponUsage.count + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    if not claimed:
+        raise CouponUnavailable("You have already used this coupon the maximum number of times.")
+
+
+def redeem_for_booking(booking, code, user_id):
+    """Redeem a coupon code against an unpaid booking and price it (no commit).
+
+    Unknown codes are ignored and return None; known coupons that cannot be
+    redeemed raise CouponUnavailable.
+    """
+    rule = coupon_index.get(code)
+    if rule is None:
+        return None
+    redeem_coupon(rule, user_id)
+    booking.discount_amount, booking.final_amount = rule.apply(booking.total_amount)
+    booking.coupon_code = rule.code
+    return rule
+
+
+# Reload the index once a coupon change is committed
+@event.listens_for(Coupon, 'after_insert')
+@event.listens_for(Coupon, 'after_update')
+@event.listens_for(Coupon, 'after_delete')
+def _remember_coupon_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info['coupons_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_coupons(session):
+    if session.info.pop('coupons_changed', False):
+        coupon_index.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_coupon_change(session):
+    session.info.pop('coupons_changed', None)
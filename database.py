@@ -0,0 +1,165 @@
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+from metrics import Histogram, metrics
+
+POOL_WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_name = 'default'
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait = Histogram(POOL_WAIT_BUCKETS)
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait.observe(time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats_name = self.stats_name
+        return pool
+
+
+class RoutingSession(FlaskSession):
+    """Sends plain SELECTs to the 'replica' bind while a read-only route runs.
+
+    Anything that writes, locks (FOR UPDATE) or reads after the session has
+    pending changes stays on the primary so a request always sees its own
+    writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _use_replica() and _is_plain_select(clause) and not (self.new or self.dirty or self.deleted):
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _use_replica():
+    return has_request_context() and g.get('_use_replica', False)
+
+
+def _is_plain_select(clause):
+    return clause is not None and getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def configure_engine_options(app):
+    """Fill SQLALCHEMY_ENGINE_OPTIONS from DB_PROFILE; call before db.init_app(app)"""
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+    if not uri:
+        return
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if not _is_memory_sqlite(make_url(uri)):
+        profile = app.config['DB_POOL_PROFILES'][app.config['DB_PROFILE']]
+        options.setdefault('poolclass', TimedQueuePool)
+        for key, value in profile.items():
+            options.setdefault(key, value)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def _apply_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return on_connect
+
+
+def _set_statement_timeout(session, transaction, connection):
+    """Apply the current route's statement timeout to each new transaction.
+
+    PostgreSQL scopes it to the transaction. MySQL only has a session-wide
+    setting, so the connection is flagged and _reset_statement_timeout puts
+    the server default back before the pool hands it to anyone else.
+    """
+    timeout = g.get('_statement_timeout_ms') if has_request_context() else None
+    if not timeout:
+        return
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+    elif dialect in ('mysql', 'mariadb'):
+        connection.exec_driver_sql(f"SET SESSION max_execution_time = {int(timeout)}")
+        connection.info['statement_timeout_set'] = True
+
+
+def _reset_statement_timeout(dbapi_connection, connection_record):
+    if not connection_record.info.pop('statement_timeout_set', False) or dbapi_connection is None:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SET SESSION max_execution_time = DEFAULT")
+    finally:
+        cursor.close()
+
+
+def _route_settings():
+    config = current_app.config
+    endpoint = request.endpoint
+    g._use_replica = endpoint in config['DB_REPLICA_ROUTES']
+    g._statement_timeout_ms = config['DB_ROUTE_STATEMENT_TIMEOUTS_MS'].get(endpoint, config['DB_STATEMENT_TIMEOUT_MS'])
+
+
+def _pool_metrics():
+    engines = current_app.extensions['sqlalchemy'].engines
+    pools = [(name or 'default', engine.pool) for name, engine in engines.items()
+             if isinstance(engine.pool, TimedQueuePool)]
+    lines = ['# TYPE db_pool_checkout_wait_seconds histogram']
+    for name, pool in pools:
+        with pool._stats_lock:
+            lines.extend(pool.wait.lines('db_pool_checkout_wait_seconds', {'bind': name}))
+    for metric, kind, read in (
+        ('db_pool_checkouts_total', 'counter', lambda p: p.checkouts),
+        ('db_pool_timeouts_total', 'counter', lambda p: p.timeouts),
+        ('db_pool_size', 'gauge', lambda p: p.size()),
+        ('db_pool_checked_out', 'gauge', lambda p: p.checkedout()),
+        ('db_pool_overflow', 'gauge', lambda p: p.overflow()),
+    ):
+        lines.append(f'# TYPE {metric} {kind}')
+        lines.extend(f'{metric}{{bind="{name}"}} {read(pool)}' for name, pool in pools)
+    return lines
+
+
+def init_database(app, db):
+    """Hook pragmas, replica routing, statement timeouts and pool metrics into the app"""
+    with app.app_context():
+        for name, engine in db.engines.items():
+            if isinstance(engine.pool, TimedQueuePool):
+                engine.pool.stats_name = name or 'default'
+            if engine.dialect.name == 'sqlite' and app.config['SQLITE_PRAGMAS_ENABLED']:
+                event.listen(engine, 'connect', _apply_sqlite_pragmas(app.config['SQLITE_PRAGMAS']))
+            if engine.dialect.name in ('mysql', 'mariadb'):
+                event.listen(engine, 'checkin', _reset_statement_timeout)
+
+    event.listen(RoutingSession, 'after_begin', _set_statement_timeout)
+    app.before_request(_route_settings)
+    metrics.register_collector(_pool_metrics)
@@ -0,0 +1,73 @@
+import atexit
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from models import db
+from reservations import release_expired_holds
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, assume a single process
+    fcntl = None
+
+
+def purge_expired_bookings():
+    """Delete every expired pending booking in one set-based DELETE and release its seats"""
+    return release_expired_holds()
+
+
+class _ProcessLock:
+    """Non-blocking flock on a shared file so only one worker process runs the job.
+
+    The lock is kept once acquired; if the owning worker dies the OS releases it
+    and the next worker to tick takes over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    def acquire(self):
+        if self._handle is not None or fcntl is None:
+            return True
+        handle = open(self.path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._handle = handle
+        return True
+
+
+def init_expiry_scheduler(app):
+    """Schedule the expired-booking purge on a BackgroundScheduler for this app"""
+    lock = _ProcessLock(app.config['BOOKING_CLEANUP_LOCK_FILE'])
+
+    def run_cleanup():
+        if not lock.acquire():
+            return
+        with app.app_context():
+            try:
+                deleted = purge_expired_bookings()
+                if deleted:
+                    app.logger.info("Cleaned up %d expired pending bookings", deleted)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error("Error cleaning up expired bookings: %s", e)
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        func=run_cleanup,
+        trigger=IntervalTrigger(minutes=app.config['BOOKING_CLEANUP_INTERVAL_MINUTES']),
+        id='cleanup_job',
+        name='Clean up expired pending bookings',
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
+    scheduler.start()
+    atexit.register(lambda: scheduler.shutdown(wait=False))
+    return scheduler
+
@@ -0,0 +1,150 @@
+import csv
+import io
+from datetime import date, datetime
+
+from models import db, Booking, Refund, CustomTrip
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+EXPORT_CHUNK_SIZE = 5000
+
+# Export name -> (model, column used for `since` timestamps)
+EXPORTABLE = {
+    'bookings': (Booking, Booking.created_at),
+    'refunds': (Refund, Refund.request_date),
+    'custom_trips': (CustomTrip, None),
+}
+
+EXPORT_FORMATS = ['csv', 'parquet']
+
+
+class ExportError(ValueError):
+    """Raised for an unknown table or format, or an option it does not support"""
+
+
+def export_statement(name, since_id=None, since=None):
+    """SELECT for an incremental export of a table, in id order"""
+    if name not in EXPORTABLE:
+        raise ExportError(f"Unknown export '{name}'")
+    model, timestamp_column = EXPORTABLE[name]
+    table = model.__table__
+
+    statement = db.select(*table.columns).order_by(table.c.id)
+    if since_id is not None:
+        statement = statement.where(table.c.id > since_id)
+    if since is not None:
+        if timestamp_column is None:
+            raise ExportError(f"'{name}' has no timestamp; use since_id instead")
+        statement = statement.where(timestamp_column >= since)
+    return statement
+
+
+def export_rows(statement, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield (column_names, rows) chunks for an export statement.
+
+    Plain Core rows are read from a server-side cursor with yield_per, so
+    nothing is added to the ORM session and memory stays constant.
+    """
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    columns = list(result.keys())
+    for partition in result.partitions():
+        yield columns, partition
+
+
+def iter_csv(columns, chunks):
+    """Render export chunks as CSV text, one piece per chunk.
+
+    The header comes first on its own, so an export matching no rows is
+    still a valid CSV file rather than an empty one.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+    for _, rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+
+class _StreamSink:
+    """Write-only file object that hands out what was written since the last drain"""
+
+    def __init__(self):
+        self._buffer = io.BytesIO()
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._buffer.write(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate(0)
+        return data
+
+
+def _arrow_type(column):
+    python_type = column.type.python_type
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is datetime:
+        return pa.timestamp('us')
+    if python_type is date:
+        return pa.date32()
+    return pa.string()
+
+
+def iter_parquet(name, chunks):
+    """Render export chunks as a Parquet file, one row group per chunk"""
+    table = EXPORTABLE[name][0].__table__
+    schema = pa.schema([(column.name, _arrow_type(column)) for column in table.columns])
+
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for columns, rows in chunks:
+        data = {column: [row[i] for row in rows] for i, column in enumerate(columns)}
+        writer.write_table(pa.Table.from_pydict(data, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def iter_export(name, fmt='csv', since_id=None, since=None):
+    """Stream a whole export as bytes in the requested format.
+
+    Arguments are validated up front so errors surface before any output.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Unknown format '{fmt}'")
+    if fmt == 'parquet' and pq is None:
+        raise ExportError("Parquet export needs pyarrow installed")
+    statement = export_statement(name, since_id=since_id, since=since)
+    chunks = export_rows(statement)
+    if fmt == 'parquet':
+        return iter_parquet(name, chunks)
+    columns = [column.name for column in statement.selected_columns]
+    return (piece.encode('utf-8') for piece in iter_csv(columns, chunks))
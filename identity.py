@@ -0,0 +1,113 @@
+import threading
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, load_only
+
+from cache import MemoryBackend, RedisBackend
+from models import db, User
+
+# Columns copied into the cached snapshot; the password hash is never cached
+SNAPSHOT_FIELDS = ('id', 'username', 'email', 'full_name', 'age', 'gender', 'occupation',
+                   'address', 'phone', 'education', 'is_admin', 'image_file', 'image_variants')
+
+
+class UserSnapshot(UserMixin):
+    """Read-only stand-in for User used as current_user.
+
+    Carries the profile columns only; call to_user() for the ORM row before
+    changing anything.
+    """
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+    def to_user(self):
+        return db.session.get(User, self.id)
+
+    def __repr__(self):
+        return f"<UserSnapshot {self.id} {self.username!r}>"
+
+
+class UserIdentityCache:
+    """TTL cache of UserSnapshot data behind flask_login's user_loader.
+
+    Entries are dropped after any commit that updated or deleted the user
+    through the ORM (profile edits, admin flag changes, deletion), so a
+    stale snapshot can only come from writes that bypass the ORM; for those
+    USER_CACHE_TTL bounds the staleness.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 300
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('USER_CACHE_BACKEND', app.config.get('CACHE_BACKEND')) == 'redis':
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        else:
+            self.backend = MemoryBackend(app.config.get('USER_CACHE_MAX_ENTRIES', 10000))
+        self.ttl = app.config.get('USER_CACHE_TTL', 300)
+        app.extensions['user_identity'] = self
+
+    @staticmethod
+    def _key(user_id):
+        return f"user_identity:{user_id}"
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def load(self, user_id):
+        """Snapshot for a user id, or None if the user does not exist"""
+        found, fields = self.backend.get(self._key(user_id))
+        self._count(found)
+        if not found:
+            user = User.query.options(load_only(*[getattr(User, f) for f in SNAPSHOT_FIELDS])).get(user_id)
+            if user is None:
+                return None
+            fields = {f: getattr(user, f) for f in SNAPSHOT_FIELDS}
+            self.backend.set(self._key(user_id), fields, self.ttl)
+        return UserSnapshot(fields)
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self.backend.delete(self._key(user_id))
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {'hits': self._hits, 'misses': self._misses,
+                    'hit_rate': round(self._hits / total, 3) if total else 0.0}
+
+
+user_identity = UserIdentityCache()
+
+
+# Collect changed users per session and drop their snapshots once the change is committed
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _remember_changed_user(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    changed = session.info.pop('changed_user_ids', None)
+    if changed and user_identity.backend is not None:
+        user_identity.invalidate(*changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
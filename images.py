@@ -0,0 +1,159 @@
+import atexit
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from assets import assets
+from blobs import blob_store, write_atomic
+from cache import cache
+from identity import user_identity
+from models import db, TourPackage, HomeImage, User
+from offload import async_mode_of, make_runner, pool_kind, spawn_green
+
+# Image kind -> (model, column holding the original filename, cache namespace, variant widths)
+IMAGE_KINDS = {
+    'package': (TourPackage, 'image_filename', 'catalog', (320, 640, 1024, 1600)),
+    'home': (HomeImage, 'filename', 'home', (640, 1280, 1920, 2560)),
+    'avatar': (User, 'image_file', None, (100, 200, 400)),
+}
+
+
+def variant_filename(filename, width, fmt):
+    stem, _ = os.path.splitext(filename)
+    return f"{stem}-{width}w.{fmt}"
+
+
+def srcset(variants):
+    """Template helper: srcset attribute value for a list of [width, filename] variants"""
+    return ', '.join(
+        f"{assets.asset_url('uploads/' + name)} {width}w" for width, name in variants or []
+    )
+
+
+def image_url(filename, variants=None, width=None, default='uploads/default.png'):
+    """Template helper: URL of the smallest variant at least `width` wide, else the original"""
+    if variants and width:
+        for variant_width, name in variants:
+            if variant_width >= width:
+                return assets.asset_url('uploads/' + name)
+        return assets.asset_url('uploads/' + variants[-1][1])
+    if filename:
+        return assets.asset_url('uploads/' + filename)
+    return assets.asset_url(default)
+
+
+class ImagePipeline:
+    """Resizes uploads into responsive variants on a worker pool.
+
+    The request only stores the original in the blob store and queues it; a
+    worker writes one IMAGE_FORMAT file per width next to the blob (they are
+    deleted with it) and records the [width, filename] list in the row's
+    image_variants column. Until then templates fall back to the original.
+
+    Under eventlet or gevent (IMAGE_POOL=auto) each job is a green thread and
+    only the Pillow work runs on IMAGE_WORKERS real OS threads, so a resize
+    never stalls the hub.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._green_pool = None
+        self._run_resize = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.upload_folder = app.config['UPLOAD_FOLDER']
+        self.format = app.config.get('IMAGE_FORMAT', 'webp')
+        self.quality = app.config.get('IMAGE_QUALITY', 80)
+        workers = app.config.get('IMAGE_WORKERS', 2)
+        # IMAGE_WORKERS=0 processes inline, e.g. for tests and CLI scripts
+        kind = pool_kind(app.config.get('IMAGE_POOL', 'auto'), async_mode_of(app))
+        if workers and kind in ('eventlet', 'gevent'):
+            self._green_pool = kind
+            self._run_resize = make_runner(kind, workers)
+        elif workers:
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix='images')
+        app.extensions['image_pipeline'] = self
+        app.add_template_global(srcset, 'srcset')
+        app.add_template_global(image_url, 'image_url')
+        atexit.register(self.shutdown)
+
+    def save_upload(self, file_storage):
+        """Store an upload in the blob store, referenced once (caller commits)"""
+        return blob_store.put(file_storage)
+
+    def release(self, filename):
+        """Drop a row's reference to its image (caller commits); GC deletes the files later"""
+        blob_store.decref(filename)
+
+    def replace(self, obj, kind, file_storage):
+        """Point obj at a new upload and release the old one (caller commits)"""
+        _, column, _, _ = IMAGE_KINDS[kind]
+        filename = self.save_upload(file_storage)
+        old_filename = getattr(obj, column)
+        self.release(old_filename)  # Same content re-uploaded: evens out save_upload's reference
+        if old_filename != filename:
+            setattr(obj, column, filename)
+            obj.image_variants = None
+        return filename
+
+    def submit(self, kind, obj_id, filename):
+        """Queue variant generation; call after the row pointing at filename is committed"""
+        if self._green_pool is not None:
+            return spawn_green(self._green_pool, self._process, kind, obj_id, filename)
+        if self._executor is None:
+            return self._process(kind, obj_id, filename)
+        return self._executor.submit(self._process, kind, obj_id, filename)
+
+    def _resize(self, filename, widths):
+        variants = []
+        with Image.open(os.path.join(self.upload_folder, filename)) as source:
+            image = ImageOps.exif_transpose(source)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+            # Never upscale; the smallest width is always produced
+            targets = [w for w in widths if w < image.width] or [min(widths[0], image.width)]
+            for width in targets:
+                height = max(1, round(image.height * width / image.width))
+                name = variant_filename(filename, width, self.format)
+                path = os.path.join(self.upload_folder, name)
+                if not os.path.exists(path):  # Shared blob: another row may have made it already
+                    buffer = io.BytesIO()
+                    image.resize((width, height), Image.LANCZOS).save(buffer, self.format.upper(), quality=self.quality)
+                    write_atomic(path, buffer.getvalue())
+                variants.append([width, name])
+        return variants
+
+    def _process(self, kind, obj_id, filename):
+        model, column, namespace, widths = IMAGE_KINDS[kind]
+        with self.app.app_context():
+            try:
+                if self._run_resize is not None:
+                    variants = self._run_resize(self._resize, filename, widths)
+                else:
+                    variants = self._resize(filename, widths)
+                # Only attach if the row still uses this upload (it may have been replaced meanwhile)
+                updated = db.session.query(model).filter(
+                    model.id == obj_id, getattr(model, column) == filename
+                ).update({'image_variants': variants}, synchronize_session=False)
+                db.session.commit()
+                if updated and namespace:
+                    cache.invalidate(namespace)
+                if updated and model is User:
+                    user_identity.invalidate(obj_id)  # Bulk UPDATE skips the ORM events
+                return variants
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error("Image processing failed for %s: %s", filename, e)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,38 @@
+from sqlalchemy.orm import joinedload, selectinload, load_only
+
+from models import User, Booking, CustomTrip, AgencyRating, Refund, ChatSession, RatingReplyForm as RatingReplyModel
+
+# Named eager-loading profiles for the admin list views. Each one loads
+# exactly the relationships its template touches, so a page renders in a
+# fixed number of queries instead of one per row.
+LOADER_PROFILES = {
+    'booking_list': (
+        selectinload(Booking.user).load_only(User.id, User.username, User.email),
+        selectinload(Booking.package),
+        selectinload(Booking.custom_trip),
+    ),
+    'custom_trip_list': (
+        joinedload(CustomTrip.user).load_only(User.id, User.username, User.email),
+    ),
+    'rating_list': (
+        joinedload(AgencyRating.user).load_only(User.id, User.username, User.email),
+        selectinload(AgencyRating.replies).joinedload(RatingReplyModel.user).load_only(User.id, User.username),
+    ),
+    'refund_list': (
+        joinedload(Refund.user),
+        joinedload(Refund.custom_trip),
+        joinedload(Refund.booking).joinedload(Booking.package),
+        joinedload(Refund.booking).joinedload(Booking.custom_trip),
+    ),
+    'chat_session_list': (
+        joinedload(ChatSession.user).load_only(User.id, User.username, User.email),
+    ),
+    'user_list': (
+        load_only(User.id, User.username, User.email, User.phone),
+    ),
+}
+
+
+def with_profile(query, name):
+    """Apply a named loader profile to a query"""
+    return query.options(*LOADER_PROFILES[name])
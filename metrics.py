@@ -0,0 +1,221 @@
+import bisect
+import heapq
+import json
+import re
+import threading
+import time
+from functools import wraps
+
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds in seconds, Prometheus style (+Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_statement(statement):
+    """Collapse whitespace and literals so identical queries group together"""
+    return _LITERALS.sub('?', ' '.join(statement.split()))[:500]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{name}_bucket{_labels(labels, le=le)} {cumulative}'
+        yield f'{name}_sum{_labels(labels)} {self.total}'
+        yield f'{name}_count{_labels(labels)} {cumulative}'
+
+
+def _labels(labels, **extra):
+    items = dict(labels, **extra)
+    if not items:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in items.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(items, escaped)) + '}'
+
+
+class _Unit:
+    """Per-request (or per-event) counters, kept on flask.g"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+
+
+class Metrics:
+    """In-process performance metrics for HTTP requests, Socket.IO events and SQL.
+
+    Requests are timed from before_request to after_request; socket handlers
+    are wrapped with track_event(). Engine cursor events attribute every
+    statement to the request or event running on the same context. /metrics
+    serves Prometheus text (each worker process reports its own numbers),
+    and a JSON line is logged for any unit slower than SLOW_REQUEST_MS.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.latency = {}     # (kind, name) -> Histogram
+        self.statuses = {}    # (endpoint, method, status) -> count
+        self.sql_counts = {}  # (kind, name) -> [queries, seconds]
+        self.sql_latency = Histogram(SQL_BUCKETS)
+        self.slowest = []     # min-heap of (seconds, statement, where)
+        self.slow_statement_limit = 20
+        self.slow_threshold = 0.5
+        self.collectors = []  # callables returning extra exposition lines
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_threshold = app.config.get('SLOW_REQUEST_MS', 500) / 1000
+        self.slow_statement_limit = app.config.get('SLOW_STATEMENT_LIMIT', 20)
+        self.token = app.config.get('METRICS_TOKEN')
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        app.extensions['metrics'] = self
+
+    # ----- HTTP -----
+
+    def _before_request(self):
+        g._metrics_unit = _Unit(request.endpoint or 'unmatched')
+
+    def _after_request(self, response):
+        unit = g.pop('_metrics_unit', None)
+        if unit is not None and unit.name not in ('metrics', 'static', 'assets'):
+            self._finish('http', unit.name, unit, method=request.method, status=response.status_code)
+        return response
+
+    # ----- Socket.IO -----
+
+    def track_event(self, name):
+        """Decorator for Socket.IO handlers: time the event and its SQL like a request"""
+        def decorator(handler):
+            @wraps(handler)
+            def wrapped(*args, **kwargs):
+                g._metrics_unit = unit = _Unit(name)
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    g.pop('_metrics_unit', None)
+                    self._finish('socketio', name, unit)
+            return wrapped
+        return decorator
+
+    # ----- SQL -----
+
+    def record_statement(self, statement, seconds):
+        unit = g.get('_metrics_unit') if has_app_context() else None
+        if unit is not None:
+            unit.queries += 1
+            unit.sql_time += seconds
+        with self._lock:
+            self.sql_latency.observe(seconds)
+            if len(self.slowest) >= self.slow_statement_limit and seconds <= self.slowest[0][0]:
+                return
+        # Only candidates for the slow list are normalized, and outside the lock
+        entry = (seconds, normalize_statement(statement), unit.name if unit else 'background')
+        with self._lock:
+            if len(self.slowest) < self.slow_statement_limit:
+                heapq.heappush(self.slowest, entry)
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    # ----- Aggregation -----
+
+    def _finish(self, kind, name, unit, method=None, status=None):
+        elapsed = time.perf_counter() - unit.started
+        with self._lock:
+            self.latency.setdefault((kind, name), Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            sql = self.sql_counts.setdefault((kind, name), [0, 0.0])
+            sql[0] += unit.queries
+            sql[1] += unit.sql_time
+            if status is not None:
+                key = (name, method, status)
+                self.statuses[key] = self.statuses.get(key, 0) + 1
+        if elapsed >= self.slow_threshold:
+            current_app.logger.warning(json.dumps({
+                'event': 'slow_' + kind, 'name': name, 'method': method, 'status': status,
+                'duration_ms': round(elapsed * 1000, 1), 'sql_queries': unit.queries,
+                'sql_ms': round(unit.sql_time * 1000, 1),
+            }))
+
+    def slow_statements(self):
+        with self._lock:
+            return [{'seconds': round(s, 6), 'statement': stmt, 'where': where}
+                    for s, stmt, where in sorted(self.slowest, reverse=True)]
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, prefix, label in (('http', 'http_request', 'endpoint'), ('socketio', 'socketio_event', 'event')):
+                entries = sorted((name, h) for (k, name), h in self.latency.items() if k == kind)
+                lines.append(f'# TYPE {prefix}_duration_seconds histogram')
+                for name, histogram in entries:
+                    lines.extend(histogram.lines(f'{prefix}_duration_seconds', {label: name}))
+                lines.append(f'# TYPE {prefix}_sql_queries_total counter')
+                lines.extend(f'{prefix}_sql_queries_total{_labels({label: name})} {self.sql_counts[(kind, name)][0]}'
+                             for name, _ in entries)
+                lines.append(f'# TYPE {prefix}_sql_seconds_total counter')
+                lines.extend(f'{prefix}_sql_seconds_total{_labels({label: name})} {self.sql_counts[(kind, name)][1]}'
+                             for name, _ in entries)
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.statuses.items()):
+                lines.append(f'http_requests_total{_labels({"endpoint": endpoint, "method": method, "status": status})} {count}')
+            lines.append('# TYPE sql_statement_duration_seconds histogram')
+            lines.extend(self.sql_latency.lines('sql_statement_duration_seconds', {}))
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+    def register_collector(self, collector):
+        """Add a callable whose lines are appended to every /metrics scrape"""
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def metrics_view(self):
+        if self.token and request.headers.get('Authorization') != f'Bearer {self.token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_started', []).append((id(cursor), time.perf_counter()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('_metrics_started')
+    if started:
+        metrics.record_statement(statement, time.perf_counter() - started.pop()[1])
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    # so it is not paired with the connection's next statement
+    started = context.connection.info.get('_metrics_started') if context.connection is not None else None
+    if started and context.cursor is not None and started[-1][0] == id(context.cursor):
+        started.pop()
+
+
+metrics = Metrics()
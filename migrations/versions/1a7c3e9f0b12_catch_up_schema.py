@@ -0,0 +1,200 @@
+"""Bring a baseline database up to the current models
+
+Revision ID: 1a7c3e9f0b12
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+The schema was originally created with db.create_all(), and columns and
+tables added since then were never migrated. This revision adds whatever
+is missing and fills the new columns from existing data, so an upgraded
+database matches a freshly created one. Columns and tables that already
+exist are left alone, and so is their data.
+"""
+import re
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a7c3e9f0b12'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _counter(name):
+    return sa.Column(name, sa.Integer(), nullable=False, server_default='0')
+
+
+NEW_COLUMNS = {
+    'home_image': [sa.Column('image_variants', sa.JSON(), nullable=True)],
+    'users': [sa.Column('image_variants', sa.JSON(), nullable=True)],
+    'tour_package': [
+        _counter('duration_days'),
+        _counter('reserved_members'),
+        sa.Column('image_variants', sa.JSON(), nullable=True),
+    ],
+    'chat_sessions': [_counter('unread_by_admin')],
+    'agency_stats': [_counter('rating_sum')] + [_counter(f'count_{stars}') for stars in range(1, 6)],
+}
+
+# Copied from models.PENDING_BOOKING_TTL and models.parse_duration_days so this revision never changes under it
+PENDING_BOOKING_TTL = timedelta(hours=1)
+DURATION_PATTERN = re.compile(r'(\d+)\s*(w(?:ee)?ks?)?', re.IGNORECASE)
+
+
+def _parse_duration_days(text):
+    match = DURATION_PATTERN.search(text or '')
+    if not match:
+        return 0
+    days = int(match.group(1))
+    return days * 7 if match.group(2) else days
+
+
+def _add_missing_columns(inspector, tables):
+    """Add the NEW_COLUMNS a table lacks; returns {table: {added column names}}"""
+    added = {}
+    for table, columns in NEW_COLUMNS.items():
+        if table not in tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        missing = [column for column in columns if column.name not in existing]
+        if missing:
+            with op.batch_alter_table(table) as batch_op:
+                for column in missing:
+                    batch_op.add_column(column)
+            added[table] = {column.name for column in missing}
+    return added
+
+
+def _create_missing_tables(tables):
+    if 'blobs' not in tables:
+        op.create_table(
+            'blobs',
+            sa.Column('filename', sa.String(100), primary_key=True),
+            sa.Column('size', sa.Integer(), nullable=False),
+            sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('released_at', sa.DateTime(), nullable=True),
+        )
+        op.create_index('ix_blobs_released_at', 'blobs', ['released_at'])
+
+
+def _backfill_duration_days():
+    """Parse duration_days for every package; the column only fills on ORM writes otherwise"""
+    bind = op.get_bind()
+    packages = sa.table('tour_package', sa.column('id', sa.Integer), sa.column('duration', sa.String),
+                        sa.column('duration_days', sa.Integer))
+    rows = [{'package_id': package_id, 'days': _parse_duration_days(duration)}
+            for package_id, duration in bind.execute(sa.select(packages.c.id, packages.c.duration))]
+    rows = [row for row in rows if row['days']]
+    if rows:
+        bind.execute(
+            packages.update().where(packages.c.id == sa.bindparam('package_id')).values(duration_days=sa.bindparam('days')),
+            rows
+        )
+
+
+def _backfill_reserved_members():
+    """Seat counters: completed bookings plus pending holds that have not expired (as resync_reserved_members)"""
+    packages = sa.table('tour_package', sa.column('id', sa.Integer), sa.column('reserved_members', sa.Integer))
+    bookings = sa.table('booking', sa.column('package_id', sa.Integer), sa.column('members', sa.Integer),
+                        sa.column('payment_status', sa.String), sa.column('created_at', sa.DateTime))
+    hold_start = datetime.utcnow() - PENDING_BOOKING_TTL
+    reserved = sa.select(sa.func.coalesce(sa.func.sum(bookings.c.members), 0)).where(
+        bookings.c.package_id == packages.c.id,
+        sa.or_(bookings.c.payment_status == 'Completed',
+               sa.and_(bookings.c.payment_status == 'Pending', bookings.c.created_at >= hold_start))
+    ).scalar_subquery()
+    op.execute(packages.update().values(reserved_members=reserved))
+
+
+def _backfill_unread_by_admin():
+    sessions = sa.table('chat_sessions', sa.column('id', sa.Integer), sa.column('unread_by_admin', sa.Integer))
+    messages = sa.table('messages', sa.column('id'), sa.column('session_id', sa.Integer),
+                        sa.column('is_admin_message', sa.Boolean), sa.column('is_read', sa.Boolean))
+    unread = sa.select(sa.func.count(messages.c.id)).where(
+        messages.c.session_id == sessions.c.id,
+        messages.c.is_admin_message.is_(False),
+        messages.c.is_read.is_(False)
+    ).scalar_subquery()
+    op.execute(sessions.update().values(unread_by_admin=unread))
+
+
+def _reconcile_agency_stats():
+    """Recompute the totals and histogram from agency_ratings into one row (as AgencyStats.reconcile)"""
+    bind = op.get_bind()
+    ratings = sa.table('agency_ratings', sa.column('id', sa.Integer), sa.column('rating', sa.Integer))
+    counters = ['rating_sum'] + [f'count_{stars}' for stars in range(1, 6)]
+    stats = sa.table('agency_stats', sa.column('id', sa.Integer), sa.column('total_ratings', sa.Integer),
+                     sa.column('average_rating', sa.Float), *[sa.column(name, sa.Integer) for name in counters])
+
+    columns = [sa.func.count(ratings.c.id), sa.func.coalesce(sa.func.sum(ratings.c.rating), 0)]
+    columns += [sa.func.coalesce(sa.func.sum(sa.case((ratings.c.rating == stars, 1), else_=0)), 0)
+                for stars in range(1, 6)]
+    total, rating_sum, *counts = bind.execute(sa.select(*columns)).one()
+    values = dict(zip(counters, [rating_sum] + counts), total_ratings=total,
+                  average_rating=rating_sum / total if total else 0.0)
+
+    # Earlier code could create a second row under concurrency; keep the one readers use
+    keep = bind.execute(sa.select(sa.func.min(stats.c.id))).scalar()
+    if keep is None:
+        bind.execute(stats.insert().values(id=1, **values))
+    else:
+        bind.execute(stats.delete().where(stats.c.id != keep))
+        bind.execute(stats.update().where(stats.c.id == keep).values(**values))
+
+
+def _create_active_session_index(inspector):
+    """One active chat session per user: the backstop ChatSession.active_id_for relies on"""
+    dialect = op.get_bind().dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        return  # Partial indexes are not available; active_id_for falls back to its lookup
+    names = {index['name'] for index in inspector.get_indexes('chat_sessions')}
+    if 'ux_chat_sessions_active_user' in names:
+        return
+
+    # Close all but the oldest active session of each user so the index can be built;
+    # their messages stay attached to the closed sessions
+    sessions = sa.table('chat_sessions', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer),
+                        sa.column('is_active', sa.Boolean))
+    oldest = sa.alias(sessions, 'oldest')
+    keep = sa.select(sa.func.min(oldest.c.id)).where(
+        oldest.c.user_id == sessions.c.user_id, oldest.c.is_active.is_(True)
+    ).scalar_subquery()
+    op.execute(sessions.update().where(sessions.c.is_active.is_(True), sessions.c.id != keep).values(is_active=False))
+
+    op.create_index('ux_chat_sessions_active_user', 'chat_sessions', ['user_id'], unique=True,
+                    sqlite_where=sa.text('is_active'), postgresql_where=sa.text('is_active'))
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    added = _add_missing_columns(inspector, tables)
+    _create_missing_tables(tables)
+
+    if 'duration_days' in added.get('tour_package', ()):
+        _backfill_duration_days()
+    if 'reserved_members' in added.get('tour_package', ()):
+        _backfill_reserved_members()
+    if 'unread_by_admin' in added.get('chat_sessions', ()):
+        _backfill_unread_by_admin()
+    if 'rating_sum' in added.get('agency_stats', ()) and 'agency_ratings' in tables:
+        _reconcile_agency_stats()
+    if 'chat_sessions' in tables:
+        _create_active_session_index(sa.inspect(op.get_bind()))
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'ux_chat_sessions_active_user' in {index['name'] for index in inspector.get_indexes('chat_sessions')}:
+        op.drop_index('ux_chat_sessions_active_user', table_name='chat_sessions')
+    op.drop_table('blobs')
+    for table, columns in NEW_COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in reversed(columns):
+                batch_op.drop_column(column.name)
@@ -0,0 +1,77 @@
+"""Index pack for the hot filters and joins
+
+Revision ID: 3f1c9a2b7d40
+Revises: 1a7c3e9f0b12
+Create Date: 2026-10-18 10:00:00.000000
+
+Databases created with db.create_all() before this revision lack most
+secondary indexes declared in models.py, so the upgrade also creates any
+earlier ones that are missing. Their columns, and the one-active-session
+unique index, come from 1a7c3e9f0b12. Indexes that already exist are
+skipped, and tables that do not exist yet are left to db.create_all().
+
+Booking cleanup (payment_status, created_at), Message.session_id (leading
+column of both messages indexes) and Coupon.code (unique constraint) are
+covered by indexes below or already in the schema.
+
+On PostgreSQL indexes are built CONCURRENTLY so bookings stay writable.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a2b7d40'
+down_revision = '1a7c3e9f0b12'
+branch_labels = None
+depends_on = None
+
+
+# Added by this revision; dropped again on downgrade
+NEW_INDEXES = [
+    ('ix_booking_package_status_created_at', 'booking', ['package_id', 'payment_status', 'created_at']),
+    ('ix_booking_user_status_created_at', 'booking', ['user_id', 'payment_status', 'created_at']),
+    ('ix_refund_booking_status', 'refund', ['booking_id', 'status']),
+    ('ix_custom_trips_status_start_date', 'custom_trips', ['status', 'start_date']),
+    ('ix_chat_sessions_user_active', 'chat_sessions', ['user_id', 'is_active']),
+    ('ix_chat_sessions_active_updated_at', 'chat_sessions', ['is_active', 'updated_at']),
+]
+
+# Declared in models.py by earlier changes but never migrated
+EXISTING_INDEXES = [
+    ('ix_tour_package_price_id', 'tour_package', ['price', 'id']),
+    ('ix_tour_package_duration_days_id', 'tour_package', ['duration_days', 'id']),
+    ('ix_booking_created_at_id', 'booking', ['created_at', 'id']),
+    ('ix_booking_status_created_at_id', 'booking', ['payment_status', 'created_at', 'id']),
+    ('ix_booking_method_created_at_id', 'booking', ['payment_method', 'created_at', 'id']),
+    ('ix_messages_session_admin_read', 'messages', ['session_id', 'is_admin_message', 'is_read']),
+    ('ix_messages_session_timestamp_id', 'messages', ['session_id', 'timestamp', 'id']),
+]
+
+
+def _existing(indexes):
+    """Names of the given indexes that are already in the database, and the tables that exist"""
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names()) & {table for _, table, _ in indexes}
+    names = {index['name'] for table in tables for index in inspector.get_indexes(table)}
+    return names, tables
+
+
+def upgrade():
+    names, tables = _existing(EXISTING_INDEXES + NEW_INDEXES)
+    missing = [(name, table, columns) for name, table, columns in EXISTING_INDEXES + NEW_INDEXES
+               if table in tables and name not in names]
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, columns in missing:
+                op.create_index(name, table, columns, postgresql_concurrently=True)
+    else:
+        for name, table, columns in missing:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    names, _ = _existing(NEW_INDEXES)
+    for name, table, _ in NEW_INDEXES:
+        if name in names:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,51 @@
+"""Coupon redemption limits
+
+Revision ID: 8d2e4b61c5a9
+Revises: 3f1c9a2b7d40
+Create Date: 2026-10-18 14:00:00.000000
+
+Adds the global and per-user caps to coupons, the redemption counter
+bumped by coupons.redeem_coupon, and the coupon_usages per-user counters.
+Existing coupons stay unlimited. Columns and tables that db.create_all()
+has already made are skipped.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4b61c5a9'
+down_revision = '3f1c9a2b7d40'
+branch_labels = None
+depends_on = None
+
+
+COUPON_COLUMNS = [
+    sa.Column('max_redemptions', sa.Integer(), nullable=True),
+    sa.Column('per_user_limit', sa.Integer(), nullable=True),
+    sa.Column('redemption_count', sa.Integer(), nullable=False, server_default='0'),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = {column['name'] for column in inspector.get_columns('coupons')}
+    with op.batch_alter_table('coupons') as batch_op:
+        for column in COUPON_COLUMNS:
+            if column.name not in existing:
+                batch_op.add_column(column)
+
+    if 'coupon_usages' not in inspector.get_table_names():
+        op.create_table(
+            'coupon_usages',
+            sa.Column('coupon_id', sa.Integer(), sa.ForeignKey('coupons.id'), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+            sa.Column('count', sa.Integer(), nullable=False, server_default='0'),
+        )
+
+
+def downgrade():
+    op.drop_table('coupon_usages')
+    with op.batch_alter_table('coupons') as batch_op:
+        for column in reversed(COUPON_COLUMNS):
+            batch_op.drop_column(column.name)
@@ -0,0 +1,46 @@
+"""64-bit chat message ids and leased writer worker ids
+
+Revision ID: c4f0d2a9e613
+Revises: 8d2e4b61c5a9
+Create Date: 2026-10-19 09:00:00.000000
+
+chat_writer.MessageIds hands out snowflake ids around 3.7e17, which do not
+fit the 32-bit messages.id of a baseline PostgreSQL or MySQL database.
+SQLite's INTEGER primary key is already 64-bit. worker_leases holds the
+per-process worker ids baked into those ids.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f0d2a9e613'
+down_revision = '8d2e4b61c5a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    id_type = next(column['type'] for column in inspector.get_columns('messages') if column['name'] == 'id')
+    if bind.dialect.name != 'sqlite' and not isinstance(id_type, sa.BigInteger):
+        op.alter_column('messages', 'id', type_=sa.BigInteger(), existing_type=sa.Integer(),
+                        existing_nullable=False, autoincrement=True)
+        if bind.dialect.name == 'postgresql':
+            op.execute("ALTER SEQUENCE IF EXISTS messages_id_seq AS BIGINT")
+
+    if 'worker_leases' not in inspector.get_table_names():
+        op.create_table(
+            'worker_leases',
+            sa.Column('name', sa.String(50), primary_key=True),
+            sa.Column('worker_id', sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column('holder', sa.String(100), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+        )
+
+
+def downgrade():
+    # messages.id stays 64-bit: existing snowflake ids would not fit back
+    op.drop_table('worker_leases')
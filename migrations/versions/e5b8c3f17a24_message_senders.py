@@ -0,0 +1,42 @@
+"""Store who sent each chat message
+
+Revision ID: e5b8c3f17a24
+Revises: c4f0d2a9e613
+Create Date: 2026-10-19 12:00:00.000000
+
+Chat history showed every admin message as 'Admin' while live emits carried
+the sending admin's username. messages.sender_id lets both use the same
+name. User messages are backfilled from their session's owner. Admin
+messages written before this revision cannot be attributed and stay NULL.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8c3f17a24'
+down_revision = 'c4f0d2a9e613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'sender_id' in {column['name'] for column in inspector.get_columns('messages')}:
+        return
+
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.add_column(sa.Column('sender_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_messages_sender_id_users', 'users', ['sender_id'], ['id'], ondelete='SET NULL')
+
+    messages = sa.table('messages', sa.column('session_id', sa.Integer), sa.column('sender_id', sa.Integer),
+                        sa.column('is_admin_message', sa.Boolean))
+    sessions = sa.table('chat_sessions', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer))
+    owner = sa.select(sessions.c.user_id).where(sessions.c.id == messages.c.session_id).scalar_subquery()
+    op.execute(messages.update().where(messages.c.is_admin_message.is_(False)).values(sender_id=owner))
+
+
+def downgrade():
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_constraint('fk_messages_sender_id_users', type_='foreignkey')
+        batch_op.drop_column('sender_id')
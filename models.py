@@ -1,11 +1,32 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 from datetime import datetime, timedelta
+import re
+
+from database import RoutingSession
+
+# RoutingSession sends read-only routes' SELECTs to the replica bind when one is configured
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Unpaid bookings hold their seats for this long before they expire
+PENDING_BOOKING_TTL = timedelta(hours=1)
+
+DURATION_PATTERN = re.compile(r'(\d+)\s*(w(?:ee)?ks?)?', re.IGNORECASE)
+
+def parse_duration_days(text):
+    """Turn free-text durations like '5 Days / 4 Nights' or '2 weeks' into a day count (0 if unknown)"""
+    match = DURATION_PATTERN.search(text or '')
+    if not match:
+        return 0
+    days = int(match.group(1))
+    return days * 7 if match.group(2) else days
 
-db = SQLAlchemy()
 class HomeImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(100), nullable=False)
+    image_variants = db.Column(db.JSON)  # [[width, filename], ...] written by images.ImagePipeline
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -24,16 +45,24 @@ class User(UserMixin, db.Model):
   #  profile_image = db.Column(db.String(150), nullable=True, default="default_profile.png")
    # profile_image = db.Column(db.String(200))
     image_file = db.Column(db.String(100), nullable=False, default='default.png')
+    image_variants = db.Column(db.JSON)  # [[width, filename], ...] written by images.ImagePipeline
 
 class TourPackage(db.Model):
+    __table_args__ = (
+        # Keyset pagination indexes for the search sort orders (see search.py)
+        db.Index('ix_tour_package_price_id', 'price', 'id'),
+        db.Index('ix_tour_package_duration_days_id', 'duration_days', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=False)
     price = db.Column(db.Float, nullable=False)
     location = db.Column(db.String(100), nullable=False)
     duration = db.Column(db.String(50))
+    duration_days = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Parsed from duration
     members = db.Column(db.Integer)               # Max members
     booked_members = db.Column(db.Integer, default=0)  
+    reserved_members = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Completed + live pending seats, see reservations.py
     facilities = db.Column(db.String(200))
     hotel_name = db.Column(db.String(100))
     room_type = db.Column(db.String(50))
@@ -41,29 +70,62 @@ class TourPackage(db.Model):
     transportation_details = db.Column(db.String(200))
     tour_type = db.Column(db.String(50))
     image_filename = db.Column(db.String(200))
+    image_variants = db.Column(db.JSON)  # [[width, filename], ...] written by images.ImagePipeline
 
     
+    @validates('duration')
+    def _sync_duration_days(self, key, value):
+        self.duration_days = parse_duration_days(value)
+        return value
+
+    @staticmethod
+    def reserved_seats_for(package_ids):
+        """Return {package_id: reserved seats} (completed + recent pending) in one grouped query"""
+        if not package_ids:
+            return {}
+
+        hold_start = datetime.utcnow() - PENDING_BOOKING_TTL
+        is_reserved = db.or_(
+            Booking.payment_status == 'Completed',
+            db.and_(Booking.payment_status == 'Pending', Booking.created_at >= hold_start)
+        )
+        rows = db.session.query(
+            Booking.package_id, db.func.coalesce(db.func.sum(Booking.members), 0)
+        ).filter(
+            Booking.package_id.in_(package_ids), is_reserved
+        ).group_by(Booking.package_id).all()
+        return {package_id: int(seats) for package_id, seats in rows}
+
+    @classmethod
+    def load_available_slots(cls, packages):
+        """Compute available_slots for a whole list of packages at once and cache it on each instance"""
+        reserved = cls.reserved_seats_for([p.id for p in packages])
+        for package in packages:
+            package._available_slots = package._slots_from_reserved(reserved.get(package.id, 0))
+        return packages
+
+    def _slots_from_reserved(self, reserved):
+        if self.members is None:
+            return 0
+        return max(self.members - reserved, 0)
+
     @property
     def available_slots(self):
         """Calculate remaining slots excluding completed bookings and recent pending bookings"""
+        cached = self.__dict__.get('_available_slots')
+        if cached is not None:
+            return cached
         if self.members is None:
             return 0
-        
-        
-        confirmed_bookings = sum(
-            booking.members for booking in self.bookings 
-            if booking.payment_status == 'Completed'
-        )
 
-        # Count pending bookings that are less than 1 hour old (updated from 1 hour)
-        one_hour_ago = datetime.utcnow() - timedelta(hours=1)  
-        recent_pending_bookings = sum(
-            booking.members for booking in self.bookings 
-            if booking.payment_status == 'Pending' and booking.created_at >= one_hour_ago
-        )
-        
-        # Available slots = total - (confirmed + recent pending)
-        return max(self.members - (confirmed_bookings + recent_pending_bookings), 0)
+        # Available slots = total - (confirmed + recent pending), summed in SQL
+        reserved = self.reserved_seats_for([self.id]).get(self.id, 0)
+        self._available_slots = self._slots_from_reserved(reserved)
+        return self._available_slots
+
+    def refresh_available_slots(self):
+        """Drop the cached slot count so the next access re-queries it"""
+        self.__dict__.pop('_available_slots', None)
 
     def adjust_booked_members_on_edit(self, new_max_members):
         """If max members reduced below booked_members, adjust booked_members."""
@@ -76,6 +138,16 @@ class TourPackage(db.Model):
         return members_requested <= self.available_slots
 
 class Booking(db.Model):
+    __table_args__ = (
+        # admin_bookings: newest-first keyset pagination, optionally filtered by status or method
+        db.Index('ix_booking_created_at_id', 'created_at', 'id'),
+        db.Index('ix_booking_status_created_at_id', 'payment_status', 'created_at', 'id'),
+        db.Index('ix_booking_method_created_at_id', 'payment_method', 'created_at', 'id'),
+        # reserved_seats_for / release_expired_holds: per-package sums over completed and live pending rows
+        db.Index('ix_booking_package_status_created_at', 'package_id', 'payment_status', 'created_at'),
+        # my_booked_packages: a user's bookings by status, newest first
+        db.Index('ix_booking_user_status_created_at', 'user_id', 'payment_status', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     package_id = db.Column(db.Integer, db.ForeignKey('tour_package.id'), nullable=True)
@@ -95,8 +167,18 @@ class Booking(db.Model):
     package = db.relationship('TourPackage', backref='bookings', lazy=True)
     custom_trip = db.relationship('CustomTrip', backref='bookings', lazy=True)
 
+    @staticmethod
+    def expired_clause():
+        """SQL predicate matching pending bookings whose hold has run out"""
+        expiration_time = datetime.utcnow() - PENDING_BOOKING_TTL
+        return db.and_(Booking.payment_status == 'Pending', Booking.created_at < expiration_time)
+
+    def is_expired(self):
+        """Check if a pending booking has expired (more than 1 hour old)"""
+        if self.payment_status != 'Pending':
+            return False
+        return self.created_at < datetime.utcnow() - PENDING_BOOKING_TTL
 
-    
     # In models.py, update the Booking model's can_request_refund method
     # In models.py, update the Booking model's can_request_refund method
     def can_request_refund(self):
@@ -118,6 +200,10 @@ class Booking(db.Model):
 
 class CustomTrip(db.Model):
     __tablename__ = 'custom_trips'
+    __table_args__ = (
+        # admin_custom_trips: filtered by status, ordered by start date
+        db.Index('ix_custom_trips_status_start_date', 'status', 'start_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -141,11 +227,22 @@ class CustomTrip(db.Model):
 
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
+    __table_args__ = (
+        # At most one active session per user; closed sessions are unrestricted
+        db.Index('ux_chat_sessions_active_user', 'user_id', unique=True,
+                 sqlite_where=db.text('is_active'), postgresql_where=db.text('is_active')),
+        # A user's sessions by state, on every backend (the partial index above only covers active ones)
+        db.Index('ix_chat_sessions_user_active', 'user_id', 'is_active'),
+        # admin_chat_manager inbox: active sessions, most recently updated first
+        db.Index('ix_chat_sessions_active_updated_at', 'is_active', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Denormalized count of user messages the admin has not read yet
+    unread_by_admin = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     # Relationships
     user = db.relationship('User', backref=db.backref('chat_sessions', lazy=True))
@@ -155,16 +252,132 @@ class ChatSession(db.Model):
         """Count unread messages. for_admin=True counts user's unread messages for admin."""
         return self.messages.filter_by(is_read=False, is_admin_message=not for_admin).count()
 
+    @classmethod
+    def active_id_for(cls, user_id):
+        """Return the id of the user's active session, creating it if needed (commits on create).
+
+        Creation is an insert-or-select: the unique partial index makes a
+        concurrent duplicate insert fail, and the loser reads the winner's row.
+        """
+        lookup = db.select(cls.id).where(cls.user_id == user_id, cls.is_active.is_(True))
+        session_id = db.session.execute(lookup).scalar()
+        if session_id is not None:
+            return session_id
+        try:
+            with db.session.begin_nested():
+                session = cls(user_id=user_id, is_active=True)
+                db.session.add(session)
+            db.session.commit()
+            return session.id
+        except IntegrityError:
+            return db.session.execute(lookup).scalar_one()
+
+    @staticmethod
+    def merge_duplicate_active():
+        """Fold extra active sessions per user into the oldest one (does not commit).
+
+        Needed once before the unique index can be created on existing data.
+        Returns the number of sessions removed.
+        """
+        duplicates = db.session.query(ChatSession.user_id, db.func.min(ChatSession.id)).filter(
+            ChatSession.is_active.is_(True)
+        ).group_by(ChatSession.user_id).having(db.func.count(ChatSession.id) > 1).all()
+
+        removed = 0
+        for user_id, keep_id in duplicates:
+            extra = db.session.query(ChatSession).filter(
+                ChatSession.user_id == user_id, ChatSession.is_active.is_(True), ChatSession.id != keep_id
+            ).all()
+            extra_ids = [s.id for s in extra]
+            Message.query.filter(Message.session_id.in_(extra_ids)).update(
+                {'session_id': keep_id}, synchronize_session=False
+            )
+            keep = db.session.get(ChatSession, keep_id)
+            keep.unread_by_admin += sum(s.unread_by_admin for s in extra)
+            keep.updated_at = max(s.updated_at for s in [keep] + extra if s.updated_at)
+            for session in extra:
+                db.session.delete(session)
+            removed += len(extra)
+        return removed
+
+    @staticmethod
+    def load_inbox(sessions, use_counter=False):
+        """Set unread_count and last_message on every session in two grouped queries at most.
+
+        With use_counter the unread counts come from the unread_by_admin column
+        and only the last-message lookup hits the messages table.
+        """
+        session_ids = [s.id for s in sessions]
+        if not session_ids:
+            return sessions
+
+        unread_of_user = db.and_(Message.is_admin_message.is_(False), Message.is_read.is_(False))
+        rows = db.session.query(
+            Message.session_id,
+            db.func.max(Message.id),
+            db.func.coalesce(db.func.sum(db.case((unread_of_user, 1), else_=0)), 0)
+        ).filter(Message.session_id.in_(session_ids)).group_by(Message.session_id).all()
+
+        last_ids = [last_id for _, last_id, _ in rows]
+        last_messages = {m.id: m for m in Message.query.filter(Message.id.in_(last_ids))} if last_ids else {}
+        summary = {session_id: (last_messages.get(last_id), int(unread)) for session_id, last_id, unread in rows}
+
+        for session in sessions:
+            last_message, unread = summary.get(session.id, (None, 0))
+            session.last_message = last_message
+            session.unread_count = session.unread_by_admin if use_counter else unread
+        return sessions
+
+    @staticmethod
+    def resync_unread_counters():
+        """Rebuild unread_by_admin for every session with one correlated UPDATE"""
+        unread = db.select(db.func.count(Message.id)).where(
+            Message.session_id == ChatSession.id,
+            Message.is_admin_message.is_(False),
+            Message.is_read.is_(False)
+        ).scalar_subquery()
+        db.session.execute(
+            db.update(ChatSession).values(unread_by_admin=unread).execution_options(synchronize_session=False)
+        )
+
 class Message(db.Model):
     __tablename__ = 'messages'
-    id = db.Column(db.Integer, primary_key=True)
+    __table_args__ = (
+        # Unread counts per session (admin_chat_manager inbox)
+        db.Index('ix_messages_session_admin_read', 'session_id', 'is_admin_message', 'is_read'),
+        # Newest-first history paging by (timestamp, id) cursor
+        db.Index('ix_messages_session_timestamp_id', 'session_id', 'timestamp', 'id'),
+    )
+    # Assigned by chat_writer.MessageIds (64-bit, time-ordered); plain INTEGER keeps the rowid alias on SQLite
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False)
     is_admin_message = db.Column(db.Boolean, default=False) # True if sender is admin
+    # Who sent it (which admin, for admin messages); NULL on messages from before the column existed
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
 
 
+class Blob(db.Model):
+    """A content-addressed upload in UPLOAD_FOLDER, see blobs.py"""
+    __tablename__ = 'blobs'
+    filename = db.Column(db.String(100), primary_key=True)  # <sha256 prefix><ext>
+    size = db.Column(db.Integer, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime, index=True)  # When ref_count last dropped to 0
+
+
+class WorkerLease(db.Model):
+    """A numbered slot (e.g. a chat writer worker id) held by one process until expires_at"""
+    __tablename__ = 'worker_leases'
+    name = db.Column(db.String(50), primary_key=True)
+    worker_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
 class AgencyRating(db.Model):
     __tablename__ = 'agency_ratings'
     id = db.Column(db.Integer, primary_key=True)
@@ -194,11 +407,90 @@ class RatingReplyForm(db.Model):
 
 class AgencyStats(db.Model):
     __tablename__ = 'agency_stats'
+    SINGLETON_ID = 1
     id = db.Column(db.Integer, primary_key=True)
     total_ratings = db.Column(db.Integer, default=0)
     average_rating = db.Column(db.Float, default=0.0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Per-star histogram
+    count_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    count_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    count_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    count_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    count_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  
 
+    @property
+    def histogram(self):
+        """[(stars, count), ...] from 5 stars down to 1"""
+        return [(stars, getattr(self, f'count_{stars}') or 0) for stars in range(5, 0, -1)]
+
+    @classmethod
+    def apply_rating_change(cls, old_rating=None, new_rating=None):
+        """Adjust the running totals for a new (None -> n), edited (m -> n) or deleted (m -> None) rating.
+
+        One atomic UPDATE, so concurrent submissions never lose an increment.
+        Does not commit; call it inside the transaction that changes the rating.
+        """
+        count_delta = (new_rating is not None) - (old_rating is not None)
+        sum_delta = (new_rating or 0) - (old_rating or 0)
+        if count_delta == 0 and sum_delta == 0:
+            return
+
+        new_total = cls.total_ratings + count_delta
+        new_sum = cls.rating_sum + sum_delta
+        values = {
+            'total_ratings': new_total,
+            'rating_sum': new_sum,
+            'average_rating': db.case((new_total > 0, db.cast(new_sum, db.Float) / new_total), else_=0.0),
+            'last_updated': datetime.utcnow(),
+        }
+        if old_rating is not None:
+            column = getattr(cls, f'count_{old_rating}')
+            values[column.key] = column - 1
+        if new_rating is not None:
+            column = getattr(cls, f'count_{new_rating}')
+            values[column.key] = column + 1
+
+        stats_id = cls.ensure_row()
+        db.session.execute(
+            db.update(cls).where(cls.id == stats_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def ensure_row(cls):
+        """Return the id of the single stats row, creating it if needed.
+
+        Creation is an insert-or-select on the fixed SINGLETON_ID, so two
+        first ratings racing each other cannot create two rows.
+        """
+        stats_id = db.session.query(cls.id).order_by(cls.id).limit(1).scalar()
+        if stats_id is not None:
+            return stats_id
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(id=cls.SINGLETON_ID, total_ratings=0, average_rating=0.0))
+        except IntegrityError:
+            pass  # Created concurrently; the other transaction's row has the same id
+        return cls.SINGLETON_ID
+
+    @classmethod
+    def reconcile(cls):
+        """Recompute every total from agency_ratings with a single SQL aggregate"""
+        columns = [db.func.count(AgencyRating.id), db.func.coalesce(db.func.sum(AgencyRating.rating), 0)]
+        columns += [db.func.coalesce(db.func.sum(db.case((AgencyRating.rating == stars, 1), else_=0)), 0)
+                    for stars in range(1, 6)]
+        total, rating_sum, *counts = db.session.query(*columns).one()
+
+        stats = db.session.get(cls, cls.ensure_row())
+        stats.total_ratings = total
+        stats.rating_sum = rating_sum
+        stats.average_rating = rating_sum / total if total else 0.0
+        for stars, count in zip(range(1, 6), counts):
+            setattr(stats, f'count_{stars}', count)
+        return stats
+
 class Coupon(db.Model):
     __tablename__ = 'coupons'
     id = db.Column(db.Integer, primary_key=True)
@@ -207,16 +499,34 @@ class Coupon(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=True)
+    max_redemptions = db.Column(db.Integer, nullable=True)  # None = unlimited
+    per_user_limit = db.Column(db.Integer, nullable=True)   # None = unlimited
+    # Bumped by coupons.redeem_coupon with a conditional UPDATE, never read-modify-write
+    redemption_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def is_valid(self):
         if not self.is_active:
             return False
         if self.expires_at and self.expires_at < datetime.utcnow():
             return False
+        if self.max_redemptions is not None and self.redemption_count >= self.max_redemptions:
+            return False
         return True  
+
+
+class CouponUsage(db.Model):
+    """How many times a user has redeemed a coupon, for Coupon.per_user_limit"""
+    __tablename__ = 'coupon_usages'
+    coupon_id = db.Column(db.Integer, db.ForeignKey('coupons.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
 
 class Refund(db.Model):
+    __table_args__ = (
+        # has_pending_refund: one lookup per booking row on the booking lists
+        db.Index('ix_refund_booking_status', 'booking_id', 'status'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=True)
     custom_trip_id = db.Column(db.Integer, db.ForeignKey('custom_trips.id'), nullable=True)
@@ -0,0 +1,52 @@
+"""Running CPU-bound work (password hashing, image resizing) off the event loop.
+
+Under eventlet or gevent a ThreadPoolExecutor's threads are monkey-patched
+green threads, so CPU-bound work on them still stalls the whole hub. The
+helpers here pick real OS threads for the Socket.IO async mode instead.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Socket.IO async mode -> pool kind that runs on real OS threads under it
+GREEN_POOLS = {'eventlet': 'eventlet', 'gevent': 'gevent', 'gevent_uwsgi': 'gevent'}
+
+
+def async_mode_of(app):
+    """The Socket.IO async mode the app actually runs in (resolved by SocketIO if it is set up)"""
+    socketio = app.extensions.get('socketio')
+    return getattr(socketio, 'async_mode', None) or app.config.get('SOCKETIO_ASYNC_MODE')
+
+
+def pool_kind(kind, async_mode=None):
+    """Resolve 'auto' to 'eventlet', 'gevent' or 'thread' for the async mode"""
+    if kind == 'auto':
+        return GREEN_POOLS.get(async_mode, 'thread')
+    if kind not in ('thread', 'process', 'eventlet', 'gevent'):
+        raise ValueError(f"Unknown worker pool '{kind}'")
+    return kind
+
+
+def make_runner(kind, workers, async_mode=None):
+    """Return run(fn, *args), which blocks the caller until fn has run on a pool of `workers`"""
+    kind = pool_kind(kind, async_mode)
+    if kind == 'eventlet':
+        from eventlet import tpool
+        tpool.set_num_threads(workers)
+        return tpool.execute
+    if kind == 'gevent':
+        from gevent.threadpool import ThreadPool
+        pool = ThreadPool(workers)
+        return lambda fn, *args: pool.apply(fn, args)
+    executor = (ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor)(workers)
+    return lambda fn, *args: executor.submit(fn, *args).result()
+
+
+def spawn_green(kind, fn, *args):
+    """Start fn(*args) on a green thread of the 'eventlet' or 'gevent' hub without waiting for it"""
+    if kind == 'eventlet':
+        import eventlet
+        eventlet.spawn_n(fn, *args)
+    elif kind == 'gevent':
+        import gevent
+        gevent.spawn(fn, *args)
+    else:
+        raise ValueError(f"'{kind}' has no green threads")
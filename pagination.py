@@ -0,0 +1,40 @@
+import base64
+import json
+from datetime import datetime
+
+from models import db
+
+
+def encode_cursor(*values):
+    """Pack the sort key of the last row on a page into an opaque URL-safe token"""
+    payload = [{'$dt': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor, size, types=None):
+    """Unpack a cursor made by encode_cursor(); None if it is missing or malformed.
+
+    `types` gives the expected type (or tuple of types) of each value, so a
+    tampered cursor cannot put a string where the query compares a number.
+    """
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(payload, list) or len(payload) != size:
+            return None
+        values = [datetime.fromisoformat(v['$dt']) if isinstance(v, dict) else v for v in payload]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if types is not None and not all(
+        isinstance(v, expected) and not isinstance(v, bool) for v, expected in zip(values, types)
+    ):
+        return None
+    return values
+
+
+def keyset_after(column, value, id_column, last_id, descending):
+    """Rows strictly after (value, last_id) in ORDER BY column, id (both asc or both desc)"""
+    if descending:
+        return db.or_(column < value, db.and_(column == value, id_column < last_id))
+    return db.or_(column > value, db.and_(column == value, id_column > last_id))
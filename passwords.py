@@ -0,0 +1,193 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+
+import bcrypt as _bcrypt
+
+from offload import async_mode_of, make_runner
+
+try:
+    import argon2
+except ImportError:  # argon2 hashing is optional (pip install argon2-cffi)
+    argon2 = None
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when too many hash operations are already queued"""
+
+
+class BcryptHasher:
+    name = 'bcrypt'
+
+    def __init__(self, rounds=12):
+        self.rounds = rounds
+
+    @staticmethod
+    def identify(hashed):
+        return hashed.startswith(('$2a$', '$2b$', '$2y$'))
+
+    def hash(self, password):
+        return _bcrypt.hashpw(password.encode('utf-8'), _bcrypt.gensalt(self.rounds)).decode('utf-8')
+
+    def verify(self, hashed, password):
+        return _bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        return int(hashed.split('$')[2]) != self.rounds
+
+
+class Argon2Hasher:
+    name = 'argon2'
+
+    def __init__(self, time_cost=3, memory_kib=65536, parallelism=1):
+        if argon2 is None:
+            raise RuntimeError("PASSWORD_HASH_ALGORITHM=argon2 needs argon2-cffi installed")
+        self._hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_kib, parallelism=parallelism)
+
+    @staticmethod
+    def identify(hashed):
+        return hashed.startswith('$argon2')
+
+    def hash(self, password):
+        return self._hasher.hash(password)
+
+    def verify(self, hashed, password):
+        try:
+            return self._hasher.verify(hashed, password)
+        except argon2.exceptions.VerificationError:
+            return False
+
+    def needs_rehash(self, hashed):
+        return self._hasher.check_needs_rehash(hashed)
+
+
+class ScryptHasher:
+    """hashlib.scrypt, stored as $scrypt$ln=<log2 N>,r=<r>,p=<p>$<salt>$<hash>"""
+    name = 'scrypt'
+
+    def __init__(self, log_n=15, r=8, p=1):
+        self.log_n, self.r, self.p = log_n, r, p
+
+    @staticmethod
+    def identify(hashed):
+        return hashed.startswith('$scrypt$')
+
+    @staticmethod
+    def _derive(password, salt, log_n, r, p):
+        n = 1 << log_n
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+    @staticmethod
+    def _parse(hashed):
+        _, _, params, salt, digest = hashed.split('$')
+        values = dict(item.split('=') for item in params.split(','))
+        return int(values['ln']), int(values['r']), int(values['p']), base64.b64decode(salt), base64.b64decode(digest)
+
+    def hash(self, password):
+        salt = os.urandom(16)
+        digest = self._derive(password, salt, self.log_n, self.r, self.p)
+        return (f"$scrypt$ln={self.log_n},r={self.r},p={self.p}"
+                f"${base64.b64encode(salt).decode()}${base64.b64encode(digest).decode()}")
+
+    def verify(self, hashed, password):
+        log_n, r, p, salt, digest = self._parse(hashed)
+        return hmac.compare_digest(self._derive(password, salt, log_n, r, p), digest)
+
+    def needs_rehash(self, hashed):
+        return self._parse(hashed)[:3] != (self.log_n, self.r, self.p)
+
+
+def make_hasher(algorithm, config):
+    if algorithm == 'bcrypt':
+        return BcryptHasher(config.get('PASSWORD_BCRYPT_ROUNDS', 12))
+    if algorithm == 'argon2':
+        return Argon2Hasher(config.get('PASSWORD_ARGON2_TIME_COST', 3),
+                            config.get('PASSWORD_ARGON2_MEMORY_KIB', 65536),
+                            config.get('PASSWORD_ARGON2_PARALLELISM', 1))
+    if algorithm == 'scrypt':
+        return ScryptHasher(config.get('PASSWORD_SCRYPT_LOG_N', 15),
+                            config.get('PASSWORD_SCRYPT_R', 8),
+                            config.get('PASSWORD_SCRYPT_P', 1))
+    raise ValueError(f"Unknown password hash algorithm '{algorithm}'")
+
+
+def _verify_with(hasher, hashed, password):
+    # Module-level so it can run in a process pool
+    return hasher.verify(hashed, password)
+
+
+def _hash_with(hasher, password):
+    return hasher.hash(password)
+
+
+class PasswordService:
+    """Hashes and verifies passwords off the request thread.
+
+    New hashes use PASSWORD_HASH_ALGORITHM with its configured cost; stored
+    hashes of any supported algorithm still verify, and verify() hands back
+    a fresh hash whenever the stored one uses other parameters so the caller
+    can upgrade it on login. Work runs on a pool of PASSWORD_HASH_WORKERS OS
+    threads (bcrypt, scrypt and argon2 release the GIL) or processes, see
+    offload.make_runner(), and at most PASSWORD_HASH_MAX_PENDING operations may wait
+    for it.
+    """
+
+    def __init__(self, app=None):
+        self.hasher = None
+        self._run_on_pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.hasher = make_hasher(config.get('PASSWORD_HASH_ALGORITHM', 'bcrypt'), config)
+        self._verifiers = {}
+        for algorithm in ('bcrypt', 'argon2', 'scrypt'):
+            try:
+                self._verifiers[algorithm] = make_hasher(algorithm, config)
+            except RuntimeError:
+                pass  # Optional library missing; such hashes cannot exist yet
+        self._verifiers[self.hasher.name] = self.hasher
+
+        workers = config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+        self._run_on_pool = make_runner(config.get('PASSWORD_HASH_POOL', 'auto'), workers, async_mode_of(app))
+        self._slots = threading.BoundedSemaphore(config.get('PASSWORD_HASH_MAX_PENDING', workers * 8))
+        self.timeout = config.get('PASSWORD_HASH_TIMEOUT', 10)
+        # Verified when the account does not exist, so response times do not reveal it
+        self._dummy_hash = self.hasher.hash(os.urandom(16).hex())
+        app.extensions['passwords'] = self
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHashingBusy("Password hashing queue is full")
+        try:
+            return self._run_on_pool(fn, *args)
+        finally:
+            self._slots.release()
+
+    def _hasher_for(self, hashed):
+        for hasher in self._verifiers.values():
+            if hasher.identify(hashed):
+                return hasher
+        return None
+
+    def hash(self, password):
+        return self._run(_hash_with, self.hasher, password)
+
+    def verify(self, hashed, password):
+        """Return (ok, new_hash); new_hash is set when the stored hash should be upgraded"""
+        hasher = self._hasher_for(hashed) if hashed else None
+        if hasher is None:
+            self._run(_verify_with, self.hasher, self._dummy_hash, password)
+            return False, None
+        if not self._run(_verify_with, hasher, hashed, password):
+            return False, None
+        if hasher is not self.hasher or self.hasher.needs_rehash(hashed):
+            return True, self.hash(password)
+        return True, None
+
+
+passwords = PasswordService()
@@ -0,0 +1,50 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app
+from sqlalchemy import event
+
+from models import db
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a view issues more SQL statements than its budget allows"""
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Collect every SQL statement the current thread runs inside the block"""
+    engine = engine or db.engine
+    thread_id = threading.get_ident()
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread_id:
+            statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def query_budget(max_queries):
+    """Fail a view that goes over max_queries when QUERY_BUDGET_ENFORCE (or TESTING) is on"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            config = current_app.config
+            if not (config.get('QUERY_BUDGET_ENFORCE') or config.get('TESTING')):
+                return view(*args, **kwargs)
+            with count_queries() as statements:
+                response = view(*args, **kwargs)
+            if len(statements) > max_queries:
+                raise QueryBudgetExceeded(
+                    f"{view.__name__} ran {len(statements)} queries (budget {max_queries}):\n"
+                    + "\n".join(statements)
+                )
+            return response
+        return wrapped
+    return decorator
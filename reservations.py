@@ -0,0 +1,135 @@
+from datetime import datetime
+
+from models import db, Booking, TourPackage, PENDING_BOOKING_TTL
+
+
+class SeatsUnavailable(Exception):
+    """Raised when a package does not have enough free seats for a reservation"""
+
+
+def _claim_seats(package_id, members):
+    """Atomically bump the package's seat counter if the seats still fit.
+
+    A single conditional UPDATE: the database serialises writers on the row,
+    so two requests can never both take the last seats.
+    """
+    result = db.session.execute(
+        db.update(TourPackage)
+        .where(
+            TourPackage.id == package_id,
+            TourPackage.members.isnot(None),
+            TourPackage.reserved_members + members <= TourPackage.members
+        )
+        .values(reserved_members=TourPackage.reserved_members + members)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def reserve_seats(package, members, user_id):
+    """Check-and-reserve seats on a package and create the pending Booking.
+
+    The fast path is one conditional UPDATE plus one INSERT in the same
+    transaction. Only when that fails are expired holds on this package
+    released and the claim retried once.
+    """
+    if members < 1:
+        raise SeatsUnavailable("At least one member is required.")
+
+    try:
+        claimed = _claim_seats(package.id, members)
+        if not claimed:
+            release_expired_holds(package.id, commit=False)
+            claimed = _claim_seats(package.id, members)
+        if not claimed:
+            db.session.rollback()
+            raise SeatsUnavailable(f"Not enough slots for {members} members.")
+
+        total_amount = package.price * members
+        booking = Booking(
+            user_id=user_id,
+            package_id=package.id,
+            members=members,
+            total_amount=total_amount,
+            final_amount=total_amount,
+            payment_status='Pending'
+        )
+        db.session.add(booking)
+        db.session.commit()
+    except SeatsUnavailable:
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+
+    package.refresh_available_slots()
+    return booking
+
+
+def _delete_expired(condition):
+    """Delete the bookings matching `condition`; returns (package_id, members) per removed row.
+
+    Only rows this call actually deleted are returned, so when two callers race for
+    the same expired holds (SQLite has no SELECT ... FOR UPDATE) each hold
+    is handed back exactly once.
+    """
+    if db.engine.dialect.delete_returning:
+        return db.session.execute(
+            db.delete(Booking).where(condition).returning(Booking.package_id, Booking.members)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+    candidates = db.session.query(Booking.id, Booking.package_id, Booking.members).filter(condition)
+    deleted = []
+    for booking_id, package_id, members in candidates.with_for_update().all():
+        removed = db.session.execute(
+            db.delete(Booking).where(Booking.id == booking_id, condition)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if removed == 1:
+            deleted.append((package_id, members))
+    return deleted
+
+
+def release_expired_holds(package_id=None, commit=True):
+    """Delete expired pending bookings and hand their seats back to the counters.
+
+    Seats are returned for the rows this call deleted, not the rows it saw,
+    so concurrent callers (the background purge and the retry in
+    reserve_seats) never return the same seats twice.
+    """
+    cutoff = datetime.utcnow() - PENDING_BOOKING_TTL
+    condition = db.and_(Booking.payment_status == 'Pending', Booking.created_at < cutoff)
+    if package_id is not None:
+        condition = db.and_(condition, Booking.package_id == package_id)
+    rows = _delete_expired(condition)
+
+    seats_by_package = {}
+    for pkg_id, members in rows:
+        if pkg_id is not None:
+            seats_by_package[pkg_id] = seats_by_package.get(pkg_id, 0) + members
+
+    for pkg_id, seats in seats_by_package.items():
+        db.session.execute(
+            db.update(TourPackage)
+            .where(TourPackage.id == pkg_id)
+            .values(reserved_members=db.case(
+                (TourPackage.reserved_members > seats, TourPackage.reserved_members - seats),
+                else_=0
+            ))
+            .execution_options(synchronize_session=False)
+        )
+
+    if commit:
+        db.session.commit()
+    return len(rows)
+
+
+def resync_reserved_members():
+    """Recompute every package's seat counter from the bookings table"""
+    packages = TourPackage.query.all()
+    reserved = TourPackage.reserved_seats_for([p.id for p in packages])
+    for package in packages:
+        package.reserved_members = reserved.get(package.id, 0)
+    db.session.commit()
+    return len(packages)
@@ -0,0 +1,177 @@
+import re
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from models import db, TourPackage, parse_duration_days
+from pagination import encode_cursor, decode_cursor, keyset_after
+
+# Sort key -> (column, descending). Every order is made total with the id column
+NUMBER = (int, float)
+SORT_OPTIONS = {
+    'newest': (TourPackage.id, True),
+    'price_asc': (TourPackage.price, False),
+    'price_desc': (TourPackage.price, True),
+    'duration_asc': (TourPackage.duration_days, False),
+    'duration_desc': (TourPackage.duration_days, True),
+}
+DEFAULT_SORT = 'newest'
+PAGE_SIZE = 12
+
+SearchPage = namedtuple('SearchPage', ['packages', 'next_cursor'])
+
+_fts_ready = None
+
+# Wildcards in user input are matched literally
+LIKE_SPECIAL = re.compile(r'[\\%_]')
+
+
+# =======================
+# Index maintenance
+# =======================
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS tour_package_fts USING fts5(
+        title, location, description, content='tour_package', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS tour_package_fts_ai AFTER INSERT ON tour_package BEGIN
+        INSERT INTO tour_package_fts(rowid, title, location, description)
+        VALUES (new.id, new.title, new.location, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tour_package_fts_ad AFTER DELETE ON tour_package BEGIN
+        INSERT INTO tour_package_fts(tour_package_fts, rowid, title, location, description)
+        VALUES ('delete', old.id, old.title, old.location, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tour_package_fts_au AFTER UPDATE ON tour_package BEGIN
+        INSERT INTO tour_package_fts(tour_package_fts, rowid, title, location, description)
+        VALUES ('delete', old.id, old.title, old.location, old.description);
+        INSERT INTO tour_package_fts(rowid, title, location, description)
+        VALUES (new.id, new.title, new.location, new.description);
+    END""",
+    "INSERT INTO tour_package_fts(tour_package_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS ix_tour_package_search_trgm ON tour_package
+        USING gin ((title || ' ' || location || ' ' || description) gin_trgm_ops)""",
+]
+
+
+def backfill_duration_days():
+    """Parse duration_days for packages written without the ORM validator (bulk inserts, old rows)"""
+    rows = db.session.query(TourPackage.id, TourPackage.duration).filter(TourPackage.duration_days == 0).all()
+    updates = [{'id': package_id, 'duration_days': parse_duration_days(duration)} for package_id, duration in rows]
+    updates = [row for row in updates if row['duration_days']]
+    if updates:
+        db.session.execute(db.update(TourPackage), updates)
+    return len(updates)
+
+
+def build_search_index():
+    """Create the full-text (SQLite FTS5) or trigram (Postgres) index over title, location and description"""
+    global _fts_ready
+    backfill_duration_days()
+    dialect = db.engine.dialect.name
+    statements = SQLITE_FTS_DDL if dialect == 'sqlite' else POSTGRES_TRGM_DDL if dialect == 'postgresql' else []
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+    _fts_ready = None
+    return dialect
+
+
+def _sqlite_fts_ready():
+    global _fts_ready
+    if _fts_ready is None:
+        _fts_ready = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tour_package_fts'")
+        ).first() is not None
+    return _fts_ready
+
+
+# =======================
+# Query building
+# =======================
+def _search_document():
+    # Must match the expression in ix_tour_package_search_trgm exactly
+    space = db.literal_column("' '")
+    return TourPackage.title + space + TourPackage.location + space + TourPackage.description
+
+
+def _text_filter(query_text):
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite' and _sqlite_fts_ready():
+        terms = re.findall(r'\w+', query_text)
+        if not terms:
+            return None
+        match = ' '.join(f'"{term}"*' for term in terms)
+        matching_ids = text(
+            "SELECT rowid FROM tour_package_fts WHERE tour_package_fts MATCH :match"
+        ).bindparams(match=match).columns(db.column('rowid', db.Integer))
+        return TourPackage.id.in_(matching_ids)
+    pattern = '%' + LIKE_SPECIAL.sub(r'\\\g<0>', query_text) + '%'
+    if dialect == 'postgresql':
+        return _search_document().ilike(pattern, escape='\\')
+    return TourPackage.location.ilike(pattern, escape='\\')
+
+
+def parse_range(value):
+    """'500-1000' -> (500.0, 1000.0), '1000+' -> (1000.0, None); (None, None) if malformed"""
+    if not value:
+        return None, None
+    try:
+        if value.endswith('+'):
+            return float(value[:-1]), None
+        low, high = value.split('-', 1)
+        return float(low), float(high)
+    except ValueError:
+        return None, None
+
+
+def search_packages(query_text=None, price_range=None, duration_range=None,
+                    sort=DEFAULT_SORT, after=None, limit=PAGE_SIZE):
+    """Filter, sort and keyset-paginate tour packages.
+
+    Returns a SearchPage with at most `limit` packages and the cursor for the
+    next page (None on the last page).
+    """
+    if sort not in SORT_OPTIONS:
+        sort = DEFAULT_SORT
+    column, descending = SORT_OPTIONS[sort]
+
+    query = TourPackage.query
+    if query_text and query_text.strip():
+        condition = _text_filter(query_text.strip())
+        if condition is not None:
+            query = query.filter(condition)
+
+    min_price, max_price = parse_range(price_range)
+    if min_price is not None:
+        query = query.filter(TourPackage.price >= min_price)
+    if max_price is not None:
+        query = query.filter(TourPackage.price <= max_price)
+
+    min_days, max_days = parse_range(duration_range)
+    if min_days is not None:
+        query = query.filter(TourPackage.duration_days >= min_days)
+    if max_days is not None:
+        query = query.filter(TourPackage.duration_days <= max_days)
+
+    position = decode_cursor(after, 2, (NUMBER, int))
+    if position:
+        value, last_id = position
+        if column is TourPackage.id:
+            query = query.filter(TourPackage.id < last_id if descending else TourPackage.id > last_id)
+        else:
+            query = query.filter(keyset_after(column, value, TourPackage.id, last_id, descending))
+
+    if column is TourPackage.id:
+        order = [TourPackage.id.desc() if descending else TourPackage.id.asc()]
+    else:
+        order = [column.desc(), TourPackage.id.desc()] if descending else [column.asc(), TourPackage.id.asc()]
+
+    rows = query.order_by(*order).limit(limit + 1).all()
+    packages = rows[:limit]
+    last = packages[-1] if packages else None
+    next_cursor = encode_cursor(getattr(last, column.key), last.id) if len(rows) > limit else None
+    return SearchPage(packages, next_cursor)
@@ -0,0 +1,74 @@
+// Incremental chat history: newest page is server-rendered, older pages are
+// fetched on demand and reconnecting clients only ask for what they missed.
+function initChatHistory(options) {
+    const container = document.getElementById('chat-messages');
+    const socket = options.socket;
+    const sessionId = options.sessionId;
+    let olderCursor = options.olderCursor;
+    // Message ids are 64-bit and arrive as strings; Numbers would round them
+    let lastSeenId = BigInt(options.lastSeenId || 0);
+    let connectedOnce = socket.connected;
+
+    const loadOlderButton = document.createElement('button');
+    loadOlderButton.type = 'button';
+    loadOlderButton.className = 'btn btn-sm btn-outline-secondary d-block mx-auto mb-3';
+    loadOlderButton.textContent = 'Load older messages';
+    container.prepend(loadOlderButton);
+
+    function updateLoadOlder() {
+        loadOlderButton.style.display = olderCursor ? '' : 'none';
+    }
+    updateLoadOlder();
+
+    loadOlderButton.addEventListener('click', function() {
+        loadOlderButton.disabled = true;
+        fetch(`${options.historyUrl}?before=${encodeURIComponent(olderCursor)}`)
+            .then(res => res.json())
+            .then(data => {
+                const previousHeight = container.scrollHeight;
+                const anchor = loadOlderButton.nextSibling;
+                data.messages.forEach(message => container.insertBefore(options.renderMessage(message), anchor));
+                olderCursor = data.older_cursor;
+                updateLoadOlder();
+                // Keep the viewport on the message the reader was looking at
+                container.scrollTop += container.scrollHeight - previousHeight;
+            })
+            .finally(() => { loadOlderButton.disabled = false; });
+    });
+
+    // Append a live message once, in id order; returns false for duplicates
+    function append(message) {
+        const messageId = BigInt(message.message_id);
+        if (message.session_id != sessionId || messageId <= lastSeenId) {
+            return false;
+        }
+        lastSeenId = messageId;
+        container.appendChild(options.renderMessage(message));
+        container.scrollTop = container.scrollHeight;
+        return true;
+    }
+
+    function requestDelta() {
+        socket.emit('sync_messages', { session_id: sessionId, last_seen_id: lastSeenId.toString() });
+    }
+
+    socket.on('connect', function() {
+        if (connectedOnce) {
+            requestDelta();
+        }
+        connectedOnce = true;
+    });
+
+    socket.on('messages_delta', function(data) {
+        if (data.session_id != sessionId) {
+            return;
+        }
+        data.messages.forEach(append);
+        // The server caps each delta; keep asking until we are caught up
+        if (data.messages.length) {
+            requestDelta();
+        }
+    });
+
+    return { append: append };
+}
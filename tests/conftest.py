@@ -0,0 +1,97 @@
+"""Shared fixtures: the app on a throwaway SQLite file, background jobs off.
+
+The environment has to be set before app.py is imported, since Config reads
+it at class definition time. A file (not :memory:) is used so that threads
+in the concurrency tests share one database.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+from flask.testing import FlaskClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}?timeout=30"
+os.environ['BOOKING_CLEANUP_ENABLED'] = '0'
+os.environ['BLOB_GC_ENABLED'] = '0'
+os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'
+os.environ['CACHE_BACKEND'] = 'memory'
+os.environ['PASSWORD_BCRYPT_ROUNDS'] = '4'
+
+from app import app as flask_app  # noqa: E402
+from cache import cache, MemoryBackend  # noqa: E402
+from chat_sessions import chat_sessions  # noqa: E402
+from coupons import coupon_index  # noqa: E402
+from identity import user_identity  # noqa: E402
+from models import db, User, TourPackage, Booking  # noqa: E402
+
+
+class FreshContextClient(FlaskClient):
+    """Runs every request in its own app context, as a server does.
+
+    The fixtures keep an app context open for the test body, and a request
+    pushed on top of it would reuse that context's `g`, so flask_login's
+    cached user and the g.agency_stats memo would leak between requests.
+    """
+
+    def open(self, *args, **kwargs):
+        with self.application.app_context():
+            return super().open(*args, **kwargs)
+
+
+def _reset_caches():
+    # Ids are reused after drop_all(), so nothing cached may survive a test
+    cache.backend = MemoryBackend()
+    user_identity.backend = MemoryBackend()
+    chat_sessions.backend = MemoryBackend()
+    coupon_index.invalidate()
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    flask_app.test_client_class = FreshContextClient
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        _reset_caches()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_user(username, is_admin=False):
+    user = User(username=username, email=f'{username}@example.com', password='x', is_admin=is_admin)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_package(title='Sundarbans', price=100.0, members=40, duration='3 days'):
+    package = TourPackage(title=title, description='-', price=price, location='Khulna',
+                          members=members, duration=duration)
+    db.session.add(package)
+    db.session.commit()
+    return package
+
+
+def make_booking(user, package, members=1, status='Pending'):
+    booking = Booking(user_id=user.id, package_id=package.id, members=members,
+                      total_amount=package.price * members, final_amount=package.price * members,
+                      payment_status=status)
+    db.session.add(booking)
+    db.session.commit()
+    return booking
+
+
+def login(client, user_id):
+    """Log the test client in as the user without going through the password form"""
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
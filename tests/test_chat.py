@@ -0,0 +1,68 @@
+from app import socketio
+from chat_sessions import chat_sessions
+from chat_writer import chat_writer
+from conftest import make_user, login
+from models import db, ChatSession, Message
+
+
+def test_history_names_senders_like_live_emits(app, client):
+    admin = make_user('support_ana', is_admin=True)
+    user = make_user('rahim')
+    session_id = ChatSession.active_id_for(user.id)
+    chat_writer.submit(session_id, False, 'Is the Sylhet trip still on?', sender_id=user.id)
+    chat_writer.submit(session_id, True, 'Yes, it leaves on Friday.', sender_id=admin.id)
+
+    login(client, user.id)
+    messages = client.get(f'/chat/{session_id}/messages').get_json()['messages']
+    assert [m['sender_name'] for m in messages] == ['rahim', 'support_ana']
+
+
+def test_sync_ignores_a_malformed_last_seen_id(app, client):
+    user = make_user('rahim')
+    session_id = ChatSession.active_id_for(user.id)
+    chat_writer.submit(session_id, False, 'Hello', sender_id=user.id)
+
+    login(client, user.id)
+    # Socket.IO handlers push their request context onto whatever app context is current
+    with app.app_context():
+        sio = socketio.test_client(app, flask_test_client=client)
+        assert sio.is_connected()
+        sio.emit('sync_messages', {'session_id': session_id, 'last_seen_id': 'not-a-number'})
+        assert not [event for event in sio.get_received() if event['name'] == 'messages_delta']
+
+        sio.emit('sync_messages', {'session_id': session_id, 'last_seen_id': '0'})
+        deltas = [event for event in sio.get_received() if event['name'] == 'messages_delta']
+        assert len(deltas) == 1 and deltas[0]['args'][0]['messages'][0]['content'] == 'Hello'
+        sio.disconnect()
+
+
+def test_admin_opens_a_users_chat(app, client):
+    admin = make_user('support_ana', is_admin=True)
+    user = make_user('rahim')
+    session_id = ChatSession.active_id_for(user.id)
+    chat_writer.submit(session_id, False, 'Is the Sylhet trip still on?', sender_id=user.id)
+
+    login(client, admin.id)
+    response = client.get(f'/admin/chat-manager?user_id={user.id}')
+    assert response.status_code == 200
+    assert 'Is the Sylhet trip still on?' in response.get_data(as_text=True)
+    db.session.expire_all()
+    assert db.session.get(ChatSession, session_id).unread_by_admin == 0
+
+
+def test_message_for_a_closed_cached_session_moves_to_the_active_one(app):
+    user = make_user('rahim')
+    closed_id = chat_sessions.active_session_id(user.id)
+    db.session.get(ChatSession, closed_id).is_active = False  # e.g. closed by another process
+    db.session.commit()
+
+    # The registry still hands out the cached id; the writer notices and reroutes
+    assert chat_sessions.active_session_id(user.id) == closed_id
+    chat_writer.submit(closed_id, False, 'Anyone there?', sender_id=user.id)
+    chat_writer.flush()
+
+    db.session.expire_all()
+    message = Message.query.filter_by(content='Anyone there?').one()
+    assert message.session_id != closed_id
+    assert db.session.get(ChatSession, message.session_id).is_active
+    assert chat_sessions.active_session_id(user.id) == message.session_id
@@ -0,0 +1,101 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import make_user, make_package, make_booking, login
+from coupons import redeem_for_booking, CouponUnavailable
+from models import db, Booking, Coupon, CouponUsage, TourPackage
+
+
+def _run_concurrently(fn, items, threads=16):
+    barrier = threading.Barrier(min(threads, len(items)))
+
+    def call(item):
+        try:
+            barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        return fn(item)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(call, items))
+
+
+def test_double_submit_redeems_once(app):
+    user = make_user('alice')
+    package = make_package()
+    booking = make_booking(user, package, members=2)
+    db.session.add(Coupon(code='ONCE', discount_percent=50))
+    db.session.commit()
+    booking_id, user_id, package_id = booking.id, user.id, package.id
+
+    def submit(_):
+        client = app.test_client()
+        login(client, user_id)
+        return client.post(f'/process-payment/{booking_id}', data={
+            'payment_method': 'card', 'transaction_id': 'tx-1', 'coupon_code': 'ONCE'
+        }).status_code
+
+    statuses = _run_concurrently(submit, range(8), threads=8)
+    assert all(status == 302 for status in statuses)
+
+    db.session.expire_all()
+    coupon = Coupon.query.filter_by(code='ONCE').one()
+    assert coupon.redemption_count == 1
+    assert CouponUsage.query.filter_by(coupon_id=coupon.id, user_id=user_id).one().count == 1
+    booking = db.session.get(Booking, booking_id)
+    assert booking.payment_status == 'Completed'
+    assert booking.coupon_code == 'ONCE'
+    assert db.session.get(TourPackage, package_id).booked_members == 2
+
+
+def test_global_and_per_user_caps_hold_under_contention(app):
+    users = [make_user(f'user_{i}') for i in range(5)]
+    package = make_package(members=1000)
+    bookings = [make_booking(users[i % len(users)], package) for i in range(60)]
+    db.session.add(Coupon(code='SPIKE', discount_percent=20, max_redemptions=10, per_user_limit=3))
+    db.session.commit()
+    booking_ids = [booking.id for booking in bookings]
+
+    def checkout(booking_id):
+        with app.app_context():
+            try:
+                booking = db.session.get(Booking, booking_id)
+                redeem_for_booking(booking, 'SPIKE', booking.user_id)
+                booking.payment_status = 'Completed'
+                db.session.commit()
+                return 'redeemed'
+            except CouponUnavailable:
+                db.session.rollback()
+                return 'refused'
+            finally:
+                db.session.remove()
+
+    outcomes = _run_concurrently(checkout, booking_ids)
+
+    db.session.expire_all()
+    coupon = Coupon.query.filter_by(code='SPIKE').one()
+    discounted = Booking.query.filter_by(coupon_code='SPIKE').count()
+    assert outcomes.count('redeemed') == discounted == coupon.redemption_count == 10
+    for usage in CouponUsage.query.filter_by(coupon_id=coupon.id):
+        assert usage.count <= 3
+        assert usage.count == Booking.query.filter_by(coupon_code='SPIKE', user_id=usage.user_id).count()
+
+
+def test_limit_added_later_counts_earlier_uses(app):
+    user = make_user('bob')
+    package = make_package()
+    bookings = [make_booking(user, package) for _ in range(3)]
+    db.session.add(Coupon(code='LATER', discount_percent=10))
+    db.session.commit()
+
+    for booking in bookings[:2]:
+        redeem_for_booking(booking, 'LATER', user.id)
+        db.session.commit()
+
+    Coupon.query.filter_by(code='LATER').one().per_user_limit = 2
+    db.session.commit()
+    with pytest.raises(CouponUnavailable):
+        redeem_for_booking(bookings[2], 'LATER', user.id)
+    db.session.rollback()
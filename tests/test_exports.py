@@ -0,0 +1,26 @@
+from conftest import make_user, make_package, make_booking, login
+from models import Booking
+
+
+def test_filtered_export_matching_nothing_is_just_the_header(app, client):
+    admin = make_user('admin', is_admin=True)
+    booking = make_booking(make_user('rahim'), make_package())
+
+    login(client, admin.id)
+    response = client.get(f'/admin/export/bookings?since_id={booking.id}')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    header = ','.join(column.name for column in Booking.__table__.columns)
+    assert response.get_data(as_text=True) == header + '\r\n'
+
+
+def test_export_writes_the_header_once(app, client):
+    admin = make_user('admin', is_admin=True)
+    user = make_user('rahim')
+    package = make_package()
+    bookings = [make_booking(user, package) for _ in range(3)]
+
+    login(client, admin.id)
+    lines = client.get('/admin/export/bookings').get_data(as_text=True).splitlines()
+    assert lines[0].startswith('id,')
+    assert [line.split(',', 1)[0] for line in lines[1:]] == [str(booking.id) for booking in bookings]
@@ -0,0 +1,76 @@
+"""Every @query_budget view, rendered against enough rows that a per-row query would show.
+
+With TESTING on, query_budget raises QueryBudgetExceeded (listing the
+statements) as soon as a view goes over its budget, and the test client
+propagates it.
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import make_user, make_package, make_booking, login
+from models import db, AgencyRating, CustomTrip, Refund, RatingReplyForm as RatingReplyModel
+
+STATUSES = ['Pending', 'Completed', 'Failed']
+METHODS = ['bkash', 'nagad', 'card']
+
+
+@pytest.fixture
+def admin_client(app, client):
+    admin = make_user('admin', is_admin=True)
+    users = [make_user(f'traveller_{i}') for i in range(6)]
+    packages = [make_package(title=f'Package {i}', duration=f'{i + 2} days') for i in range(3)]
+
+    trips = []
+    for i, user in enumerate(users):
+        trip = CustomTrip(user_id=user.id, destination=f'Place {i}', transport='Bus', hotel='Hotel',
+                          number_of_rooms=1, room_type='Double', start_date=date.today() + timedelta(days=i),
+                          end_date=date.today() + timedelta(days=i + 3), people=2,
+                          status=['Pending', 'Approved', 'Rejected'][i % 3], price=500.0)
+        db.session.add(trip)
+        trips.append(trip)
+    db.session.commit()
+
+    # More than one admin bookings page (ADMIN_BOOKINGS_PAGE_SIZE is 50)
+    bookings = []
+    for i in range(60):
+        booking = make_booking(users[i % len(users)], packages[i % len(packages)], members=1 + i % 3,
+                               status=STATUSES[i % len(STATUSES)])
+        booking.payment_method = METHODS[i % len(METHODS)]
+        bookings.append(booking)
+    db.session.commit()
+
+    for i, user in enumerate(users):
+        rating = AgencyRating(user_id=user.id, rating=1 + i % 5, feedback=f'Feedback {i}')
+        db.session.add(rating)
+        db.session.flush()
+        db.session.add(RatingReplyModel(rating_id=rating.id, user_id=admin.id, is_admin_reply=True, reply_text='Thanks'))
+        db.session.add(RatingReplyModel(rating_id=rating.id, user_id=user.id, reply_text='You are welcome'))
+        db.session.add(Refund(user_id=user.id, booking_id=bookings[i].id, amount=100.0, reason='Changed plans'))
+        db.session.add(Refund(user_id=user.id, custom_trip_id=trips[i].id, amount=200.0, reason='Cancelled'))
+    db.session.commit()
+
+    login(client, admin.id)
+    return client
+
+
+@pytest.mark.parametrize('url', [
+    '/dashboard',
+    '/admin/bookings',
+    '/admin/bookings?status=Completed&method=card',
+    '/admin/custom-trips',
+    '/admin/custom-trips?status=Approved',
+    '/manage-users',
+    '/admin/agency-feedback',
+    '/admin/refunds',
+])
+def test_view_stays_within_budget(admin_client, url):
+    response = admin_client.get(url)
+    assert response.status_code == 200
+
+
+def test_admin_bookings_next_page_stays_within_budget(admin_client):
+    first = admin_client.get('/admin/bookings')
+    assert first.status_code == 200
+    cursor = first.get_data(as_text=True).split('after=', 1)[1].split('"', 1)[0].split('&', 1)[0]
+    assert admin_client.get(f'/admin/bookings?after={cursor}').status_code == 200
@@ -0,0 +1,26 @@
+"""Production entry point.
+
+Each server process runs one async worker; processes share Socket.IO rooms
+through SOCKETIO_MESSAGE_QUEUE, so put several of them behind a load
+balancer with sticky sessions:
+
+    SOCKETIO_ASYNC_MODE=eventlet SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/1 \
+        gunicorn -k eventlet -w 1 -b 127.0.0.1:8001 wsgi:app
+
+(use -k gevent with SOCKETIO_ASYNC_MODE=gevent for gevent).
+"""
+import os
+
+# Green-thread libraries must patch the standard library before anything else is imported
+ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from app import app, socketio  # noqa: E402
+
+if __name__ == '__main__':
+    socketio.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 5000)))